@@ -1,10 +1,18 @@
 # python3 -m src/ptedit [-P] filename
+# python3 -m src/ptedit -e script [-o output] filename
+# python3 -m src/ptedit -e script [-j jobs] filename ...
+# python3 -m src/ptedit --replay trace [--baseline old.json] [--save new.json] filename
 
 import curses
 from curses import wrapper
 import argparse
+import json
+import locale
+import logging
+import sys
 
 from .controller import Controller
+from . import batch, session, tracing
 
 
 def main():
@@ -14,21 +22,108 @@ def main():
     )
     parser.add_argument('filename')
     parser.add_argument('-P', '--perftest', action='store_true', help="Performance test")
+    parser.add_argument('-p', '--progressive', action='store_true', help="Show the file while it loads")
+    parser.add_argument('-l', '--line', type=int, default=1, help="Start at line")
+    parser.add_argument(
+        '-T', '--trace', default='',
+        help=f"Comma-separated trace categories to log periodically: all,{','.join(tracing.categories)}"
+    )
+    parser.add_argument('--log', default='ptedit.log', help="Log file")
+    parser.add_argument(
+        '-e', '--script',
+        help="Apply an edit script (JSON actions or one command per line) without a screen and write the result"
+    )
+    parser.add_argument('-o', '--output', help="Where to write the edited file in script mode (default stdout)")
+    parser.add_argument('more', nargs='*', help="More files to edit in place with --script")
+    parser.add_argument('-j', '--jobs', type=int, help="Worker processes for editing several files (default one per core)")
+    parser.add_argument('--chunk', type=int, default=16, help="Files handed to a worker at a time")
+    parser.add_argument('--record', help="Record the keys of this session to a trace file for --replay")
+    parser.add_argument(
+        '--replay',
+        help="Replay a recorded trace on filename without a screen, reporting latency percentiles for each action"
+    )
+    parser.add_argument('--baseline', help="Compare --replay latencies with a previous --save, exiting 1 on regression")
+    parser.add_argument('--save', help="Save --replay latencies as JSON")
     args = parser.parse_args()
 
+    if args.more and not args.script:
+        parser.error("only --script mode can edit several files")
+    if args.script:
+        try:
+            script_commands = batch.parse_script(open(args.script).read())
+        except ValueError as e:
+            parser.error(f"{args.script}: {e}")
+        if args.more:
+            if args.output:
+                parser.error("several files are edited in place, so --output isn't allowed")
+            sys.exit(batch_main([args.filename, *args.more], script_commands, args.jobs, args.chunk))
+        if args.output:
+            with open(args.output, 'wb') as f:
+                batch.run_script(args.filename, script_commands, f)
+        else:
+            batch.run_script(args.filename, script_commands, sys.stdout.buffer)
+        return
+
+    # log to a file since the screen belongs to curses
+    logging.basicConfig(level=logging.INFO if args.trace else logging.WARNING, filename=args.log, filemode='w')
+    try:
+        tracing.enable(args.trace)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.replay:
+        try:
+            results = session.replay(args.replay, args.filename)
+        except ValueError as e:
+            parser.error(str(e))
+        print(session.report(results))
+        if args.save:
+            with open(args.save, 'w') as f:
+                f.write(json.dumps(results, indent=2) + '\n')
+        if args.baseline:
+            regressions = session.compare(results, json.load(open(args.baseline)))
+            for r in regressions:
+                print('REGRESSION', r, file=sys.stderr)
+            sys.exit(1 if regressions else 0)
+        return
+
+    # use the terminal's encoding so curses can show non-ascii characters
+    locale.setlocale(locale.LC_ALL, '')
+
     result = wrapper(main_loop, args)
     if result:
         print(result)
 
 
+def batch_main(fnames: list[str], script_commands: list[batch.Command], jobs: int | None, chunk: int) -> int:
+    """Edit files in parallel, streaming a line per file and finishing with the totals"""
+    totals = batch.Totals()
+    for result in batch.run_batch(fnames, script_commands, jobs, chunk):
+        totals.add(result)
+        if result.error:
+            print(f"{result.fname}: {result.error}", file=sys.stderr)
+        else:
+            print(f"{result.fname}: {result.size} -> {result.written} bytes")
+    print(totals.summary(), file=sys.stderr)
+    return 1 if totals.errors else 0
+
+
 def main_loop(stdscr: curses.window, args: argparse.Namespace):
-    ctrl = Controller(args.filename, stdscr)
+    line = max(args.line - 1, 0)
+    ctrl = Controller(args.filename, stdscr, args.progressive, line)
 
     if args.perftest:
         return ctrl.perftest()
-    else:
-        ctrl.interactive()
-        return None
+
+    recorder = None
+    if args.record:
+        scr = ctrl.dpy.scr
+        recorder = session.Recorder(args.record, args.filename, scr.height, scr.width, line)
+        ctrl.on_key = recorder.record
+    ctrl.interactive()
+    if recorder:
+        recorder.close()
+    return None
 
 if __name__ == "__main__":
     main()
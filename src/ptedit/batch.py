@@ -0,0 +1,198 @@
+# Apply a script of edits to files with no screen, for use in pipelines
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import partial
+import json
+import os
+import re
+from time import perf_counter
+from typing import BinaryIO, Callable, Iterator
+
+from .document import Document, MatchMode
+from .loader import open_document
+from .saver import write_atomic
+
+
+def moveto(doc: Document, k: int):
+    """Move to offset k from the start, clamped to the document"""
+    doc.set_point_start().move_point(k)
+
+
+def find(doc: Document, s: str) -> bool:
+    """Move after the next occurrence of s, or to the end if there isn't one"""
+    return doc.find_forward(s, MatchMode.EXACT_CASE)
+
+
+def substitute(doc: Document, old: str, new: str) -> int:
+    """Replace each occurrence of old after the point with new, returning how many we changed"""
+    n = 0
+    while doc.find_forward(old, MatchMode.EXACT_CASE):
+        doc.delete(-len(old))
+        doc.insert(new)
+        n += 1
+    return n
+
+
+# each command takes the document and a fixed list of int or str arguments
+Command = tuple[str, list[int | str]]
+
+commands: dict[str, tuple[Callable[..., object], tuple[type, ...]]] = {
+    'moveto': (moveto, (int,)),
+    'move': (Document.move_point, (int,)),
+    'start': (Document.set_point_start, ()),
+    'end': (Document.set_point_end, ()),
+    'insert': (Document.insert, (str,)),
+    'delete': (Document.delete, (int,)),
+    'replace': (Document.replace, (str,)),
+    'find': (find, (str,)),
+    'subst': (substitute, (str, str)),
+}
+
+# commands whose first argument is a search string, which can't be empty
+searches = {'find', 'subst'}
+
+# random_soak actions are [EditType, k, s] with EditType MOVE, INSERT, DELETE, REPLACE
+soak_commands = ['moveto', 'insert', 'delete', 'replace']
+
+# command language arguments are integers or JSON strings
+token = re.compile(r'\s*(-?\d+|"(?:[^"\\]|\\.)*")')
+
+
+def check(name: str, args: list[int | str], where: str) -> Command:
+    if name not in commands:
+        raise ValueError(f"{where}: unknown command {name!r}")
+    types = commands[name][1]
+    if len(args) != len(types) or not all(type(a) is t for a, t in zip(args, types)):
+        expected = ' '.join(t.__name__ for t in types) or 'no arguments'
+        raise ValueError(f"{where}: {name} expects {expected}, got {args!r}")
+    if name in searches and not args[0]:
+        raise ValueError(f"{where}: {name} can't search for an empty string")
+    return name, args
+
+
+def parse_json(script: str) -> list[Command]:
+    """
+    Parse a JSON list of actions, either [EditType, k, s] as generated by
+    tests/random_soak.py, or a command name followed by its arguments like ["subst", "old", "new"].
+    """
+    script_commands: list[Command] = []
+    for i, action in enumerate(json.loads(script)):
+        where = f"action {i}"
+        if not isinstance(action, list) or not action:
+            raise ValueError(f"{where}: expected a list, got {action!r}")
+        if type(action[0]) is int and len(action) == 3:
+            typ, k, s = action
+            if not 0 <= typ < len(soak_commands):
+                raise ValueError(f"{where}: unknown edit type {typ}")
+            name = soak_commands[typ]
+            script_commands.append(check(name, [s if commands[name][1][0] is str else k], where))
+        else:
+            script_commands.append(check(action[0], action[1:], where))
+    return script_commands
+
+
+def parse_commands(script: str) -> list[Command]:
+    """
+    Parse a script with a command per line, like 'subst "colour" "color"',
+    ignoring blank lines and comments starting with #.
+    """
+    script_commands: list[Command] = []
+    for i, line in enumerate(script.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        name, rest = (line.split(None, 1) + [''])[:2]
+        args: list[int | str] = []
+        pos = 0
+        while pos < len(rest) and (m := token.match(rest, pos)):
+            args.append(json.loads(m.group(1)))
+            pos = m.end()
+        if rest[pos:].strip():
+            raise ValueError(f"line {i}: can't parse {rest[pos:].strip()!r}")
+        script_commands.append(check(name, args, f"line {i}"))
+    return script_commands
+
+
+def parse_script(script: str) -> list[Command]:
+    """Parse either kind of script, telling them apart by JSON's leading ["""
+    return parse_json(script) if script.lstrip().startswith('[') else parse_commands(script)
+
+
+def apply_commands(doc: Document, script_commands: list[Command]) -> Document:
+    for name, args in script_commands:
+        commands[name][0](doc, *args)
+    return doc
+
+
+def run_script(fname: str, script_commands: list[Command], out: BinaryIO):
+    """Apply the commands to a file, streaming the result to out"""
+    doc = apply_commands(open_document(fname), script_commands)
+    doc.write(out)
+
+
+@dataclass
+class FileResult:
+    fname: str
+    size: int = 0           # bytes read and written
+    written: int = 0
+    error: str = ''
+
+
+def edit_file(script_commands: list[Command], fname: str) -> FileResult:
+    """
+    Apply the commands to a file in place, writing a temporary copy
+    and renaming it over the original so a failure leaves the file as it was.
+    Errors are reported in the result rather than raised so one bad file doesn't stop a batch.
+    """
+    try:
+        size = os.path.getsize(fname)
+        doc = apply_commands(open_document(fname), script_commands)
+        written = write_atomic(doc, fname)
+    except Exception as e:
+        return FileResult(fname, error=f"{type(e).__name__}: {e}")
+    return FileResult(fname, size, written)
+
+
+def edit_files(script_commands: list[Command], fnames: list[str]) -> list[FileResult]:
+    return [edit_file(script_commands, fname) for fname in fnames]
+
+
+def run_batch(
+        fnames: list[str], script_commands: list[Command], workers: int | None = None, chunk_size: int = 16
+    ) -> Iterator[FileResult]:
+    """
+    Edit many files in place, yielding results as they finish.
+    Each Document is independent, so we hand chunks of files to a pool of
+    worker processes (default one per core) to get past the GIL.
+    """
+    if workers == 1:
+        for fname in fnames:
+            yield edit_file(script_commands, fname)
+        return
+
+    job = partial(edit_files, script_commands)
+    with ProcessPoolExecutor(workers) as pool:
+        chunks = [fnames[i:i + chunk_size] for i in range(0, len(fnames), chunk_size)]
+        for future in as_completed([pool.submit(job, chunk) for chunk in chunks]):
+            yield from future.result()
+
+
+class Totals:
+    """Aggregate results from a batch, and the rate we processed them"""
+    def __init__(self):
+        self.start = perf_counter()
+        self.files = 0
+        self.errors = 0
+        self.bytes = 0
+
+    def add(self, result: FileResult):
+        self.files += 1
+        self.errors += bool(result.error)
+        self.bytes += result.size
+
+    def summary(self) -> str:
+        elapsed = max(perf_counter() - self.start, 1e-9)
+        return (
+            f"{self.files} files, {self.errors} errors, {self.bytes / 1e6:.1f}MB in {elapsed:.2f}s: "
+            f"{self.files / elapsed:.1f} files/s, {self.bytes / 1e6 / elapsed:.1f}MB/s"
+        )
@@ -7,19 +7,22 @@ from typing import Callable, Literal, cast
 import logging
 
 
-from .document import Document, Location
+from .document import Location
+from .loader import open_document
+from .saver import Saver
 from .editor import Editor
 from .display import Display
-from .screen import CursesScreen
-
-
-logging.basicConfig(level=logging.INFO, filename='ptedit.log', filemode='w')
+from .hexdisplay import HexDisplay
+from .highlighter import highlighter_for
+from .screen import CursesScreen, Screen
+from . import tracing
 
 
 class KeyMode(IntEnum):
     NORMAL = 0
     ISEARCH = 1
     META = 2
+    COUNT = 3
 
 
 # note curses won't see all control keys since zsh is intercepting some
@@ -57,7 +60,11 @@ def actionlist(actionable: Actionable) -> list[Action]:
 
 
 class Controller:
-    def __init__(self, fname: str, stdscr: curses.window):
+    def __init__(
+            self, fname: str, stdscr: curses.window | None, progressive: bool=False, line: int=0,
+            scr: Screen | None = None,
+        ):
+        """Edit fname on the curses window stdscr, or headless on scr for testing and replay"""
         self.mode = KeyMode.NORMAL
 
         # create missing file
@@ -67,14 +74,39 @@ class Controller:
         self.fname = fname
         self.change_count = 0
 
-        # use iso-8859-1 so that str <-> bytes is 1:1
-        self.doc = Document(open(fname, encoding='iso-8859-1').read())
+        self.doc = open_document(fname, progressive, line)
+        self.saver = Saver(fname)
         self.doc.watch(self.change_handler)
-        self.dpy = Display(self.doc, CursesScreen(stdscr), fname)
+        if scr is None:
+            assert stdscr is not None
+            scr = CursesScreen(stdscr)
+        # the text and hex views of the document share the screen
+        self.views: list[Display] = [
+            Display(self.doc, scr, fname, highlighter=highlighter_for(self.doc, fname)),
+            HexDisplay(self.doc, scr, fname),
+        ]
+        self.dpy = self.views[0]
         self.ed = Editor(self.doc, self.dpy)
-        self.getch = stdscr.getch
+        self.stdscr = stdscr
         self.active = True
-
+        # keys recorded by start_macro, see play_macro
+        self.macro: list[int | str] = []
+        self.recording = False
+        self.replaying = False
+        self.command_start = 0      # where the keys of the current command start in the macro
+        # a repeat count typed after C-u, see repeat_macro
+        self.count: int | None = None
+        # called with each key read from the terminal, e.g. by session.Recorder
+        self.on_key: Callable[[int | str], None] | None = None
+
+        if self.doc.loading and stdscr:
+            # poll for keys so we can keep loading in between
+            stdscr.timeout(50)
+
+        self.bind_keys()
+
+    def bind_keys(self):
+        """Map keys to actions for the current view"""
         # printable ascii keys insert themselves
         printable = {k: k for k in range(32,127)}
         ed = self.ed
@@ -104,6 +136,7 @@ class Controller:
                 ctrl('S'): [KeyMode.ISEARCH, ed.isearch_forward],
                 ctrl('R'): [KeyMode.ISEARCH, ed.isearch_backward],
                 ctrl('O'): ed.toggle_overwrite,
+                ctrl('U'): [KeyMode.COUNT, self.start_count],
                 **printable
             },
             # KeyMode.ISEARCH
@@ -126,6 +159,8 @@ class Controller:
 
                 ctrl('['): ed.clear_mark,
                 ord('a'): dpy.move_backward_page,
+                ord('h'): self.toggle_view,
+                ord('w'): dpy.toggle_wrap,
                 ord('b'): ed.move_backward_para,
                 ord('f'): ed.move_forward_para,
                 ord('e'): dpy.move_forward_page,
@@ -139,28 +174,141 @@ class Controller:
                 ord('K'): ed.copy_line,
                 ord('x'): ed.cut,
                 ord('v'): ed.paste,
+                ord('V'): ed.paste_previous,
                 ord('y'): ed.redo,
                 ord('z'): ed.undo,
-            }
+                ord('Z'): ed.revert,
+                ord('('): self.start_macro,
+                ord(')'): self.end_macro,
+                ord('r'): self.repeat_macro,
+                # M-0 .. M-9 jump to 0%, 10%, ... 90% of the way through the document
+                **{ord(str(d)): self._jump(d / 10) for d in range(10)},
+            },
+            # KeyMode.COUNT
+            # Digits after C-u make a repeat count, and any other key runs in NORMAL mode
+            {
+                'fallback': KeyMode.NORMAL,
+
+                **{ord(str(d)): self._digit(d) for d in range(10)},
+            },
         ]
 
+    def toggle_view(self):
+        """Switch between the text and hex views"""
+        self.dpy = self.views[1] if self.dpy is self.views[0] else self.views[0]
+        self.ed.pager = self.dpy
+        self.dpy.recenter()
+        self.bind_keys()
+
+    def start_macro(self):
+        self.macro = []
+        self.recording = True
+        self.dpy.show_message('Recording macro')
+
+    def end_macro(self):
+        if not self.recording:
+            self.dpy.show_message('Not recording', True)
+            return
+        self.recording = False
+        # drop the keys that ended recording
+        del self.macro[self.command_start:]
+        self.dpy.show_message(f'Recorded {len(self.macro)} keys')
+
+    def play_macro(self, count: int=1):
+        """
+        Replay the recorded keys count times.  We dispatch them in a tight loop,
+        settling the point after each key as paint would, but holding off autosave and
+        index repair until the end, and leave the caller to paint once when we're done.
+        """
+        if self.recording or self.replaying:
+            self.dpy.show_message(f"Can't play a macro while {'recording' if self.recording else 'replaying'}", True)
+            return
+        if not self.macro:
+            self.dpy.show_message('No macro', True)
+            return
+        generation = self.doc.generation
+        self.mode = KeyMode.NORMAL
+        self.replaying = True
+        for view in self.views:
+            view.defer_changes(True)
+        try:
+            for _ in range(count):
+                for key in self.macro:
+                    self.dispatch(key)
+                    self.dpy.settle()
+        finally:
+            self.replaying = False
+            for view in self.views:
+                view.defer_changes(False)
+        if self.doc.generation != generation:
+            # one autosave for the lot
+            self.autosave(0)
+
+    def repeat_macro(self):
+        """Play the macro as many times as a C-u count says, or once"""
+        if self.recording:
+            # like the keys that end recording, these aren't part of the macro
+            del self.macro[self.command_start:]
+        self.play_macro(self.count or 1)
+
+    def start_count(self):
+        self.count = None
+        self.dpy.show_message('Repeat count:')
+
+    def _digit(self, d: int) -> ActionFn:
+        def add_digit():
+            self.count = (self.count or 0) * 10 + d
+            self.dpy.show_message(f'Repeat count: {self.count}')
+        return add_digit
+
+    def _jump(self, fraction: float) -> ActionFn:
+        def move_to_fraction():
+            self.dpy.move_to_fraction(fraction)
+        return move_to_fraction
+
     def interactive(self):
         while self.active:
             self.dpy.paint(self.ed.mark)
+            tracing.periodic_summary()
             try:
-                key = self.getch()
-                logging.info(f'key ${key:02x}')
+                key = self.get_key()
+                if key is None:
+                    # timed out while loading, so append what we've read so far
+                    if self.doc.load():
+                        self.stdscr.timeout(-1)
+                    continue
+                logging.info('key %r', key)
+                if self.on_key:
+                    self.on_key(key)
                 self.dispatch(key)
             except KeyboardInterrupt:
                 self.quit()
 
+    def get_key(self) -> int | str | None:
+        """
+        Return the next ascii key or curses key code as an int, any other character as a str,
+        or None if we time out.  Keeping characters as str avoids confusing them with key codes.
+        """
+        try:
+            key = self.stdscr.get_wch()
+        except curses.error:
+            return None
+        return ord(key) if isinstance(key, str) and ord(key) < 128 else key
+
     def quit(self):
         self.autosave(0)
+        self.saver.close()
         self.active = False
 
     def save(self, suffix: str=''):
-        open(self.fname + suffix, 'w', encoding='iso-8859-1').write(self.doc.get_data())
-        self.doc.dirty = False
+        if suffix:
+            self.doc.load(wait=True)
+            with open(self.fname + suffix, 'wb') as f:
+                self.doc.write(f)
+            self.doc.dirty = False
+        else:
+            self.saver.save(self.doc)
+            self.doc.mark_saved()
 
     def autosave(self, interval: int=10):
         if interval:
@@ -171,7 +319,8 @@ class Controller:
             self.save('~')
 
     def change_handler(self, start: Location, end: Location):
-        self.autosave()
+        if not self.doc.loading and not self.replaying:
+            self.autosave()
 
     def perftest(self, max_time: float=1.0) -> str:
         self.ed.move_end()
@@ -181,28 +330,42 @@ class Controller:
         while time() - start < max_time:
             self.dpy.paint(self.ed.mark)
             frames += 1
-            logging.info(f'frame {frames}, pos {self.doc.get_point().position()}')
+            if tracing.paint.enabled:
+                tracing.paint.log('frame %d, pos %d', frames, self.doc.get_point().position())
             self.ed.insert(ord('a'))
             self.ed.move_backward_char()
             self.dpy.move_backward_line()
 
         cpf = self.doc.n_get_char_calls / frames
-        return f"Repainted {frames} frames, {cpf:.1f} chars/frame, in {time()-start:0.1}s"
+        result = f"Repainted {frames} frames, {cpf:.1f} chars/frame, in {time()-start:0.1}s"
+        return '\n'.join([result, tracing.summary()]).strip()
 
-    def dispatch(self, key: int):
-        """Handle an ascii keypress"""
+    def dispatch(self, key: int | str):
+        """Handle an ascii keypress or curses key code, or a non-ascii character"""
 
+        if self.mode == KeyMode.NORMAL and self.count is None:
+            self.command_start = len(self.macro)
+        # record the key first so the command can take back its own keys, see end_macro
+        if self.recording:
+            self.macro.append(key)
         actions: list[Action] = []
-        while True:
-            keymap = self.keymap[self.mode]
-            actions += actionlist(keymap.get(key))
-            if actions or 'fallback' not in keymap:
-                break
-            self._act(actionlist(keymap['fallback']))
+        keymap = self.keymap[self.mode]
+        if isinstance(key, str):
+            # printable non-ascii characters insert themselves, except as meta keys
+            if key.isprintable() and self.mode != KeyMode.META:
+                actions.append(ord(key))
+        else:
+            while True:
+                keymap = self.keymap[self.mode]
+                actions += actionlist(keymap.get(key))
+                if actions or 'fallback' not in keymap:
+                    break
+                self._act(actionlist(keymap['fallback']))
 
         if not actions:
             self.dpy.show_message(
-                f'No action for key ${key:02x} in {self.mode.name} mode',
+                f'No action for key {key!r} in {self.mode.name} mode' if isinstance(key, str)
+                else f'No action for key ${key:02x} in {self.mode.name} mode',
                 True
             )
 
@@ -210,6 +373,28 @@ class Controller:
 
         self._act(actions)
 
+        if self.mode == KeyMode.NORMAL:
+            # the command has finished, using up any count
+            self.count = None
+
+    def action_name(self, key: int | str) -> str:
+        """Name what a key does in the current mode, like isearch_forward or insert, for timing sessions"""
+        keymap = self.keymap[self.mode]
+        if isinstance(key, str):
+            actions: list[Action] = [ord(key)] if key.isprintable() and self.mode != KeyMode.META else []
+        else:
+            actions = actionlist(keymap.get(key))
+            if not actions and 'fallback' in keymap:
+                # the fallback drops back to NORMAL mode and tries again
+                actions = actionlist(self.keymap[KeyMode.NORMAL].get(key))
+        names = [action.__name__ for action in actions if callable(action)]
+        if names:
+            return names[-1]
+        if any(not isinstance(action, KeyMode) for action in actions):
+            return 'isearch_insert' if self.mode == KeyMode.ISEARCH else 'insert'
+        modes = [action for action in actions if isinstance(action, KeyMode)]
+        return modes[-1].name.lower() if modes else 'unbound'
+
     def _act(self, actions: list[Action]):
         for action in actions:
             if callable(action):
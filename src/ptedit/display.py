@@ -1,11 +1,53 @@
 # The layout engine for showing a document on screen
+from array import array
 from typing import TYPE_CHECKING
+from time import perf_counter
 import logging
 
 from .document import Document
 from .location import Location
-from .formatter import Formatter
-from .screen import Screen
+from .formatter import Formatter, NoWrapFormatter
+from .highlighter import Highlighter, Token
+from .screen import Screen, Span, reversed_attrs, style_attr
+from . import tracing
+
+
+# map formatted line markers to the glyph shown on screen
+glyphs = str.maketrans(
+    ''.join(map(chr, range(32))),
+    ' ^\\' + ' ' * 29
+)
+
+Row = tuple[str, bytes]      # glyphs and the attribute of each, see screen.REVERSE
+
+
+def changed_span(old: Row, new: Row) -> Span | None:
+    """Return the [start, end) columns that differ between two rows, or None if identical"""
+    if old == new:
+        return None
+    (a, a_attrs), (b, b_attrs) = old, new
+    n = len(b)
+    start, end = n, 0
+    # xor the rows as big integers, four bytes per column of text and one per attribute,
+    # to find the first and last difference
+    for x, bits in (
+            (int.from_bytes(a.encode('utf-32-be', 'surrogatepass')) ^ int.from_bytes(b.encode('utf-32-be', 'surrogatepass')), 32),
+            (int.from_bytes(a_attrs) ^ int.from_bytes(b_attrs), 8),
+        ):
+        if x:
+            start = min(start, n - (x.bit_length() + bits - 1) // bits)
+            end = max(end, n - ((x & -x).bit_length() - 1) // bits)
+    return start, end
+
+
+def reverse(attrs: bytes, spans: list[Span]) -> bytes:
+    """Return attrs with the [start, end) spans shown in reverse"""
+    if not spans:
+        return attrs
+    row = bytearray(attrs)
+    for start, end in spans:
+        row[start:end] = row[start:end].translate(reversed_attrs)
+    return bytes(row)
 
 
 class Display:
@@ -17,6 +59,7 @@ class Display:
             guard_rows: int=3,
             preferred_row: int=0,
             tab: int=4,
+            highlighter: Highlighter | None = None,
         ):
         self.scr = scr
         self.doc = doc
@@ -24,7 +67,10 @@ class Display:
         self.rows = self.scr.height - 1     # one for status
         self.cols = self.scr.width
 
+        self.tab = tab
         self.fmt = Formatter(self.doc, self.cols, self.rows//2, tab)
+        self.highlighter = highlighter      # syntax highlighting, if we know how for this file
+        self.blank = bytes(self.cols)       # attributes for an unhighlighted row
 
         # layout options
         self.guard_rows = guard_rows
@@ -33,18 +79,77 @@ class Display:
 
         self.preferred_col = 0          # last column that wasn't
         self.pin_preferred_col = False  # True if cursor should track preferred col
+        self.col_point: tuple[Location, int] | None = None  # point and generation when we set preferred_col
 
         self.message = ''
+        self.frame: list[Row] | None = None     # what's currently on screen, None forces a full repaint
+        self.frame_starts: list[int] = []       # document offset at the start of each row in frame
+        self.frame_generation = -1              # document generation when frame_starts was recorded
+        self.deferring = False                  # see defer_changes
         self.doc.watch(self.change_handler)
 
     def change_handler(self, start: Location, end: Location):
-        self.fmt.change_handler(start, end)
+        if self.deferring:
+            self.fmt.forget(start)
+        else:
+            self.fmt.change_handler(start, end)
+
+    def defer_changes(self, defer: bool):
+        """Bracket a burst of changes with no painting in between, like replaying a macro"""
+        self.deferring = defer
+
+    def settle(self):
+        """
+        Move the point to the preferred column after a line move, as paint would, without drawing anything.
+        Replaying keys calls this after each one so that they act just as they did when typed.
+        """
+        if not self.pin_preferred_col:
+            return
+        self.pin_preferred_col = False
+        if not self.doc.at_end():
+            self.fmt.scroll_to_point(self.preferred_col)
+            bol = self.doc.get_point()
+            _, col_map, _ = self.fmt.format_row()
+            self.doc.set_point(bol.move(self.fmt.offset_for_column(self.preferred_col, col_map)))
+        # the preferred column still holds here
+        self.col_point = (self.doc.get_point(), self.doc.generation)
+
+    def point_column(self) -> int:
+        """Return the point's column on screen, counting from the start of the line if we don't wrap"""
+        if self.doc.at_end():
+            return 0
+        self.fmt.scroll_to_point(None)
+        pt = self.doc.get_point()
+        self.fmt.clamp_to_bol()
+        bol = self.doc.get_point()
+        _, col_map, _ = self.fmt.format_row()
+        self.doc.set_point(pt)
+        return col_map[pt.distance_after(bol) or 0]
+
+    def track_column(self):
+        """
+        Line moves aim for the column the point was in when we last painted.
+        If it's moved since without a paint, say while replaying a macro, work out its column now.
+        """
+        if not self.pin_preferred_col and self.col_point != (self.doc.get_point(), self.doc.generation):
+            self.preferred_col = self.point_column()
 
     ### External interface begins
 
     def recenter(self):
         """Force point back to preferred row by invalidating sticky top"""
         self.preferred_top = None
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget what's on screen so the next paint redraws everything"""
+        self.frame = None
+
+    def toggle_wrap(self):
+        """Switch between wrapping long lines and scrolling them horizontally"""
+        cls = Formatter if isinstance(self.fmt, NoWrapFormatter) else NoWrapFormatter
+        self.fmt = cls(self.doc, self.cols, self.rows//2, self.tab)
+        self.recenter()
 
     def show_message(self, msg: str, warn: bool=False):
         self.message = msg
@@ -62,6 +167,7 @@ class Display:
             self.doc.move_point(-1)
 
     def move_forward_line(self):
+        self.track_column()
         self.fmt.clamp_to_bol()
         if not self.doc.at_end():
             self.fmt.bol_to_next_bol()
@@ -69,46 +175,62 @@ class Display:
             self.pin_preferred_col = True
 
     def move_backward_line(self):
+        self.track_column()
         self.fmt.clamp_to_bol()
         if not self.doc.at_start():
             self.fmt.bol_to_prev_bol()
             self.pin_preferred_col = True
 
     def move_forward_page(self):
+        self.track_column()
         self.fmt.clamp_to_bol()
         for _ in range(self.rows):
             self.fmt.bol_to_next_bol()
         self.pin_preferred_col = True
 
     def move_backward_page(self):
+        self.track_column()
         self.fmt.clamp_to_bol()
         for _ in range(self.rows):
             self.fmt.bol_to_prev_bol()
         self.pin_preferred_col = True
 
+    def move_to_fraction(self, fraction: float):
+        """Jump to the visual line a given fraction through the document"""
+        k = int(fraction * self.fmt.visual_line_count())
+        self.doc.set_point(self.fmt.visual_line_start(k))
+        self.recenter()
+
     def status_message(self, cursor: tuple[int, int]) -> str:
         if self.message:
             status = self.message
             self.message = ''
         else:
-            pt = self.doc.get_point()
-            doc_nl = self.doc.get_data().count('\n')
-            pt_nl = self.doc.get_data(None, pt).count('\n')
-            fname = ('*' if self.doc.dirty else '') + f'{self.fname}'
-            pt_pieces, all_pieces = self.doc.piece_counts()
-            pt_edits, all_edits = self.doc.edit_counts()
-            status = "  ".join([
-                f"{fname}",
-                f"xy {cursor[1]},{cursor[0]}",
-                f"ch ${ord(self.doc.get_char() or '\0'):02x}",
-                f"pos {pt.position()}/{len(self.doc)}",
-                f"lns {pt_nl}/{doc_nl}",
-                f"pcs {pt_pieces}/{all_pieces}",
-                f"eds {pt_edits}/{all_edits}",
-            ])
+            status = "  ".join(self.status_fields(cursor))
 
         return " " + status + " " * (self.cols - len(status))
 
+    def status_fields(self, cursor: tuple[int, int]) -> list[str]:
+        pt = self.doc.get_point()
+        if self.doc.loader:
+            # counting lines in a partial document is slow and meaningless
+            lines = f"load {self.doc.loader.progress:.0%}"
+        else:
+            pt_nl, doc_nl = self.doc.line_counts()
+            lines = f"lns {pt_nl}/{doc_nl}"
+        fname = ('*' if self.doc.dirty else '') + f'{self.fname}'
+        pt_pieces, all_pieces = self.doc.piece_counts()
+        pt_edits, all_edits = self.doc.edit_counts()
+        return [
+            f"{fname}",
+            f"xy {cursor[1]},{cursor[0]}",
+            f"ch ${ord(self.doc.get_char() or '\0'):02x}",
+            f"pos {pt.position()}/{len(self.doc)}",
+            lines,
+            f"pcs {pt_pieces}/{all_pieces}",
+            f"eds {pt_edits}/{all_edits}",
+        ]
+
     def find_top(self):
         """
         Move the point to the top left of the screen,
@@ -148,19 +270,22 @@ class Display:
         Paint the buffer to the screen, returning the new top-left location.
         Leaves point unchanged.
         """
-        _n0 = self.doc.n_get_char_calls
-
-        logging.info(f'paint top {len(self.fmt.bol_ladder)} bol')
+        trace = tracing.paint.enabled
+        t = perf_counter() if trace else 0.0
+        n0 = self.doc.n_get_char_calls
 
         original_pt = self.doc.get_point()
         at_end = self.doc.at_end()
 
+        self.fmt.scroll_to_point(self.preferred_col if self.pin_preferred_col and not at_end else None)
         self.find_top()         # move point to show at top-left of screen
 
-        _n = self.doc.n_get_char_calls - _n0
-        logging.info(f'paint glyphs {len(self.fmt.bol_ladder)} bol {_n} chars, top/pt {self.doc.get_point().position()}/{original_pt.position()}')
-
-        self.scr.clear()        # move cursor to 0,0
+        if trace:
+            t = tracing.paint.lap('find_top', t)
+            tracing.paint.count('find_top_chars', self.doc.n_get_char_calls - n0)
+            tracing.paint.log(
+                'top/pt %d/%d, %d bol', self.doc.get_point().position(), original_pt.position(), len(self.fmt.bol_ladder)
+            )
 
         cursor = (0,0)
 
@@ -174,17 +299,23 @@ class Display:
             mark_off = pt_off
 
         highlight = mark_off < 0
-
+        left = self.fmt.left    # column maps count from the start of the line, which might be scrolled off screen
+
+        top = start_pt
+        texts: list[str] = []
+        row_spans: list[list[Span]] = []
+        col_maps: list[array[int]] = []
+        starts: list[int] = []
+        row_pos = start_pos
         row = 0
         while row < self.rows:
-            line, col_map = self.fmt.format_line()
+            line, col_map, delta = self.fmt.format_row()
             pt = self.doc.get_point()
-            delta = len(col_map)
+            starts.append(row_pos)
+            row_pos += delta
             start_pt = pt
-            toggle_mark = -1
-            toggle_pt = -1
+            toggles: list[int] = []
             # found the point?
-            logging.info(f"delta {delta} pt_off {pt_off} end {self.doc.at_end()}")
             if 0 <= pt_off < delta:
                 # deferred move to preferred column?
                 if not at_end and self.pin_preferred_col:
@@ -193,46 +324,133 @@ class Display:
                     original_pt = original_pt.move(pt_off)
                     if not mark:
                         mark_off = pt_off
-                col = col_map[pt_off]
-                toggle_pt = col
+                col = col_map[pt_off] - left if pt_off < len(col_map) else self.cols
+                toggles.append(col)
                 cursor = (row, col)
 
             if 0 <= mark_off < delta:
-                # found the mark?
-                col = col_map[mark_off]
-                toggle_mark = col
+                # found the mark?  it might be off screen if we're not wrapping
+                toggles.append(col_map[mark_off] - left if mark_off < len(col_map) else self.cols)
 
             pt_off -= delta
             mark_off -= delta
 
-            for col, ch in enumerate(line):
-                if toggle_pt == col:
-                    highlight = not highlight
-                if toggle_mark == col:
-                    highlight = not highlight
-                match ch:
-                    case 1: ch = ord('^')
-                    case 2: ch = ord('\\')
-                    case _ if ch < 32: ch = ord(' ')
-                    case _: pass
-                self.scr.put(ch, highlight)
-
+            spans: list[Span] = []
+            col = 0
+            for toggle in sorted(min(max(toggle, 0), self.cols) for toggle in toggles):
+                if highlight and toggle > col:
+                    spans.append((col, toggle))
+                highlight = not highlight
+                col = toggle
+            if highlight and col < self.cols:
+                spans.append((col, self.cols))
+
+            texts.append(line.translate(glyphs))
+            row_spans.append(spans)
+            col_maps.append(col_map)
             row += 1
 
         self.doc.set_point(original_pt)
 
+        styles = self.style_rows(top, starts, row_pos, col_maps) if self.highlighter else [self.blank] * self.rows
+        frame: list[Row] = [(text, reverse(attrs, spans)) for text, attrs, spans in zip(texts, styles, row_spans)]
+
         if not self.pin_preferred_col:
-            self.preferred_col = cursor[1] if not self.doc.at_end() else 0
+            self.preferred_col = cursor[1] + self.fmt.left if not self.doc.at_end() else 0
         else:
             self.pin_preferred_col = False
+        self.col_point = (original_pt, self.doc.generation)
+
+        status = self.status_message(cursor)[:self.cols]
+        frame.append((status.translate(glyphs), reverse(self.blank[:len(status)], [(0, len(status))])))
+
+        if trace:
+            t = tracing.paint.lap('format', t)
 
-        status = self.status_message(cursor)
-        self.scr.move(self.rows, 0)
-        self.scr.puts(status, highlight=True)
+        self.scroll_frame(starts)
+        self.refresh_frame(frame)
 
         self.scr.move(*cursor)
         self.scr.refresh()
 
-        _n = self.doc.n_get_char_calls - _n - _n0
-        logging.info(f'paint end {len(self.fmt.bol_ladder)} bol {_n} chars')
+        if trace:
+            tracing.paint.lap('refresh', t)
+            tracing.paint.count('frames')
+            tracing.paint.count('chars', self.doc.n_get_char_calls - n0)
 
+    def style_rows(self, top: Location, starts: list[int], end: int, col_maps: list[array[int]]) -> list[bytes]:
+        """
+        Return the attributes showing the syntax styles of the rows starting at each offset in starts,
+        the first at location top, with column maps col_maps and the last ending at end
+        """
+        assert self.highlighter
+        runs: list[Token] = self.highlighter.runs(top, starts[0], end)
+        left = self.fmt.left
+
+        def column(col_map: array[int], off: int) -> int:
+            col = col_map[off] - left if off < len(col_map) else self.cols
+            return min(max(col, 0), self.cols)
+
+        rows: list[bytes] = []
+        i = 0
+        for k, (pos, col_map) in enumerate(zip(starts, col_maps)):
+            row_end = starts[k + 1] if k + 1 < len(starts) else end
+            while i < len(runs) and runs[i][1] <= pos:
+                i += 1
+            if i == len(runs) or runs[i][0] >= row_end:
+                rows.append(self.blank)
+                continue
+            attrs = bytearray(self.cols)
+            j = i
+            while j < len(runs) and runs[j][0] < row_end:
+                a, b, style = runs[j]
+                ca, cb = column(col_map, max(a, pos) - pos), column(col_map, min(b, row_end) - pos)
+                attrs[ca:cb] = bytes((style_attr(style),)) * (cb - ca)
+                j += 1
+            rows.append(bytes(attrs))
+        return rows
+
+    def scroll_frame(self, starts: list[int]):
+        """
+        If the rows starting at starts overlap what's on screen shifted by
+        a few lines, scroll the screen to match so that only the newly
+        exposed rows need painting.  Row offsets are only comparable while
+        the document is unchanged.
+        """
+        old_starts, self.frame_starts = self.frame_starts, starts
+        generation, self.frame_generation = self.frame_generation, self.doc.generation
+        if self.frame is None or generation != self.doc.generation or old_starts == starts:
+            return
+
+        if starts[0] in old_starts:
+            n = old_starts.index(starts[0])         # scroll up
+        elif old_starts[0] in starts:
+            n = -starts.index(old_starts[0])        # scroll down
+        else:
+            return
+        if not 0 < abs(n) <= self.rows // 2:
+            return
+
+        self.scr.scroll(0, self.rows, n)
+        blank: list[Row] = [(' ' * self.cols, self.blank)] * abs(n)
+        rows = self.frame[:self.rows]
+        self.frame[:self.rows] = rows[n:] + blank if n > 0 else blank + rows[:n]
+
+    def refresh_frame(self, frame: list[Row]):
+        """
+        Send the new frame to the screen, only touching the cells
+        which differ from what we last painted
+        """
+        if self.frame is None:
+            self.scr.clear()
+            self.frame = [(' ' * self.cols, self.blank)] * len(frame)
+
+        for row, (old, new) in enumerate(zip(self.frame, frame)):
+            span = changed_span(old, new)
+            if span is None:
+                continue
+            start, end = span
+            text, attrs = new
+            self.scr.put_row(row, text[start:end], attrs[start:end], start)
+
+        self.frame = frame
@@ -1,12 +1,15 @@
 
 from __future__ import annotations
-from typing import Callable, ParamSpec, TypeVar, Concatenate
+from typing import BinaryIO, Callable, ParamSpec, TypeVar, Concatenate, TYPE_CHECKING
 from enum import Enum
 
-from .piece import Piece, PrimaryPiece
+from .piece import Piece, PrimaryPiece, SecondaryPiece, SourcePiece, label_gap
 from .location import Location
 from .edit import Edit
 
+if TYPE_CHECKING:
+    from .loader import Loader
+
 
 whitespace = ' \t\n'
 
@@ -37,6 +40,8 @@ R = TypeVar('R')    # Represents the return type of the decorated function
 
 def mutator(method: Callable[Concatenate[Document, P], R]) -> Callable[Concatenate[Document, P], R]:
     def wrapped(self: Document, *args: P.args, **kwargs: P.kwargs) -> R:
+        # edits can only be stacked on the complete source
+        self.load(wait=True)
         retval = method(self, *args, **kwargs)
         self.notify_watchers()
         return retval
@@ -47,31 +52,88 @@ Watcher = Callable[[Location,Location],None]
 
 
 class Document:
-    def __init__(self, s: str=''):
+    def __init__(self, s: str | bytes=''):
+        """Create a document from text, or raw utf-8 bytes which are decoded on demand"""
         self._watchers: list[Watcher] = []
 
         # Create sentinel pieces at the ends of the chain
         # These are the only Pieces that are empty
         self._start: Piece = PrimaryPiece(allow_empty=True)
         self._end: Piece = PrimaryPiece(allow_empty=True)
+        self._start.live = self._end.live = True
+        self._end.label = label_gap
         self.dirty = False
         self._n_get_char_calls = 0  # for performance testing
+        self.generation = 0         # counts changes, so caches can tell if they're stale
+        self._undone: Edit | None = None     # set when the latest change was an undo
+        self._span: tuple[Location, Location] | None = None     # the range changed by undo_to or redo_to
+        self.loader: Loader | None = None     # fetches the rest of the source when opened progressively
         self._reset(s)
+        self._saved = self._edit    # the edit matching the file as last saved
 
-    def _reset(self, s: str):
+    def _reset(self, s: str | bytes):
+        if self._start.next is not None and self._start.next is not self._end:
+            Piece.retire(self._start.next, self._end.prev)
         Piece.link(self._start, self._end)
         self._edit = Edit.create(Location(self._end), insert=s)
+        self._source_size = len(s) if isinstance(s, bytes) else 0     # bytes of the source file so far
         self.set_point_start()
 
     def watch(self, watcher: Watcher):
         self._watchers.append(watcher)
 
     def notify_watchers(self):
-        self.dirty = True
-        start, end = (self._edit.get_change_start(), self._edit.get_change_end())
+        # saved edits are sealed, so we're back in the saved state only if it's the latest edit
+        self.dirty = self._edit is not self._saved
+        self.generation += 1
+        if self._span:
+            start, end = self._span
+        else:
+            # after an undo the change is described by the edit we just undid
+            edit = self._undone or self._edit
+            start, end = (edit.get_change_start(), edit.get_change_end())
+        self._undone = self._span = None
         for watcher in self._watchers:
             watcher(start, end)
 
+    @property
+    def loading(self) -> bool:
+        return self.loader is not None
+
+    def load(self, wait: bool = False) -> bool:
+        """
+        Append any source text the loader has read so far, or all of it if wait.
+        Returns True once the whole source is loaded.
+        """
+        if self.loader is None:
+            return True
+        for s in self.loader.chunks(wait):
+            self._append_source(s)
+        if self.loader.done:
+            self.loader = None
+        return self.loader is None
+
+    def _append_source(self, s: bytes):
+        """
+        Add more source text at the end of the document.
+        This isn't an edit so it can't be undone and doesn't make the document dirty,
+        which is only safe before any edits have been made.
+        Watchers can tell an append from an edit since we're still loading.
+        """
+        assert self._edit.prev is None and self._edit.next is None, "can't extend the source after editing"
+        if not s:
+            return
+        last = self._end.prev
+        assert last is not None
+        p = SourcePiece(raw=s, offset=self._source_size)
+        self._source_size += len(s)
+        Piece.link(last, p)
+        Piece.link(p, self._end)
+        Piece.splice(p, p)
+        self.generation += 1
+        for watcher in self._watchers:
+            watcher(Location(p), Location(self._end))
+
     @mutator
     def squash(self):
         self._reset(self.get_data())
@@ -84,12 +146,31 @@ class Document:
 
     def __len__(self) -> int:
         """count the number of characters in the document"""
-        return len(self.get_data())
+        return Location(self._end).position()
 
     def piece_counts(self) -> tuple[int, int]:
         """Count pieces to point and in full doc for extended status"""
         return self._point.chain_length(), Location(self._end).chain_length()
 
+    def line_counts(self) -> tuple[int, int]:
+        """
+        Count newlines to point and in full doc for extended status.
+        Like piece_counts this walks the chain, but source pieces count their newlines from an index
+        rather than scanning the text.
+        """
+        p, offset = self._point.tuple()
+        src, start = p.ref()
+        within = src.count_newlines(start, start + offset)     # in p before the point
+        before = after = 0
+        q: Piece | None = p
+        while (q := q.prev) is not None:
+            before += q.newlines()
+        q = p
+        while q is not None:
+            after += q.newlines()
+            q = q.next
+        return before + within, before + after
+
     def edit_counts(self) -> tuple[int, int]:
         """Count active edits and total (including undone) edits for extended status"""
         edit = self._edit
@@ -100,6 +181,11 @@ class Document:
     def get_point(self) -> Location:
         return self._point
 
+    def get_start(self) -> Location:
+        """Return the location of the start of the document"""
+        assert self._start.next is not None
+        return Location(self._start.next)
+
     def set_point(self, loc: Location) -> Document:
         self._point = loc
         return self
@@ -130,14 +216,152 @@ class Document:
         s += p.data[offset:q_offset]
         return s
 
+    def get_pieces(self, start: Location, end: Location) -> list[SecondaryPiece]:
+        """
+        Like get_data, but return unlinked pieces that share the text rather than copying it,
+        so a clip costs memory per piece however long it is.  Runs of the same primary
+        piece are merged, and the primaries are marked shared so that later edits won't trim them.
+        """
+        p, offset = start.tuple()
+        q, q_offset = end.tuple()
+        pieces: list[SecondaryPiece] = []
+        while True:
+            stop = q_offset if p is q else len(p)
+            if offset < stop:
+                src, base = p.ref()
+                src.shared = True
+                base, n = base + offset, stop - offset
+                if pieces and pieces[-1].ref() == (src, base - len(pieces[-1])):
+                    # extend the previous run
+                    base, n = base - len(pieces[-1]), n + len(pieces.pop())
+                pieces.append(SecondaryPiece(source=src, start=base, length=n))
+            if p is q or p.next is None:
+                return pieces
+            p, offset = p.next, 0
+
+    def write(self, f: BinaryIO, start: int = 0, copy: Callable[[int, int], bool] | None = None):
+        """
+        Write the encoded document, or its bytes from offset start on, to a binary file a piece at a time.
+        If given, copy(offset, n) is offered the n bytes of each source piece, from offset in the
+        source file, and returns True if it wrote them itself, say straight from that file.
+        """
+        assert self._start.next is not None
+        p = self._start.next
+        skip = 0        # bytes of p before start
+        while start > 0 and p.next is not None:
+            _, a, b = p.byte_span()
+            if start < b - a:
+                skip = start
+                break
+            start -= b - a
+            p = p.next
+        while p.next is not None:
+            src, _ = p.ref()
+            if skip or copy and isinstance(src, SourcePiece):
+                _, a, b = p.byte_span()
+                a += skip
+                skip = 0
+                if not (copy and isinstance(src, SourcePiece) and copy(src.offset + a, b - a)):
+                    f.write(src.byte_slice(a, b))
+            else:
+                f.write(p.encode())
+            p = p.next
+
+    def source_prefix(self) -> int:
+        """
+        Return how many leading bytes of the encoded document are still source bytes
+        at their original offsets, which a file holding the source already has.
+        """
+        n = 0
+        p = self._start
+        while (p := p.next) is not None:
+            src, start, end = p.byte_span()
+            if not isinstance(src, SourcePiece) or src.offset + start != n:
+                break
+            n += end - start
+        return n
+
+    ### Addressing the encoded document by byte, a piece walk like Location.position
+
+    def byte_length(self) -> int:
+        """Count the bytes in the encoded document"""
+        n = 0
+        p = self._start
+        while (p := p.next) is not None:
+            _, start, end = p.byte_span()
+            n += end - start
+        return n
+
+    def byte_position(self, loc: Location) -> int:
+        """Return the offset in the encoded document of the start of the character at loc"""
+        p, offset = loc.tuple()
+        src, start = p.ref()
+        n = src.byte_offset(start + offset) - src.byte_offset(start)
+        while (p := p.prev) is not None:
+            _, start, end = p.byte_span()
+            n += end - start
+        return n
+
+    def byte_location(self, b: int) -> Location:
+        """Return the location of the character containing byte b of the encoded document, or the end"""
+        assert self._start.next is not None
+        p = self._start.next
+        while p.next is not None:
+            src, start, end = p.byte_span()
+            if b < end - start:
+                return Location(p, src.char_offset(start + b) - p.ref()[1])
+            b -= end - start
+            p = p.next
+        return Location(p)
+
+    def get_bytes(self, b: int, n: int) -> bytes:
+        """Return up to n bytes of the encoded document starting at byte b"""
+        parts: list[bytes] = []
+        p = self._start
+        while n > 0 and (p := p.next) is not None:
+            src, start, end = p.byte_span()
+            if b < end - start:
+                data = src.byte_slice(start + b, min(start + b + n, end))
+                parts.append(data)
+                n -= len(data)
+                b = 0
+            else:
+                b -= end - start
+        return b''.join(parts)
+
     def get_char(self) -> str:
         """Return character after point, without moving point"""
         self._n_get_char_calls += 1
         offset = self._point.offset
-        return self._point.piece.data[offset:offset+1] or '\0'
+        return self._point.piece.slice(offset, offset+1) or '\0'
+
+    def get_chunk(self, n: int) -> str:
+        """
+        Return up to n characters after point, without moving point.
+        The chunk comes from a single piece so it may be shorter than n,
+        and is only empty at the end of the document.
+        """
+        p, offset = self._point.tuple()
+        s = p.slice(offset, offset + n)
+        self._n_get_char_calls += len(s)
+        return s
+
+    def get_chunk_before(self, n: int) -> str:
+        """
+        Return up to n characters before point, without moving point.
+        Like get_chunk, the chunk comes from a single piece and is only empty at the start.
+        """
+        p, offset = self._point.tuple()
+        if not offset:
+            assert p.prev is not None
+            p, offset = p.prev, len(p.prev)
+        s = p.slice(max(offset - n, 0), offset)
+        self._n_get_char_calls += len(s)
+        return s
 
     @property
     def n_get_char_calls(self) -> int:
+        """Number of characters scanned (for performance testing)"""
         return self._n_get_char_calls
 
     def next_char(self) -> str:
@@ -155,13 +379,17 @@ class Document:
         """
         move point before the first occurrence of a char in chars
         so need move_point(1) to do repeated searches
+        Like find_char_backward we scan growing chunks, leaving the point at the end if there's no match.
         """
-        match = False
-        while not match and not self.at_end():
-            match = self.next_char() in chars
-        if match:
-            self.move_point(-1)
-        return match
+        size = 64
+        while chunk := self.get_chunk(size):
+            i = min((j for c in chars if (j := chunk.find(c)) >= 0), default=-1)
+            if i >= 0:
+                self.move_point(i)
+                return True
+            self.move_point(len(chunk))
+            size = min(size * 2, 4096)
+        return False
 
     def find_not_char_forward(self, chars: str) -> bool:
         """
@@ -175,18 +403,28 @@ class Document:
             self.move_point(-1)
         return match
 
-    def find_char_backward(self, chars: str) -> bool:
+    def find_char_backward(self, chars: str, limit: int | None = None) -> bool:
         """
         move point *after* the first occurrence of a char in chars
         so need move_point(-1) to do repeated searches
         see 9.13.4.1 Moving by Words
+        If limit is given, give up after looking back that many characters,
+        leaving the point where we stopped.
+        We scan chunks that grow as we go since this is used to find the start
+        of lines which are usually short but might be very long.
         """
-        match = False
-        while not match and not self.at_start():
-            match = self.prev_char() in chars
-        if match:
-            self.move_point(1)
-        return match
+        n = 0
+        size = 64
+        while not self.at_start() and (limit is None or n < limit):
+            chunk = self.get_chunk_before(size if limit is None else min(limit - n, size))
+            i = max(chunk.rfind(c) for c in chars)
+            if i >= 0:
+                self.move_point(i + 1 - len(chunk))
+                return True
+            self.move_point(-len(chunk))
+            n += len(chunk)
+            size = min(size * 2, 4096)
+        return False
 
     def find_not_char_backward(self, chars: str) -> bool:
         """
@@ -208,6 +446,9 @@ class Document:
         """
         assert len(pattern) != 0, "find_forward: expected non-empty string"
 
+        if mode == MatchMode.EXACT_CASE:
+            return self._find_exact_forward(pattern)
+
         pt = self.get_point()
         match = False
         while not match and not pt.is_end():
@@ -219,6 +460,22 @@ class Document:
                     break
         return match
 
+    def _find_exact_forward(self, pattern: str) -> bool:
+        """
+        Search a chunk at a time with str.find, carrying the last few characters
+        of each chunk over to the next so we see matches that span pieces.
+        """
+        carry = ''
+        while chunk := self.get_chunk(1 << 16):
+            text = carry + chunk
+            i = text.find(pattern)
+            if i >= 0:
+                self.move_point(i + len(pattern) - len(carry))
+                return True
+            self.move_point(len(chunk))
+            carry = text[len(text) - len(pattern) + 1:]
+        return False
+
     def find_backward(self, pattern: str, mode: MatchMode) -> bool:
         """
         Find a string that ends before the point, leaving the point
@@ -246,6 +503,15 @@ class Document:
         self.set_point(self._edit.get_change_end())
         return self
 
+    @mutator
+    def insert_pieces(self, pieces: list[SecondaryPiece]) -> Document:
+        """Insert text shared with pieces from get_pieces, without copying it"""
+        if not pieces:
+            return self
+        self._edit = self._edit.apply_change(self.get_point(), insert=pieces)
+        self.set_point(self._edit.get_change_end())
+        return self
+
     @mutator
     def delete(self, n: int) -> Document:
         """
@@ -278,6 +544,7 @@ class Document:
     def undo(self) -> Document:
         if self._edit.prev:
             self.set_point(self._edit.undo())
+            self._undone = self._edit
             self._edit = self._edit.prev
         return self
 
@@ -288,6 +555,64 @@ class Document:
             self.set_point(self._edit.redo())
         return self
 
+    @property
+    def edit_index(self) -> int:
+        """Return the number of edits applied to the original document"""
+        return self._edit.index
+
+    @mutator
+    def undo_to(self, index: int) -> Document:
+        """
+        Undo edits until only index of them are applied, relinking the chain for each
+        but notifying watchers just once with a change that spans them all.
+        """
+        while self._edit.index > index and self._edit.prev:
+            edit = self._edit
+            self.set_point(edit.undo())
+            self._edit = edit.prev
+            self._widen_span(edit.undone_location, edit.get_change_start(), edit.get_change_end())
+        return self
+
+    @mutator
+    def redo_to(self, index: int) -> Document:
+        """Redo edits until index of them are applied, notifying watchers once like undo_to"""
+        while self._edit.index < index and self._edit.next:
+            edit = self._edit = self._edit.next
+            self.set_point(edit.redo())
+            self._widen_span(edit.redone_location, edit.get_change_start(), edit.get_change_end())
+        return self
+
+    def _widen_span(self, rebase: Callable[[Location], Location], start: Location, end: Location):
+        """Extend the range changed so far, first rebasing it onto the chain as it is now, to cover start-end"""
+        if self._span:
+            lo, hi = map(rebase, self._span)
+            start = lo if lo.is_at_or_before(start) else start
+            end = end if hi.is_at_or_before(end) else hi
+        self._span = (start, end)
+
+    def mark_saved(self):
+        """Remember that the document matches its file, sealing the latest edit so it stays that way"""
+        self.dirty = False
+        self._saved = self._edit
+        self._edit.sealed = True
+
+    def revert_to_saved(self) -> bool:
+        """
+        Undo or redo to the state we last saved in a single change,
+        returning False if that state was undone and then replaced by other edits.
+        """
+        edit: Edit | None = self._edit
+        index = self._saved.index
+        while edit is not None and edit.index != index:
+            edit = edit.prev if edit.index > index else edit.next
+        if edit is not self._saved:
+            return False
+        if index < self._edit.index:
+            self.undo_to(index)
+        elif index > self._edit.index:
+            self.redo_to(index)
+        return True
+
     def __str__(self):
         p = self._start.next
         s: str = ''
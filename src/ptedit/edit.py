@@ -1,14 +1,15 @@
 from __future__ import annotations
 from typing import cast, Self
 
-from .piece import Piece, PrimaryPiece, SecondaryPiece
+from .piece import Piece, PrimaryPiece, SecondaryPiece, SourcePiece
 from .location import Location
 
 
 class Edit:
     r"""
     An Edit tracks each change to the piece chain.
-    The Edit owns up to three new pieces, pre/ins/post.
+    The Edit owns up to three new pieces, pre/ins/post,
+    or when pasting, a run of pieces that share existing data in place of ins.
     An empty Edit occurs (for example) when we exactly delete an existing
     piece.  We also insert an empty Edit in a new (empty) document.
 
@@ -39,6 +40,7 @@ class Edit:
         pre: SecondaryPiece | None = None,
         ins: PrimaryPiece | None = None,     # for an insertion when new data is created
         post: SecondaryPiece | None = None,
+        pasted: list[SecondaryPiece] | None = None,     # instead of ins, to insert shared data
 
         # Edits form a linked list supporting undo/redo
         prev: Self | None = None,
@@ -53,8 +55,11 @@ class Edit:
         self.pre = pre
         self.post = post
         self.ins = ins
+        self.pasted = pasted or []
         self.prev = prev
         self.next = next
+        self.index = 0          # position in the undo stack, counting from the original document
+        self.sealed = bool(self.pasted)     # never merge later changes into this edit
 
         # preserve the original links for undo
         self.exclude_first: Piece = exclude_first
@@ -68,10 +73,7 @@ class Edit:
             + (0 if self.post is None else len(self.post))
         ), f"Edit excluding insert should not be longer than before change, got d={d}"
 
-        pieces: list[Piece] = [
-            p for p in cast(list[Piece|None], [self.pre, self.ins, self.post])
-            if p is not None
-        ]
+        pieces = self.pieces()
 
         # link up the new pieces
         for pair in zip(pieces[:-1], pieces[1:]):
@@ -85,6 +87,13 @@ class Edit:
         self._applied = False
         self.redo()
 
+    def pieces(self) -> list[Piece]:
+        """Return the new pieces in order"""
+        return [
+            p for p in cast(list[Piece|None], [self.pre, self.ins, *self.pasted, self.post])
+            if p is not None
+        ]
+
     @property
     def before(self) -> Piece:
         p = self.exclude_first.prev if not self.exclude_empty else self.exclude_last
@@ -98,8 +107,12 @@ class Edit:
         return p
 
     @classmethod
-    def create(cls, pt: Location, delete: int = 0, insert: str = '') -> Self:
-        """Create an edit representing an insert/delete action"""
+    def create(cls, pt: Location, delete: int = 0, insert: str | bytes | list[SecondaryPiece] = '') -> Self:
+        """
+        Create an edit representing an insert/delete action.
+        Raw bytes are only inserted as the document source.
+        A list of pieces inserts new pieces sharing their data, without copying it.
+        """
         if delete == 0:
             left, right = pt, pt
         else:
@@ -111,20 +124,30 @@ class Edit:
 
         pre = left.piece.lsplit(left.offset) if left.offset else None
         post = right.piece.rsplit(right.offset) if right.offset else None
-        ins = PrimaryPiece(data=insert) if insert else None
-
-        return cls(exclude_first, exclude_last, pre=pre, post=post, ins=ins)
-
-    def apply_change(self, pt: Location, delete: int = 0, insert: str = '') -> Self:
+        ins = None
+        pasted = None
+        if isinstance(insert, list):
+            pasted = [p.view(0, len(p)) for p in insert]
+        elif isinstance(insert, bytes):
+            ins = SourcePiece(raw=insert) if insert else None
+        elif insert:
+            ins = PrimaryPiece(data=insert)
+
+        return cls(exclude_first, exclude_last, pre=pre, post=post, ins=ins, pasted=pasted)
+
+    def apply_change(self, pt: Location, delete: int = 0, insert: str | list[SecondaryPiece] = '') -> Self:
         """
         Either update self or return a new Edit
         """
         compatible = True
-        if self.prev is None or pt != self.get_change_end():
+        # merging after an undo would change what the redo branch in next expects to relink to
+        if self.prev is None or self.next is not None or self.sealed or isinstance(insert, list) \
+                or pt != self.get_change_end():
             compatible = False
         elif delete:
             p = self.post if delete > 0 else (self.ins or self.pre)
-            if not p or len(p) <= abs(delete):
+            # pieces elsewhere may share ins, which would see it change if we trimmed it
+            if not p or len(p) <= abs(delete) or isinstance(p, PrimaryPiece) and p.shared:
                 compatible = False
             else:
                 p.trim(delete)
@@ -139,27 +162,62 @@ class Edit:
                 self.ins = PrimaryPiece(data=insert)
                 Piece.link(self.pre or self.before, self.ins)
                 Piece.link(self.ins, self.post or self.after)
+                Piece.splice(self.ins, self.ins)
 
         return self
 
     def append(self, edit: Self) -> Self:
         edit.prev = self
+        edit.index = self.index + 1
         self.next = edit
         return edit
 
+    def undone_location(self, loc: Location) -> Location:
+        """
+        Given a location from before we were undone, return the equivalent one now.
+        Locations in pre or post move to the pieces they were split from,
+        and anything else we retired moves to the change.
+        """
+        if loc.piece is self.pre:
+            return Location(self.exclude_first, loc.offset)
+        if loc.piece is self.post:
+            return Location(self.exclude_last, len(self.exclude_last) - len(self.post) + loc.offset)
+        return loc if loc.piece.live else self.get_change_start()
+
+    def redone_location(self, loc: Location) -> Location:
+        """The reverse of undone_location, for a location from before we were redone"""
+        if loc.piece is self.exclude_first and self.pre and loc.offset < len(self.pre):
+            return Location(self.pre, loc.offset)
+        k = len(self.exclude_last) - len(self.post) if self.post else 0
+        if loc.piece is self.exclude_last and self.post and loc.offset >= k:
+            return Location(self.post, loc.offset - k)
+        return loc if loc.piece.live else self.get_change_start()
+
     def undo(self) -> Location:
         """Undo this edit"""
         assert self._applied, "undo: Edit already undone"
+        first, last = self.before.next, self.after.prev
         self.before.next = self.exclude_first
         self.after.prev = self.exclude_last
+        if first is not self.after:
+            assert first and last
+            Piece.retire(first, last)
+        if not self.exclude_empty:
+            Piece.splice(self.exclude_first, self.exclude_last)
         self._applied = False
         return self.get_change_end()
 
     def redo(self) -> Location:
         """Redo this edit"""
         assert not self._applied, "redo: Edit already applied"
-        self.before.next = self.pre or self.ins or self.post or self.after
-        self.after.prev = self.post or self.ins or self.pre or self.before
+        pieces = self.pieces()
+        first, last = (pieces[0], pieces[-1]) if pieces else (None, None)
+        self.before.next = first or self.after
+        self.after.prev = last or self.before
+        if not self.exclude_empty:
+            Piece.retire(self.exclude_first, self.exclude_last)
+        if first and last:
+            Piece.splice(first, last)
         self._applied = True
         return self.get_change_end()
 
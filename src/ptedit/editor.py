@@ -1,6 +1,7 @@
 from enum import IntEnum
 from .document import Document, MatchMode, whitespace
 from .location import Location
+from .piece import SecondaryPiece
 from .display import Display
 
 
@@ -18,18 +19,25 @@ class Editor:
 
         # state
         self.mark: Location | None = None
-        self.clipboard = ''
+        # cut and copied text as pieces sharing the document's data, most recent last
+        self.kill_ring: list[list[SecondaryPiece]] = []
+        self.kill_ring_size = 16
+        # kill ring index, length, end and document generation of the last paste, for paste_previous
+        self.pasted: tuple[int, int, Location, int] | None = None
         self.overwrite_mode = False
         self.isearch_dir: ISearchDirection | None = None
         self.isearch_text = ''
         self.isearch_origin = self.doc.get_point()
+        # search text, where its search started, match start if any and point after each step of a search
+        self.isearch_stack: list[tuple[str, Location, Location | None, Location]] = []
         self.isearch_recall = False
 
         # TODO cycle mode action
         self.match_mode = MatchMode.SMART_CASE
 
     def change_handler(self, start: Location, end: Location):
-        self.mark = None
+        if not self.doc.loading:
+            self.mark = None
 
     def squash(self):
         pos = self.doc.get_point().position()
@@ -100,24 +108,47 @@ class Editor:
         self.doc.set_point(self.isearch_origin)
 
     def _isearch_insert(self, c: str):
-        """Extend search text and restart search"""
+        """Extend search text, narrowing the search from the last match"""
         if self.isearch_start:      # defer clearing search text to allow reuse with C-S C-S
             self.isearch_text = ''
         self.isearch_text += c
-        self._isearch_restart()
+        _, start, match, _ = self.isearch_stack[-1]
+        if match is None and len(self.isearch_stack) > 1:
+            # the shorter text didn't match so neither will this
+            self.pager.show_message(f"Search: {self.isearch_text}")
+            self.isearch_stack.append((self.isearch_text, start, None, self.doc.get_point()))
+            return
+        if match is None:
+            resume = start
+        elif self.isearch_dir == ISearchDirection.FORWARD:
+            # any match of the longer text is also a match of the shorter, so is at or after this one
+            resume = match
+        else:
+            # or at or before it, so ends by the one after the end of this one
+            resume = match.move(len(self.isearch_text) + 1)
+            if start.is_at_or_before(resume):
+                resume = start
+        self.doc.set_point(resume)
+        self._isearch_go(start=start)
 
     def _isearch_delete(self):
-        """Trim search text and restart search"""
+        """Trim search text, returning to where we were before the last character or search"""
         if self.isearch_start:
             self.isearch_text = ''
-        self.isearch_text = self.isearch_text[:-1]
-        self._isearch_restart()
-
-    def _isearch_restart(self):
-        self.doc.set_point(self.isearch_origin)
-        self._isearch_go()
+        if len(self.isearch_stack) > 1:
+            self.isearch_stack.pop()
+        self.isearch_text, _, self.mark, pt = self.isearch_stack[-1]
+        self.doc.set_point(pt)
+        if self.isearch_text:
+            self.pager.show_message(f"Search: {self.isearch_text}")
+        else:
+            self.pager.show_message("Empty search", True)
 
-    def _isearch_go(self, direction: ISearchDirection|None = None):
+    def _isearch_go(self, direction: ISearchDirection|None = None, start: Location|None = None):
+        """
+        Search from point, remembering the text, where the search started and the match on
+        isearch_stack so deleting a character can return there without searching again
+        """
         self.isearch_start = self.isearch_dir is None
 
         if direction is not None:
@@ -129,8 +160,11 @@ class Editor:
         if self.isearch_start:
             # starting a new search
             self.isearch_origin = self.doc.get_point()
+            self.isearch_stack = [('', self.isearch_origin, None, self.isearch_origin)]
             return
 
+        if start is None:
+            start = self.doc.get_point()
         if self.isearch_text:
             # search from current point
             if self.isearch_dir == ISearchDirection.FORWARD:
@@ -140,6 +174,7 @@ class Editor:
             # highlight match if found
             if match:
                 self.mark = self.doc.get_point().move(-len(self.isearch_text))
+            self.isearch_stack.append((self.isearch_text, start, self.mark, self.doc.get_point()))
         else:
             self.pager.show_message("Empty search", True)
 
@@ -153,11 +188,11 @@ class Editor:
         if self.mark:
             _ = self._clip_region(cut=True)
 
-    def _clip_region(self, cut: bool=False) -> str:
+    def _clip_region(self, cut: bool=False) -> list[SecondaryPiece]:
         """Cut or copy marked region, error if no mark"""
         if self.mark is None:
             self.pager.show_message('No mark', True)
-            s = ''
+            clip = []
         else:
             a, b = (self.mark, self.doc.get_point())
             sign = -1
@@ -165,11 +200,17 @@ class Editor:
                 (a, b) = (b, a)
                 sign = 1
 
-            s = self.doc.get_data(a, b)
+            clip = self.doc.get_pieces(a, b)
             if cut:
-                self.doc.delete(sign * len(s))
+                self.doc.delete(sign * sum(len(p) for p in clip))
             self.mark = None
-        return s
+        return clip
+
+    def _kill(self, clip: list[SecondaryPiece]):
+        """Add a clip to the kill ring, forgetting the oldest once it's full"""
+        if clip:
+            self.kill_ring.append(clip)
+            del self.kill_ring[:-self.kill_ring_size]
 
     def insert(self, ch: int):
         c = chr(ch)
@@ -194,19 +235,33 @@ class Editor:
             self.doc.delete(-1)
 
     def copy(self):
-        self.clipboard = self._clip_region(cut=False)
+        self._kill(self._clip_region(cut=False))
 
     def cut(self):
-        self.clipboard = self._clip_region(cut=True)
+        self._kill(self._clip_region(cut=True))
 
     def paste(self):
         self._delete_region()
-        if not self.clipboard:
+        if not self.kill_ring:
             self.pager.show_message('Clipboard empty', True)
             return
-        self.doc.insert(self.clipboard)
+        self._paste(len(self.kill_ring) - 1)
 
-    def _clip_line(self, cut: bool=False) -> str:
+    def paste_previous(self):
+        """Right after a paste, replace what we pasted with the previous entry in the kill ring"""
+        if self.pasted is None or self.pasted[2:] != (self.doc.get_point(), self.doc.generation):
+            self.pager.show_message('Not after a paste', True)
+            return
+        i, n, _, _ = self.pasted
+        self.doc.delete(-n)
+        self._paste((i - 1) % len(self.kill_ring))
+
+    def _paste(self, i: int):
+        clip = self.kill_ring[i]
+        self.doc.insert_pieces(clip)
+        self.pasted = (i, sum(len(p) for p in clip), self.doc.get_point(), self.doc.generation)
+
+    def _clip_line(self, cut: bool=False) -> list[SecondaryPiece]:
         self.pager.move_start_line()
         self.mark = self.doc.get_point()
         self.pager.move_end_line()
@@ -215,11 +270,11 @@ class Editor:
 
     def copy_line(self):
         """Copy line to clipboard"""
-        self.clipboard = self._clip_line(False)
+        self._kill(self._clip_line(False))
 
     def cut_line(self):
         """Cut line to clipboard"""
-        self.clipboard = self._clip_line(True)
+        self._kill(self._clip_line(True))
 
     def undo(self):
         self.doc.undo()
@@ -227,4 +282,9 @@ class Editor:
     def redo(self):
         self.doc.redo()
 
+    def revert(self):
+        """Undo or redo all the way back to the last save"""
+        if not self.doc.revert_to_saved():
+            self.pager.show_message("Can't revert, the saved state was undone and replaced", True)
+
 
@@ -1,25 +1,173 @@
-from collections import deque
-import logging
-
+from array import array
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+from functools import cache
+import re
+import sys
+import unicodedata
+from typing import Callable
+
+from . import tracing
+from .piece import Piece, PrimaryPiece
 from .location import Location
 from .document import Document
+from .lineindex import LineIndex
+
+
+# anything other than plain printable ascii needs individual attention
+special_chars = re.compile(r'[^\x20-\x7e]')
+
+
+@cache
+def glyph(ch: str) -> str:
+    """
+    Return how to show a character other than printable ascii or whitespace.
+    Other printable characters that take a single column show as themselves.
+    """
+    c = ord(ch)
+    if c < 32:
+        # ctrl-escape, e.g. ^M
+        return '\x01' + chr(c | 0x40)
+    if 0xdc80 <= c <= 0xdcff:
+        # an invalid utf-8 byte, decoded as a surrogate, e.g. \9E
+        return f'\x02{c - 0xdc00:02X}'
+    if c == 0x7f:
+        return '\x027F'
+    if ch.isprintable() and not unicodedata.combining(ch) and unicodedata.east_asian_width(ch) not in 'WF':
+        return ch
+    # unicode escape, e.g. \u200B
+    return f'\x02u{c:04X}'
+
+# A run of document text identified by its owning PrimaryPiece, offset and length
+Run = tuple[PrimaryPiece, int, int]
+
+
+class CachedLine:
+    """
+    A formatted line, along with the runs of document text it was formatted from.
+    The runs identify text by where it lives in primary pieces rather than by
+    Location, so the entry survives pieces being split by nearby edits.
+    """
+    def __init__(self, line: str, col_map: array[int], n: int, runs: list[Run], at_end: bool, limit: int):
+        self.line = line
+        self.col_map = col_map
+        self.n = n              # number of characters to the next BoL
+        self.runs = runs        # all text scanned while formatting, which could extend past next BoL
+        self.at_end = at_end    # did we scan to the end of the document?
+        self.limit = limit      # the most characters the line could hold, see Formatter.line_limit
 
+    @staticmethod
+    def key(loc: Location) -> tuple[int, int]:
+        src, start = loc.piece.ref()
+        return src.id, start + loc.offset
 
-hex_digits: list[int] = [ord(c) for c in '0123456789ABCDEF']
-
-
-class Ladder(deque[Location]):
-    def __init__(self, locs: list[Location]=[]):
-        super().__init__(locs, maxlen=48)
-
-    def brackets(self, pt: Location):
-        p, off = pt.tuple()
-        assert len(self) > 0 and p.prev is not None
-        start, end = self[0], self[-1]
-
+    @staticmethod
+    def scan(start: Location, end: Location) -> list[Run]:
+        """Collect the text between two locations as runs, merging contiguous pieces"""
+        runs: list[Run] = []
+        p, offset = start.tuple()
+        while True:
+            n = (len(p) if p != end.piece else end.offset) - offset
+            if n:
+                src, ref = p.ref()
+                ref += offset
+                if runs and runs[-1][0] is src and runs[-1][1] + runs[-1][2] == ref:
+                    runs[-1] = (src, runs[-1][1], runs[-1][2] + n)
+                else:
+                    runs.append((src, ref, n))
+            if p == end.piece or p.next is None:
+                break
+            p, offset = p.next, 0
+        return runs
+
+    def matches(self, loc: Location) -> bool:
+        """Is the document text from loc still the same as when we formatted it?"""
+        p, offset = loc.tuple()
+        for src, ref, n in self.runs:
+            while n:
+                if p.next is None:
+                    return False
+                p_src, p_ref = p.ref()
+                if p_src is not src or p_ref + offset != ref:
+                    return False
+                k = min(n, len(p) - offset)
+                ref += k
+                n -= k
+                offset += k
+                if offset == len(p):
+                    p, offset = p.next, 0
+        return not self.at_end or p.next is None
+
+    def uses(self, src: PrimaryPiece) -> bool:
+        return any(run[0] is src for run in self.runs)
+
+
+class Ladder:
+    """
+    A ladder of beginning-of-line marks in document order.
+    Each rung carries its offset from the start of the document,
+    which is only valid for the document generation the ladder was built in,
+    so finding a rung or bracketing the point is a binary search.
+    """
+    maxlen = 48
+
+    def __init__(self, generation: int = -1):
+        self.generation = generation
+        self.locs: list[Location] = []
+        self.keys: list[int] = []
+        self._keys: dict[tuple[Piece, int], int] = {}
+
+    def __len__(self) -> int:
+        return len(self.locs)
+
+    def __getitem__(self, i: int) -> Location:
+        return self.locs[i]
+
+    def __iter__(self):
+        return iter(self.locs)
+
+    def __contains__(self, loc: Location) -> bool:
+        return loc.tuple() in self._keys
+
+    def append(self, loc: Location, key: int):
+        """Add a rung after the last one, dropping the first if we're full"""
+        assert not self.keys or key > self.keys[-1], f"Ladder: rung {key} out of order"
+        self.locs.append(loc)
+        self.keys.append(key)
+        self._keys[loc.tuple()] = key
+        if len(self.locs) > self.maxlen:
+            del self._keys[self.locs[0].tuple()]
+            del self.locs[0], self.keys[0]
+
+    def key(self, loc: Location) -> int:
+        """Return the offset of a rung"""
+        return self._keys[loc.tuple()]
+
+    def find(self, loc: Location) -> int | None:
+        """Return the index of the rung at loc, if any"""
+        key = self._keys.get(loc.tuple())
+        return None if key is None else bisect_left(self.keys, key)
+
+    def key_of(self, pt: Location) -> int | None:
+        """Find the offset of an arbitrary location at or after the first rung"""
+        if pt in self:
+            return self.key(pt)
+        d = pt.distance_after(self.locs[0])
+        return None if d is None else self.keys[0] + d
+
+    def rung_at_or_before(self, key: int) -> int:
+        """Return the index of the last rung at or before offset key"""
+        i = bisect_right(self.keys, key) - 1
+        assert i >= 0, f"Ladder: no rung before {key}"
+        return i
+
+    def brackets(self, pt: Location, key: int) -> bool:
+        """Is pt, which is at offset key, strictly inside the ladder (or at start/end)?"""
+        assert self.keys
+        first, last = self.keys[0], self.keys[-1]
         return (
-            (start.is_strictly_before(pt) or (off == 0 and p.prev.prev is None and start == pt))
-            and (pt.is_strictly_before(end) or (off == 0 and p.next is None and end == pt))
+            (first < key or (key == first and pt.is_start()))
+            and (key < last or (key == last and pt.is_end()))
         )
 
 
@@ -32,12 +180,46 @@ class Formatter:
         self.cols = cols
         self.rungs = rungs
         self.tab = tab
+        self.left = 0                   # first column on screen, see NoWrapFormatter
+
+        # Long lines are also cut at every multiple of this offset that's preceded
+        # by that many characters without a newline.  These anchors mean we never
+        # need to look back more than a couple of intervals to find a BoL.
+        self.anchor = 1 << 14
 
         self.bol_ladder = Ladder()      # cached beginning of line marks
-        self.wrap_lookahead: bool
+
+        # cache of formatted lines keyed by the text at their BoL
+        self.line_cache: OrderedDict[tuple[int, int], CachedLine] = OrderedDict()
+        self.cache_size = 256
+        self.n_formatted = 0            # lines formatted from scratch, for performance testing
+
+        # whole document index of visual lines, built on demand
+        self.line_index: LineIndex | None = None
+        self.index_length = 0           # document length when the index was last updated
+        self.index_long = False         # does the indexed text have any lines long enough to anchor?
 
     def change_handler(self, start: Location, end: Location):
         self.rescue_ladder(start)
+        self.evict_lines(start)
+        if self.line_index is not None:
+            self.repair_index(start, end)
+
+    def forget(self, start: Location):
+        """
+        A cheaper alternative to change_handler for a burst of changes with no painting in between.
+        Rather than rescuing the ladder, working out which formatted lines changed and
+        repairing the index after every change, we drop them all and rebuild on demand.
+        """
+        self.bol_ladder = Ladder(self.doc.generation)
+        self.line_cache.clear()
+        self.line_index = None
+
+    def ladder(self) -> Ladder:
+        """Return the BoL ladder, discarding it if the document changed since it was built"""
+        if self.bol_ladder.generation != self.doc.generation:
+            self.bol_ladder = Ladder(self.doc.generation)
+        return self.bol_ladder
 
     def clamp_to_bol(self):
         """
@@ -45,34 +227,21 @@ class Formatter:
         Unlike bol_to_prev_bol this is a no-op if we're already at BOL
         """
         pt = self.doc.get_point()
-        if self.doc.at_start() or self.doc.at_end() or pt in self.bol_ladder:
+        if self.doc.at_start() or self.doc.at_end() or pt in self.ladder():
             return
-
-        if not self.bol_ladder or not pt.within(self.bol_ladder[0],self.bol_ladder[-1]):
-            self.ladder_point()
+        if tracing.ladder.enabled:
+            tracing.ladder.count('clamp_misses')
 
         # point is strictly bracketed, just find correct rung
-        top = self.bol_ladder[0]
-        assert pt.is_at_or_after(top)
-        for bol in reversed(self.bol_ladder):  #TODO could skip first
-            dbol, dpt = bol.distance_after(top), pt.distance_after(top)
-            assert dbol is not None and dpt is not None
-            if dbol <= dpt:
-                self.doc.set_point(bol)
-                return
-
-        assert False, "clamp_to_bol failed"
+        key = self.ladder_point()
+        self.doc.set_point(self.bol_ladder[self.bol_ladder.rung_at_or_before(key)])
 
     def bol_to_next_bol(self):
-        bol = self.doc.get_point()
-
-        n = len(self.bol_ladder)
-        try:
-            i = self.bol_ladder.index(bol)
-        except:
-            i = n     # force miss
-        if i+1 < n:
+        i = self.ladder().find(self.doc.get_point())
+        if i is not None and i+1 < len(self.bol_ladder):
             self.doc.set_point(self.bol_ladder[i+1])
+            if tracing.ladder.enabled:
+                tracing.ladder.count('next_hits')
         else:
             # format and discard line to advance point
             self.format_line()
@@ -96,37 +265,131 @@ class Formatter:
         # the characters on the screen while rendering it; once the cache is primed
         # that reduces to about 10-15% overhead
 
-        try:
-            i = self.bol_ladder.index(self.doc.get_point())
-        except ValueError:
-            i = 0  # force miss
-
+        i = self.ladder().find(self.doc.get_point())
         if not i:
+            if tracing.ladder.enabled:
+                tracing.ladder.count('prev_misses')
             self.ladder_point()
-            i = len(self.bol_ladder) - (1 if self.doc.at_end() else 2)
-            assert self.doc.get_point() == self.bol_ladder[i]
+            i = self.bol_ladder.find(self.doc.get_point())
+            assert i, "bol_to_prev_bol: point should be an inner rung"
 
         self.doc.set_point(self.bol_ladder[i-1])
 
+    ### Whole document visual line index
+
+    def get_line_index(self) -> LineIndex:
+        """Return the visual line index, formatting the whole document the first time"""
+        if self.line_index is None:
+            pt = self.doc.get_point()
+            self.doc.set_point_start()
+            self.index_long = False
+            starts, _ = self._index_lines(0)
+            self.doc.set_point(pt)
+            self.line_index = LineIndex(starts)
+            self.index_length = len(self.doc)
+        return self.line_index
+
+    def visual_line_count(self) -> int:
+        return len(self.get_line_index())
+
+    def visual_line(self, loc: Location) -> int:
+        """Return the visual line number containing loc"""
+        return self.get_line_index().line(loc.position())
+
+    def visual_line_start(self, k: int) -> Location:
+        """Return the BoL of visual line k"""
+        index = self.get_line_index()
+        k = max(0, min(k, len(index)-1))
+        return self.doc.get_start().move(index.offset(k))
+
+    def repair_index(self, start: Location, end: Location):
+        """
+        Reformat the lines touched by a change until we find a line
+        starting at the same (shifted) offset as before the change.
+        """
+        assert self.line_index is not None
+        index = self.line_index
+        n = len(self.doc)
+        delta = n - self.index_length
+        self.index_length = n
+        s, e = start.position(), end.position()
+
+        # Anchors stay put while the text around them moves, so if there are
+        # long lines the old lines don't just shift.  Rebuild the index when it's next needed.
+        if self.index_long or self._long_line(start, end, e - s):
+            self.line_index = None
+            return
+
+        # an edit can pull text back onto the end of the preceding line
+        first = max(0, index.line(s) - 1)
+        pos = index.offset(first)
+
+        def converged(pos: int) -> int | None:
+            k = index.find(pos - delta) if pos >= e else None
+            return k if k is not None and k > first else None
+
+        pt = self.doc.get_point()
+        self.doc.set_point(self.doc.get_start().move(pos))
+        starts, last = self._index_lines(pos, converged)
+        self.doc.set_point(pt)
+        index.replace(first, len(index) if last is None else last, starts, delta)
+
+    def _index_lines(self, pos: int, converged: Callable[[int], int | None] | None = None) -> tuple[list[int], int | None]:
+        """
+        Format lines from the point, which is at offset pos, collecting the offset of each BoL
+        until we reach the end of the document or converged() returns an existing line number.
+        """
+        starts: list[int] = []
+        run = 0         # characters since the last newline
+        while True:
+            starts.append(pos)
+            line, col_map, _, at_end = self._format_line(self.line_limit(pos))
+            if at_end:
+                return starts, None
+            pos += len(col_map)
+            run = 0 if '\n' in line else run + len(col_map)
+            if run >= self.anchor:
+                self.index_long = True
+            if converged and (k := converged(pos)) is not None:
+                return starts, k
+
+    def _long_line(self, start: Location, end: Location, n: int) -> bool:
+        """Is the text from start to end, which is n characters, part of a line long enough to anchor?"""
+        pt = self.doc.get_point()
+        self.doc.set_point(start)
+        self.doc.find_char_backward('\n', self.anchor - n)
+        n += start.distance_after(self.doc.get_point()) or 0
+        self.doc.set_point(end)
+        while n < self.anchor and (chunk := self.doc.get_chunk(self.anchor - n)):
+            if (i := chunk.find('\n')) >= 0:
+                n += i
+                break
+            n += len(chunk)
+            self.doc.move_point(len(chunk))
+        self.doc.set_point(pt)
+        return n >= self.anchor
+
     ### Internal glyph rendering for BoL calcs and painting
 
-    def format_line(self) -> tuple[bytes, list[int]]:
+    def format_line(self) -> tuple[str, array[int]]:
         r"""
-        Convert doc characters to a string of exactly 'cols' bytes that can
+        Convert doc characters to a string of exactly 'cols' characters that can
         be directly mapped to screen display characters.
         A column map is also returned which maps document offsets from BoL
         to corresponding screen columns.
-        Normally a byte corresponds to a single document character,
+        Normally a column corresponds to a single document character,
         but there are a few exceptions:
-        - 0x00 indicates a padding space, with no corresponding character in the document
-        - 0x01 <x> is a control-escape for a single non-printable character c = 0x00-0x1f
+        - \0 indicates a padding space, with no corresponding character in the document
+        - \1 <x> is a control-escape for a single non-printable character c = 0x00-0x1f
           with x = c | 0x40, displayed as "^C" perhaps in a different color.
-        - 0x02 <x> <y> is a hex-escape for a single non-printable character c > 0x7e
+        - \2 <x> <y> is a hex-escape for 0x7f or an invalid utf-8 byte
           with x,y as the hex nibbles, displayed as "\xy" perhaps in a different color.
-        - whitespace bytes \t, \n and ' ' are normally be displayed as a single
-          space (additional padding zero bytes will be added), but could be
+        - \2 u <xxxx> is a unicode escape for any other character that isn't printable
+          or doesn't take exactly one column, displayed as "\uxxxx".
+        - whitespace \t, \n and ' ' are normally be displayed as a single
+          space (additional padding \0 will be added), but could be
           shown with a special character to indicate tabs or newlines.
-        - the end-of-document is marked with a 0x00 byte.  This is indistinguishable
+        - the end-of-document is marked with \0.  This is indistinguishable
           from padding but is indexed in the column map for cursor placement.
 
         This representation makes it easy to compute the screen column
@@ -134,156 +397,394 @@ class Formatter:
         """
 
         pt = self.doc.get_point()
-        if pt not in self.bol_ladder:
-            self.bol_ladder = Ladder([pt])
-            logging.info(f'format_line reset to [{pt.position()}]')
+        if pt not in self.ladder():
+            key = pt.position()
+            self.bol_ladder = Ladder(self.doc.generation)
+            self.bol_ladder.append(pt, key)
+            if tracing.ladder.enabled:
+                tracing.ladder.count('resets')
+                tracing.ladder.log('format_line reset to [%d]', key)
         extend_ladder = pt == self.bol_ladder[-1]
 
-        wrap_col = 0
-        wrap_point: Location | None = None
-        line = b''
-        col_map: list[int] = []        # col_map[i] is column for document offset i
-        done = False
-        while len(line) < self.cols and not done:
-            done = self.doc.at_end()        # treat eod as printable 0
-            ch = ord(self.doc.next_char())
-            if done or 32 <= ch < 127 or ch in (ord('\t'), ord('\n')):
-                n = 0
-            else:
-                n = 1 if ch < 32 else 2
-                if len(line) >= self.cols - n:
-                    self.doc.move_point(-1)
-                    break
+        line, col_map, n = self.render_line(self.line_limit(self.bol_ladder.key(pt)))
 
-            col_map.append(len(line))
-
-            # unget the char if escaped version won't fit
-            match n:
-                case 0:
-                    line += bytes([ch])
-                    # wrappable?
-                    if ch in (0, ord('\n'), ord('\t'), ord(' '), ord('-')):
-                        wrap_col = len(line)
-                        wrap_point = self.doc.get_point()
-                        if ch == ord('\n'):
-                            done = True         # 0 already handled by at_end test
-                        elif ch == ord('\t'):
-                            pad = (self.tab - len(line)) & (self.tab - 1)
-                            line += bytes(pad)
-                case 1:
-                    # ctrl-escape, e.g. ^M
-                    line += bytes([0x01, ch|0x40])
-                case _:
-                    # backslash-escape, e.g. \9E
-                    line += bytes([0x02, hex_digits[ch // 16], hex_digits[ch%16]])
-
-        if wrap_point:
-            line = line[:wrap_col]
-            col_map = [c for c in col_map if c < wrap_col]
-            self.doc.set_point(wrap_point)
+        if extend_ladder and n:
+            self.bol_ladder.append(self.doc.get_point(), self.bol_ladder.keys[-1] + n)
+
+        return line, col_map
+
+    def format_row(self) -> tuple[str, array[int], int]:
+        """
+        Like format_line, also returning how many document offsets the row spans,
+        including the end of the document if it's on the row.
+        The column map covers every one of them when we wrap.
+        """
+        line, col_map = self.format_line()
+        return line, col_map, len(col_map)
 
+    def scroll_to_point(self, preferred_col: int | None):
+        """
+        Scroll horizontally to show the point, or the preferred column of its line if given.
+        Wrapped lines always fit on screen so there's nothing to do.
+        """
+        pass
+
+    def render_line(self, limit: int) -> tuple[str, array[int], int]:
+        """
+        Format the line starting at the point, holding at most limit characters,
+        leaving the point at the next BoL and returning the number of characters we advanced.
+        Lines are cached so that repainting unchanged text doesn't reformat it.
+        """
         pt = self.doc.get_point()
-        if extend_ladder and pt != self.bol_ladder[-1]:
-            self.bol_ladder.append(pt)
+        key = CachedLine.key(pt)
+        cached = self.line_cache.get(key)
+        if cached is not None and cached.limit == limit and cached.matches(pt):
+            self.line_cache.move_to_end(key)
+            self.doc.set_point(pt.move(cached.n))
+            if tracing.lines.enabled:
+                tracing.lines.count('cache_hits')
+            return cached.line, cached.col_map, cached.n
+
+        line, col_map, read_end, at_end = self._format_line(limit)
+        n = self.doc.get_point().distance_after(pt)
+        assert n is not None
+        self.line_cache[key] = CachedLine(line, col_map, n, CachedLine.scan(pt, read_end), at_end, limit)
+        if len(self.line_cache) > self.cache_size:
+            self.line_cache.popitem(last=False)
+        self.n_formatted += 1
+        if tracing.lines.enabled:
+            tracing.lines.count('formatted')
+        return line, col_map, n
+
+    def evict_lines(self, start: Location):
+        """
+        Edits can change the text of a line without changing the pieces
+        that refer to it by extending or trimming the edited piece in place,
+        so forget any line formatted from that piece.   Other changes are
+        detected by CachedLine.matches.
+        """
+        if not isinstance(start.piece, PrimaryPiece):
+            return
+        for key in [k for k, v in self.line_cache.items() if v.uses(start.piece)]:
+            del self.line_cache[key]
 
-        line += bytes(self.cols - len(line))
+    def _format_line(
+            self, limit: int | None = None, cols: int | None = None, wrap: bool = True
+        ) -> tuple[str, array[int], Location, bool]:
+        """
+        Format the line starting at the point, returning the line and column map
+        along with the furthest location read and whether we hit the end of the document.
+        The line is cut after limit characters (default cols) even if it's not full.
+        Without wrap we stop at the last column that fits rather than the last wrap point,
+        and don't pad the line.
+        We take text a chunk at a time, copying runs of plain printable characters
+        directly and only handling whitespace and escapes one by one.
+        """
+        cols = self.cols if cols is None else cols
+        limit = cols if limit is None else limit
+        wrap_col = 0                # column after the last wrappable character
+        wrap_n = 0                  # characters consumed up to that point
+        n = 0                       # characters consumed
+        col = 0                     # columns used so far
+        parts: list[str] = []
+        col_map = array('i')        # col_map[i] is column for document offset i
+        at_end = False
+        unget = 0
+        while col < cols:
+            if n == limit and not self.doc.at_end():
+                # a hard break at a long line anchor
+                wrap_col, wrap_n = col, n
+                break
+            chunk = self.doc.get_chunk(min(cols - col, limit - n))
+            if not chunk:
+                # treat eod as a printable, wrappable 0
+                at_end = True
+                col_map.append(col)
+                parts.append('\0')
+                col += 1
+                wrap_col, wrap_n = col, n
+                break
 
-        return line, col_map
+            m = special_chars.search(chunk)
+            k = m.start() if m else len(chunk)
+            if k:
+                run = chunk[:k]
+                col_map.extend(range(col, col + k))
+                parts.append(run)
+                i = max(run.rfind(' '), run.rfind('-'))
+                if i >= 0:
+                    wrap_col, wrap_n = col + i + 1, n + i + 1
+                col += k
+                n += k
+                self.doc.move_point(k)
+                continue
+
+            ch = chunk[0]
+            if ch in '\t\n':
+                col_map.append(col)
+                parts.append(ch)
+                col += 1
+                n += 1
+                self.doc.move_point(1)
+                wrap_col, wrap_n = col, n
+                if ch == '\n':
+                    break
+                pad = (self.tab - col) & (self.tab - 1)
+                parts.append('\0' * pad)
+                col += pad
+                continue
+
+            escape = glyph(ch)
+            # leave the char for the next line if the escaped version won't fit
+            if col + len(escape) > cols:
+                unget = 1
+                break
+            col_map.append(col)
+            parts.append(escape)
+            col += len(escape)
+            n += 1
+            self.doc.move_point(1)
+
+        read_end = self.doc.get_point().move(unget)
+
+        line = ''.join(parts)
+        if not wrap:
+            return line, col_map, read_end, at_end
+        if wrap_col:
+            line = line[:wrap_col]
+            del col_map[bisect_left(col_map, wrap_col):]
+            self.doc.move_point(wrap_n - n)
+
+        return line + '\0' * (cols - len(line)), col_map, read_end, at_end
 
     @staticmethod
-    def offset_for_column(column: int, col_map: list[int]) -> int:
+    def offset_for_column(column: int, col_map: array[int]) -> int:
         if len(col_map) < 2:
             return 0
-        offset = len(col_map) - 1
-        while offset and col_map[offset] > column:
-            offset -= 1
-        return offset
+        return max(bisect_right(col_map, column) - 1, 0)
 
     ### Internal beginning-of-line routines
 
-    def ladder_point(self):
+    def ladder_point(self) -> int:
         """
         Ensure that the point is strictly bracketed by BoL marks (or at start/end),
         with approximately 'rungs' marks before the point.
+        Returns the offset of the point.
         """
         pt = self.doc.get_point()
-        if self.bol_ladder:
+        key = None
+        if self.ladder():
             # do we already bracket the point?
-            if self.bol_ladder.brackets(pt):
-                return
+            key = self.bol_ladder.key_of(pt)
+            if key is not None and self.bol_ladder.brackets(pt, key):
+                if tracing.ladder.enabled:
+                    tracing.ladder.count('point_hits')
+                return key
 
             # is the existing ladder still useful?
-            #TODO is this right
-            if pt.is_at_or_before(self.bol_ladder[0]) or (pt.distance_after(self.bol_ladder[-1]) or 1e6) > self.rungs * self.cols:
-                self.bol_ladder = Ladder()
+            if key is None or key <= self.bol_ladder.keys[0] or key - self.bol_ladder.keys[-1] > self.rungs * self.cols:
+                self.bol_ladder = Ladder(self.doc.generation)
 
         # find a reasonable starting point for the ladder
         if not self.bol_ladder:
             self.doc.move_point(-self.rungs * self.cols)
-            self.doc.find_char_backward('\n')
-            self.bol_ladder = Ladder([self.doc.get_point()])
-
+            start_key = self.find_bol()
+            start = self.doc.get_point()
+            self.bol_ladder.append(start, start_key)
+            d = pt.distance_after(start)
+            assert d is not None
+            key = self.bol_ladder.keys[0] + d
+
+        assert key is not None
+        if tracing.ladder.enabled:
+            tracing.ladder.count('point_misses')
         # extend the ladder until we bracket the point
         self.doc.set_point(self.bol_ladder[-1])
-        while not self.doc.at_end() and self.doc.get_point().is_at_or_before(pt):
+        while not self.doc.at_end() and self.bol_ladder.keys[-1] <= key:
             self.bol_to_next_bol()
 
         self.doc.set_point(pt)
 
-        assert self.bol_ladder.brackets(pt)
+        assert self.bol_ladder.brackets(pt, key)
+        return key
+
+    def find_bol(self) -> int:
+        """
+        Move the point back to the nearest BoL we can find without formatting,
+        just after a newline or at an anchor, returning its offset.
+        That's never more than two anchor intervals back, however long the line.
+        """
+        pt = self.doc.get_point()
+        pos = pt.position()
+        a = pos - pos % self.anchor         # the last anchor at or before the point, if it is one
+        if not self.doc.find_char_backward('\n', pos - a + self.anchor) and not self.doc.at_start():
+            # no newline for a whole interval before a, so it's an anchor
+            self.doc.move_point(self.anchor)
+            return a
+        d = pt.distance_after(self.doc.get_point())
+        assert d is not None
+        return pos - d
+
+    def line_limit(self, pos: int) -> int:
+        """
+        Return how many characters the line starting at the point, which is at offset pos,
+        can hold before it's cut at an anchor.  That's only possible when the next
+        multiple of anchor is within reach, and no newline precedes it by less than anchor.
+        Any newline after pos would end the line first, so we only need to look back.
+        """
+        p = pos - pos % self.anchor + self.anchor
+        if p - pos > self.cols:
+            return self.cols
+        pt = self.doc.get_point()
+        found = self.doc.find_char_backward('\n', pos - (p - self.anchor))
+        self.doc.set_point(pt)
+        if tracing.ladder.enabled:
+            tracing.ladder.count('anchor_checks')
+        return self.cols if found else p - pos
 
     def rescue_ladder(self, start: Location):
         """
         After most changes we can rescue most of the cached BoL marks.
-        We need to recreate them based on position relative to the start
-        of the document because the Location objects themselves might
-        no longer be valid as when swapped out of the piece chain.
-        We need to make sure to re-bracket the point, and don't
-        bother if the movement was too large.
+        Marks well before the change keep their offsets, but we need to
+        recreate their Locations relative to the change because the
+        Location objects themselves might no longer be valid when their
+        pieces are swapped out of the piece chain.
+        We don't bother if the change was too far from the ladder.
         """
+        bols = self.bol_ladder
+        self.bol_ladder = Ladder(self.doc.generation)
+
         # anything to rescue?
-        if not self.bol_ladder:
+        if not bols or bols.generation != self.doc.generation - 1:
             return
 
-        bols = self.bol_ladder
-        self.bol_ladder = Ladder()
-        logging.info(f'rescue_ladder {len(self.bol_ladder)} bol, first/last/edit/pt {bols[0].position()}/{bols[-1].position()}/{start.position()}/{self.doc.get_point().position()}')
+        pos = start.position()
+        if tracing.ladder.enabled:
+            tracing.ladder.log('rescue_ladder %d bol, first/last/edit %d/%d/%d', len(bols), bols.keys[0], bols.keys[-1], pos)
 
         # give up if start is before the first BoL or too far from point
-        if (
-            start.position() < bols[0].position() + self.cols
-            or bols[-1].position() + self.cols * self.rungs < start.position()
-        ):
+        if pos < bols.keys[0] + self.cols or bols.keys[-1] + self.cols * self.rungs < pos:
             return
 
-        # reconstruct BoL up to the start of the change
-        # use position relative to start
-        # how far is the first BoL from the start of the change?
-        for i,b in enumerate(bols):
-            logging.info(f"ladder {i}: {b} {b.position()}")
-        prev = bols.popleft()
-        delta = start.position() - prev.position()
-        self.bol_ladder.append(start.move(-delta))
-        for b in bols:
-            d = b.distance_after(prev)
-            if d is None:
-                logging.info(f"{b} ancestors:")
-                p = b.piece
-                while p is not None:
-                    p = p.prev
-                    logging.info(p)
-                logging.info(f"{prev} ancestors:")
-                p = prev.piece
-                while p is not None:
-                    p = p.prev
-                    logging.info(p)
-
-            assert d is not None, f"failed! {b} - {prev} => {d}"
-            delta -= d
-            # change could affect line break position up to cols beforehand
-            if delta < self.cols:
+        # change could affect line break position up to cols beforehand
+        loc, key = start, pos
+        for k in bols.keys:
+            if pos - k < self.cols:
                 break
-            self.bol_ladder.append(self.bol_ladder[-1].move(d))
-            prev = b
+            loc, key = loc.move(k - key), k
+            self.bol_ladder.append(loc, key)
+
+        if tracing.ladder.enabled:
+            tracing.ladder.count('rescued', len(self.bol_ladder))
 
-        logging.info(f'rescue_ladder kept {len(self.bol_ladder)} bol')
+
+class NoWrapFormatter(Formatter):
+    """
+    Shows each logical line on a single row, scrolled horizontally so that
+    the row starts at column `left`.  Lines only begin after a newline,
+    so moving between them just scans for newlines with no ladder or anchors,
+    and we only format a line as far as the right edge of the screen.
+    """
+    def __init__(self, doc: Document, cols: int, rungs: int, tab: int=4):
+        super().__init__(doc, cols, rungs, tab)
+        self.guard_cols = cols // 8     # scroll before the point gets this close to an edge
+
+    def change_handler(self, start: Location, end: Location):
+        self.evict_lines(start)
+        if self.line_index is not None:
+            self.repair_index(start, end)
+
+    def clamp_to_bol(self):
+        self.doc.find_char_backward('\n')
+
+    def bol_to_next_bol(self):
+        if self.doc.find_char_forward('\n'):
+            self.doc.move_point(1)
+
+    def bol_to_prev_bol(self):
+        if self.doc.at_start():
+            return
+        self.doc.move_point(-1)
+        self.doc.find_char_backward('\n')
+
+    def format_line(self) -> tuple[str, array[int]]:
+        line, col_map, _ = self.format_row()
+        return line, col_map
+
+    def format_row(self) -> tuple[str, array[int], int]:
+        """
+        Format the visible part of the line at the point, skipping the rest to the next BoL.
+        The column map only covers characters up to the right edge,
+        and like the preferred column counts from the start of the line rather than left.
+        Rows are cached like wrapped lines, keyed by left rather than a limit.
+        """
+        pt = self.doc.get_point()
+        key = CachedLine.key(pt)
+        cached = self.line_cache.get(key)
+        if cached is not None and cached.limit == self.left and cached.matches(pt):
+            self.line_cache.move_to_end(key)
+            self.doc.set_point(pt.move(cached.n))
+            if tracing.lines.enabled:
+                tracing.lines.count('cache_hits')
+            return cached.line, cached.col_map, cached.n + cached.at_end
+
+        line, col_map, _, at_end = self._format_line(cols=self.left + self.cols, wrap=False)
+        if not at_end and not line.endswith('\n'):
+            # the line runs off the right edge
+            at_end = not self.doc.find_char_forward('\n')
+            if not at_end:
+                self.doc.move_point(1)
+        line = line[self.left:self.left + self.cols]
+        line += '\0' * (self.cols - len(line))
+        end = self.doc.get_point()
+        n = end.distance_after(pt)
+        assert n is not None
+        self.line_cache[key] = CachedLine(line, col_map, n, CachedLine.scan(pt, end), at_end, self.left)
+        if len(self.line_cache) > self.cache_size:
+            self.line_cache.popitem(last=False)
+        self.n_formatted += 1
+        if tracing.lines.enabled:
+            tracing.lines.count('formatted')
+        return line, col_map, n + at_end
+
+    def scroll_to_point(self, preferred_col: int | None):
+        """
+        Keep the point's column at least guard_cols from either edge,
+        jumping to put it mid-screen when it strays.  While the point is on screen
+        its column comes from the visible row, usually cached, and only when it's
+        off the right edge do we format from its BoL to the point.
+        """
+        pt = self.doc.get_point()
+        self.clamp_to_bol()
+        bol = self.doc.get_point()
+        if preferred_col is not None:
+            # the point is at BoL and will move to the preferred column when we paint;
+            # an escape that doesn't fit leaves nothing before it, so it's at column 0
+            _, col_map, _, _ = self._format_line(cols=preferred_col + 1, wrap=False)
+            col = col_map[self.offset_for_column(preferred_col, col_map)] if col_map else 0
+        else:
+            n = pt.distance_after(bol) or 0
+            _, col_map, _ = self.format_row()
+            if n >= len(col_map):
+                self.doc.set_point(bol)
+                _, col_map, _, _ = self._format_line(limit=n + 1, cols=sys.maxsize, wrap=False)
+            col = col_map[n]
+        self.doc.set_point(pt)
+        if not self.left + self.guard_cols <= col < self.left + self.cols - self.guard_cols:
+            self.left = max(col - self.cols // 2, 0)
+
+    def _index_lines(self, pos: int, converged: Callable[[int], int | None] | None = None) -> tuple[list[int], int | None]:
+        starts: list[int] = []
+        while True:
+            starts.append(pos)
+            pt = self.doc.get_point()
+            if not self.doc.find_char_forward('\n'):
+                return starts, None
+            self.doc.move_point(1)
+            pos += self.doc.get_point().distance_after(pt) or 0
+            if converged and (k := converged(pos)) is not None:
+                return starts, k
+
+    def _long_line(self, start: Location, end: Location, n: int) -> bool:
+        # lines never break at anchors
+        return False
@@ -0,0 +1,233 @@
+# A hex dump view of the document, with fixed rows of bytes
+from bisect import bisect_right
+from time import perf_counter
+
+from .display import Display, Row, glyphs, reverse
+from .document import Document
+from .location import Location
+from .piece import Piece
+from .screen import Screen, Span
+from . import tracing
+
+
+class HexDisplay(Display):
+    """
+    Shows the encoded document as rows of `width` bytes with offset, hex and ascii columns,
+    like `hexdump -C`.  Row r always starts at byte r * width, so moving by
+    rows or pages or jumping to an offset is arithmetic and a piece walk,
+    with no formatting, ladder or line index however big the document.
+    The point is still a character location, shown on the first byte of its character.
+    We index the byte offset of each piece the first time we need it after a change,
+    so painting doesn't walk or re-encode the whole chain.
+    """
+    def __init__(self, doc: Document, scr: Screen, fname: str = '', guard_rows: int=3, preferred_row: int=0):
+        super().__init__(doc, scr, fname, guard_rows, preferred_row)
+        self.top_row: int | None = None     # first row on screen, like preferred_top
+        self.point_byte = 0                 # byte offset of the point and size at last paint, for status
+        self.size = 0
+        self.pieces: list[Piece] = []           # the piece chain, with the byte offset each starts at
+        self.piece_bytes: list[int] = []
+        self.piece_index: dict[Piece, int] = {}
+        self.layout(8)
+
+    def change_handler(self, start: Location, end: Location):
+        # rows depend only on byte offsets, which we'll index again when we need them
+        self.piece_bytes = []
+
+    def index_bytes(self) -> list[int]:
+        """Return the byte offset of each piece, and the length of the document, indexing them if they changed"""
+        if not self.piece_bytes:
+            self.pieces.clear()
+            self.piece_index.clear()
+            n = 0
+            p: Piece | None = self.doc.get_start().piece
+            while p is not None:
+                self.piece_index[p] = len(self.pieces)
+                self.pieces.append(p)
+                self.piece_bytes.append(n)
+                _, start, end = p.byte_span()
+                n += end - start
+                p = p.next
+            self.piece_bytes.append(n)
+        return self.piece_bytes
+
+    def byte_length(self) -> int:
+        return self.index_bytes()[-1]
+
+    def byte_position(self, loc: Location) -> int:
+        """Return the offset in the encoded document of the start of the character at loc"""
+        offsets = self.index_bytes()
+        p, offset = loc.tuple()
+        src, start = p.ref()
+        return offsets[self.piece_index[p]] + src.byte_offset(start + offset) - src.byte_offset(start)
+
+    def byte_location(self, b: int) -> Location:
+        """Return the location of the character containing byte b of the encoded document, or the end"""
+        offsets = self.index_bytes()
+        if b >= offsets[-1]:
+            return Location(self.pieces[-1])
+        i = bisect_right(offsets, b) - 1
+        p = self.pieces[i]
+        src, start, _ = p.byte_span()
+        return Location(p, src.char_offset(start + b - offsets[i]) - p.ref()[1])
+
+    def get_bytes(self, b: int, n: int) -> bytes:
+        """Return up to n bytes of the encoded document starting at byte b"""
+        offsets = self.index_bytes()
+        parts: list[bytes] = []
+        i = bisect_right(offsets, b) - 1
+        while n > 0 and i < len(self.pieces):
+            src, start, end = self.pieces[i].byte_span()
+            a = start + b - offsets[i]
+            data = src.byte_slice(a, min(a + n, end))
+            parts.append(data)
+            n -= len(data)
+            b = offsets[i + 1]
+            i += 1
+        return b''.join(parts)
+
+    def settle(self):
+        # _move_rows has already moved to the preferred column
+        if self.pin_preferred_col:
+            self.pin_preferred_col = False
+            self.col_point = (self.doc.get_point(), self.doc.generation)
+
+    def point_column(self) -> int:
+        return self.byte_position(self.doc.get_point()) % self.width
+
+    def layout(self, digits: int):
+        """Fit as many bytes to a row as we can, a power of two up to 16, with offsets of the given width"""
+        self.digits = digits
+        self.width = 16
+        while self.width > 1 and len(self.format_row(0, bytes(self.width))) > self.cols:
+            self.width //= 2
+        self.hex_cols = [digits + 2 + 3 * j + (j >= 8) for j in range(self.width)]
+        end = len(self.format_row(0, b''))
+        self.ascii_cols = [end - 1 + j for j in range(self.width)]
+
+    def format_row(self, offset: int, data: bytes) -> str:
+        """Format a row like '00000010  68 65 6c 6c 6f 0a ...  |hello.|'"""
+        cells = [f'{b:02x} ' for b in data] + ['   '] * (self.width - len(data))
+        if self.width > 8:
+            cells[8] = ' ' + cells[8]
+        text = ''.join(chr(b) if 32 <= b < 127 else '.' for b in data)
+        return f"{offset:0{self.digits}x}  {''.join(cells)} |{text}|"
+
+    ### External interface
+
+    def recenter(self):
+        self.top_row = None
+        self.invalidate()
+
+    def move_to_offset(self, b: int):
+        """Move the point to the character containing byte b, clamped to the document"""
+        self.doc.set_point(self.byte_location(max(b, 0)))
+
+    def _move_rows(self, n: int):
+        self.track_column()
+        b = self.byte_position(self.doc.get_point())
+        self.move_to_offset((b // self.width + n) * self.width + self.preferred_col)
+        self.pin_preferred_col = True
+
+    def move_start_line(self):
+        b = self.byte_position(self.doc.get_point())
+        self.move_to_offset(b - b % self.width)
+
+    def move_end_line(self):
+        b = self.byte_position(self.doc.get_point())
+        self.move_to_offset(b - b % self.width + self.width - 1)
+
+    def move_forward_line(self):
+        self._move_rows(1)
+
+    def move_backward_line(self):
+        if self.byte_position(self.doc.get_point()) >= self.width:
+            self._move_rows(-1)
+
+    def move_forward_page(self):
+        self._move_rows(self.rows)
+
+    def move_backward_page(self):
+        self._move_rows(-min(self.rows, self.byte_position(self.doc.get_point()) // self.width))
+
+    def move_to_fraction(self, fraction: float):
+        b = int(fraction * self.byte_length())
+        self.move_to_offset(b - b % self.width)
+        self.recenter()
+
+    def status_fields(self, cursor: tuple[int, int]) -> list[str]:
+        fname = ('*' if self.doc.dirty else '') + f'{self.fname}'
+        pt_pieces, all_pieces = self.doc.piece_counts()
+        pt_edits, all_edits = self.doc.edit_counts()
+        return [
+            f"{fname}",
+            f"ch ${ord(self.doc.get_char() or '\0'):02x}",
+            f"off {self.point_byte:x}/{self.size:x}",
+            *([f"load {self.doc.loader.progress:.0%}"] if self.doc.loader else []),
+            f"pcs {pt_pieces}/{all_pieces}",
+            f"eds {pt_edits}/{all_edits}",
+        ]
+
+    def find_top_row(self, row: int) -> int:
+        """Return the top row to show the point's row, keeping the previous top if we can"""
+        top = self.top_row
+        if top is None or not top <= row < top + self.rows:
+            top = row - self.preferred_row
+        else:
+            top = max(min(top, row - self.guard_rows), row - (self.rows - self.guard_rows - 1))
+        self.top_row = max(top, 0)
+        return self.top_row
+
+    def paint(self, mark: Location|None=None):
+        trace = tracing.paint.enabled
+        t = perf_counter() if trace else 0.0
+
+        self.size = self.byte_length()
+        self.point_byte = pt = self.byte_position(self.doc.get_point())
+        mark_b = self.byte_position(mark) if mark else pt
+        lo, hi = min(pt, mark_b), max(pt, mark_b)
+
+        digits = max(8, len(f'{self.size:x}'))
+        if digits != self.digits:
+            self.layout(digits)
+        k = self.width
+
+        top = self.find_top_row(pt // k)
+        data = self.get_bytes(top * k, self.rows * k)
+        if trace:
+            t = tracing.paint.lap('find_top', t)
+
+        frame: list[Row] = []
+        starts: list[int] = []
+        for row in range(self.rows):
+            start = (top + row) * k
+            starts.append(start)
+            text = self.format_row(start, data[row * k:(row + 1) * k]) if start <= self.size else ''
+            spans: list[Span] = []
+            a, b = max(lo, start) - start, min(hi, start + k) - start
+            if a < b:
+                spans = [(self.hex_cols[a], self.hex_cols[b-1] + 2), (self.ascii_cols[a], self.ascii_cols[b-1] + 1)]
+            frame.append((text[:self.cols].ljust(self.cols), reverse(self.blank, spans)))
+
+        cursor = (pt // k - top, self.hex_cols[pt % k])
+        if not self.pin_preferred_col:
+            self.preferred_col = pt % k
+        else:
+            self.pin_preferred_col = False
+        self.col_point = (self.doc.get_point(), self.doc.generation)
+
+        status = self.status_message(cursor)[:self.cols]
+        frame.append((status.translate(glyphs), reverse(self.blank[:len(status)], [(0, len(status))])))
+
+        if trace:
+            t = tracing.paint.lap('format', t)
+
+        self.scroll_frame(starts)
+        self.refresh_frame(frame)
+
+        self.scr.move(*cursor)
+        self.scr.refresh()
+
+        if trace:
+            tracing.paint.lap('refresh', t)
+            tracing.paint.count('frames')
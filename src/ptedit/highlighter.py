@@ -0,0 +1,324 @@
+# Syntax highlighting, lexing a line at a time from cached lexer states
+from collections import OrderedDict
+from enum import IntEnum
+import keyword
+import os
+import re
+from typing import Hashable, Iterator
+
+from .document import Document
+from .lineindex import LineIndex
+from .location import Location
+
+
+class Style(IntEnum):
+    """How to show a token.  Screens color each style from a palette, see screen.palette"""
+    PLAIN = 0
+    KEYWORD = 1
+    STRING = 2
+    COMMENT = 3
+    NUMBER = 4
+    NAME = 5
+
+
+State = Hashable
+Token = tuple[int, int, Style]              # [start, end) of a styled run of text
+Rule = tuple[str, Style, State | None]      # a pattern, the style of its matches and the state to switch to
+Lexed = tuple[State, int, list[Token], State]   # state before, length, tokens and state after a line
+
+
+class Lexer:
+    """
+    A lexer splits a line of text, including its newline, into styled tokens
+    given the state the previous line left it in, returning the state for the next line.
+    States must be equal exactly when lexing would carry on the same way,
+    so the highlighter can tell when it's caught up with what it lexed before an edit.
+    """
+    initial: State = 'root'
+
+    def lex(self, line: str, state: State) -> tuple[list[Token], State]:
+        raise NotImplementedError
+
+
+class RegexLexer(Lexer):
+    """
+    A lexer defined by a list of rules for each state, tried in order at each position.
+    Text that no rule matches is plain.  Rules mustn't match the empty string.
+    A ^ only matches at the start of the line.
+    """
+    rules: dict[State, list[Rule]] = {}
+
+    def __init__(self):
+        self.patterns = {
+            state: re.compile('|'.join(f'(?P<r{i}>{rule[0]})' for i, rule in enumerate(rules)), re.DOTALL)
+            for state, rules in self.rules.items()
+        }
+
+    def lex(self, line: str, state: State) -> tuple[list[Token], State]:
+        tokens: list[Token] = []
+        pos = 0
+        while pos < len(line) and (m := self.patterns[state].search(line, pos)):
+            assert m.lastgroup
+            _, style, next_state = self.rules[state][int(m.lastgroup[1:])]
+            if style:
+                tokens.append((m.start(), m.end(), style))
+            if next_state is not None:
+                state = next_state
+            pos = m.end()
+        return tokens, state
+
+
+def _string_rules(quote: str) -> list[Rule]:
+    """Rules for the rest of a triple-quoted string, which can span lines"""
+    return [
+        (rf'(?:[^{quote}\\]|\\.|{quote}(?!{quote}{quote}))*{quote * 3}', Style.STRING, 'root'),
+        (r'.+', Style.STRING, None),
+    ]
+
+
+class PythonLexer(RegexLexer):
+    prefix = '[rRbBuUfF]{0,2}'
+    rules = {
+        'root': [
+            (r'#.*', Style.COMMENT, None),
+            (f'{prefix}"""', Style.STRING, '"'),
+            (f"{prefix}'''", Style.STRING, "'"),
+            (rf'{prefix}"(?:[^"\\\n]|\\.)*"?', Style.STRING, None),
+            (rf"{prefix}'(?:[^'\\\n]|\\.)*'?", Style.STRING, None),
+            (rf"\b(?:{'|'.join(keyword.kwlist)})\b", Style.KEYWORD, None),
+            (r'\b(?:0[xXoObB][0-9a-fA-F_]+|\d[\d_]*\.?[\d_]*(?:[eE][+-]?\d+)?j?)', Style.NUMBER, None),
+            (r'@\w+(?:\.\w+)*', Style.NAME, None),
+            (r'[^\W\d]\w*', Style.PLAIN, None),
+        ],
+        '"': _string_rules('"'),
+        "'": _string_rules("'"),
+    }
+
+
+class ConfigLexer(RegexLexer):
+    """For ini, toml and similar files of keys and values, perhaps in [sections]"""
+    rules = {
+        'root': [
+            (r'^[ \t]*[#;].*', Style.COMMENT, None),
+            (r'^[ \t]*\[[^\]\n]*\]', Style.KEYWORD, None),
+            (r'^[ \t]*[^\s#;=:\[][^=:\n]*?(?=[ \t]*[=:])', Style.NAME, None),
+            (r'"(?:[^"\\\n]|\\.)*"?|\'[^\'\n]*\'?', Style.STRING, None),
+            (r'(?i:\b(?:true|false|yes|no|on|off|null|none)\b)', Style.KEYWORD, None),
+            (r'\b\d[\w.:-]*', Style.NUMBER, None),
+            (r'\w+', Style.PLAIN, None),
+        ],
+    }
+
+
+# lexers by file extension; add to this to highlight other kinds of file
+lexers: dict[str, type[Lexer]] = {
+    '.py': PythonLexer,
+    '.ini': ConfigLexer,
+    '.cfg': ConfigLexer,
+    '.conf': ConfigLexer,
+    '.toml': ConfigLexer,
+    '.properties': ConfigLexer,
+}
+
+
+class Highlighter:
+    """
+    Styles document text with a lexer, a line at a time.  Lines longer than stride
+    are cut into pieces of stride characters which we treat as lines.
+    The state at the start of a line depends on everything before it, so like the
+    Formatter's ladder we cache it at anchors: the first line start at least stride
+    past the previous anchor.  Their offsets are held in a LineIndex so edits shift them cheaply,
+    and the anchors run from the start of the document to as far as we've lexed.
+    We also cache recently lexed lines by offset, so repainting the screen usually lexes nothing.
+
+    After an edit we re-lex from the start of the line it touched until we reach
+    a line we've cached, or an anchor, with the same state as we now have there,
+    usually the next line.  Everything after that is as before, only shifted.
+    """
+    stride = 1 << 12        # characters between anchors, and the longest line we lex at once
+    horizon = 1 << 20       # how far past the last anchor we'll lex to reach the screen, rather than guess
+    budget = 1 << 16        # how much we'll re-lex after an edit before leaving the rest until it's needed
+    cache_size = 512
+
+    def __init__(self, doc: Document, lexer: Lexer):
+        self.doc = doc
+        self.lexer = lexer
+        self.anchors = LineIndex()
+        self.states: list[State] = [lexer.initial]      # state at each anchor
+        self.lines: OrderedDict[int, Lexed] = OrderedDict()
+        self.length = len(doc)
+        self.n_lexed = 0            # characters lexed, for performance testing
+        doc.watch(self.change_handler)
+
+    def read_lines(self, loc: Location, pos: int) -> Iterator[tuple[int, str]]:
+        """Yield the offset and text of each line starting from loc, which is at offset pos"""
+        p, offset = loc.tuple()
+        buf, i = '', 0
+        while True:
+            k = buf.find('\n', i, i + self.stride)
+            if k < 0 and len(buf) - i < self.stride and p.next is not None:
+                # read more, leaving room for a whole line
+                chunk = p.slice(offset, offset + 4 * self.stride)
+                buf, i = buf[i:] + chunk, 0
+                offset += len(chunk)
+                if offset == len(p):
+                    p, offset = p.next, 0
+                continue
+            end = k + 1 if k >= 0 else min(i + self.stride, len(buf))
+            if end == i:
+                return
+            yield pos, buf[i:end]
+            pos += end - i
+            i = end
+
+    def lex(self, pos: int, line: str, state: State, cache: bool = True) -> Lexed:
+        """Lex a line starting at pos, caching the result"""
+        tokens, after = self.lexer.lex(line, state)
+        self.n_lexed += len(line)
+        lexed = (state, len(line), tokens, after)
+        if cache:
+            self.lines[pos] = lexed
+            if len(self.lines) > self.cache_size:
+                self.lines.popitem(last=False)
+        return lexed
+
+    def runs(self, loc: Location, start: int, end: int) -> list[Token]:
+        """
+        Return the styled runs of text between offsets start and end, where loc is the location of start,
+        lexing from the last line start before it whose state we know.
+        """
+        k = self.anchors.line(start)
+        pos, state = self.anchors.offset(k), self.states[k]
+        guess = k == len(self.anchors) - 1 and start - pos > self.horizon
+        if guess:
+            # rather than lex everything in between, start from a nearby line in the initial state
+            pos, state = start - self.nearby_bol(loc), self.lexer.initial
+        extend = k == len(self.anchors) - 1 and not guess
+        anchors: list[int] = []
+        states: list[State] = []
+        last = pos
+
+        runs: list[Token] = []
+        lines: Iterator[tuple[int, str]] | None = None
+        while pos < end:
+            lexed = None if guess else self.lines.get(pos)
+            if lexed is not None and lexed[0] == state:
+                # a line we've lexed in the same state, so we needn't even read it
+                self.lines.move_to_end(pos)
+                lines = None
+            else:
+                if lines is None:
+                    lines = self.read_lines(loc.move(pos - start), pos)
+                line = next(lines, None)
+                if line is None:
+                    break
+                lexed = self.lex(pos, line[1], state, not guess)
+            if extend and pos - last >= self.stride:
+                anchors.append(pos)
+                states.append(state)
+                last = pos
+            state, n, tokens = lexed[3], lexed[1], lexed[2]
+            runs.extend((pos + a, pos + b, style) for a, b, style in tokens if pos + b > start and pos + a < end)
+            pos += n
+        if anchors:
+            n = len(self.anchors)
+            self.anchors.replace(n, n, anchors, 0)
+            self.states += states
+        return runs
+
+    def nearby_bol(self, loc: Location) -> int:
+        """Return how far before loc the line containing it starts, looking back at most stride characters"""
+        p, offset = loc.tuple()
+        n = 0
+        while n < self.stride and p.prev is not None:
+            s = p.slice(max(offset - (self.stride - n), 0), offset)
+            k = s.rfind('\n')
+            if k >= 0:
+                return n + len(s) - k - 1
+            n += len(s)
+            p = p.prev
+            offset = len(p)
+        return n
+
+    def change_handler(self, start: Location, end: Location):
+        """
+        Re-lex from the start of the first line the change touched until we converge
+        with a line or anchor lexed before the change, shifting everything after it.
+        If we don't converge within budget, or there's nothing left to converge with,
+        we forget everything after the change and lex it again when it's needed.
+        """
+        n = len(self.doc)
+        delta, self.length = n - self.length, n
+        s, e = start.position(), end.position()
+        if self.doc.loading:
+            # the document is growing, so the last line might be longer
+            for pos in [pos for pos, lexed in self.lines.items() if pos + lexed[1] >= s]:
+                del self.lines[pos]
+            return
+
+        # resume from the last line start we know at or before s, and split the cache
+        # into lines before the change and those after it, which we shift
+        k = self.anchors.line(s)
+        pos, state = self.anchors.offset(k), self.states[k]
+        before: OrderedDict[int, Lexed] = OrderedDict()
+        after: dict[int, Lexed] = {}
+        for p, lexed in self.lines.items():
+            if p <= s and p > pos:
+                pos, state = p, lexed[0]
+            if p + lexed[1] < s:
+                before[p] = lexed
+            elif p >= e - delta:
+                after[p + delta] = lexed
+        self.lines = before
+
+        anchors: list[int] = []
+        states: list[State] = []
+        last = self.anchors.offset(k)
+        converged = None
+        lexed_from = pos
+        # past these there's nothing from before the change we could converge with
+        frontier = self.anchors.offset(len(self.anchors) - 1)
+        last_after = max(after, default=-1)
+        for pos, line in self.read_lines(start.move(pos - s), pos):
+            if pos >= e:
+                # have we caught up with an anchor or line from before the change?
+                j = self.anchors.find(pos - delta) if pos - delta > s else None
+                if j is not None and self.states[j] == state:
+                    converged = j
+                    break
+                if pos in after and after[pos][0] == state:
+                    # anchors from here on are good, as are any at or before s
+                    j = self.anchors.line(pos - delta)
+                    converged = max(j + (self.anchors.offset(j) < pos - delta), k + 1)
+                    break
+                if pos - delta > frontier and pos > last_after:
+                    break
+            if pos - lexed_from > self.budget:
+                break
+            if pos - last >= self.stride:
+                anchors.append(pos)
+                states.append(state)
+                last = pos
+            state = self.lex(pos, line, state)[3]
+        else:
+            # we lexed to the end, so nothing from before the change is left
+            converged = len(self.anchors)
+            after = {}
+
+        if converged is None:
+            # leave the rest until it's needed
+            self.anchors.replace(k + 1, len(self.anchors), anchors, 0)
+            del self.states[k + 1:]
+            self.states += states
+            return
+        self.anchors.replace(k + 1, converged, anchors, delta)
+        self.states[k + 1:converged] = states
+        for p, lexed in after.items():
+            if p >= pos:
+                self.lines[p] = lexed
+
+
+def highlighter_for(doc: Document, fname: str) -> Highlighter | None:
+    """Return a highlighter for a file whose extension we have a lexer for"""
+    cls = lexers.get(os.path.splitext(fname)[1].lower())
+    return Highlighter(doc, cls()) if cls else None
@@ -0,0 +1,84 @@
+from array import array
+from bisect import bisect_right
+from typing import Iterable
+
+
+class LineIndex:
+    """
+    A LineIndex records the document offset where each visual line begins.
+    Offsets are stored in blocks of up to block_size lines, each block
+    holding offsets relative to its first line.  Shifting every line after
+    an edit only touches the block bases, and lookups in either direction
+    are a pair of binary searches.
+    """
+    block_size = 512
+
+    def __init__(self, starts: Iterable[int] = (0,)):
+        self.blocks: list[array[int]] = []
+        self.bases: list[int] = []      # absolute offset of each block's first line
+        self.firsts: list[int] = []     # line number of each block's first line
+        self._chunk(list(starts) or [0])
+        self._renumber()
+
+    def __len__(self) -> int:
+        return self.firsts[-1] + len(self.blocks[-1])
+
+    def offset(self, k: int) -> int:
+        """Return the offset of the start of visual line k"""
+        assert 0 <= k < len(self), f"LineIndex: no line {k}"
+        i = bisect_right(self.firsts, k) - 1
+        return self.bases[i] + self.blocks[i][k - self.firsts[i]]
+
+    def line(self, offset: int) -> int:
+        """Return the visual line containing offset"""
+        i = max(bisect_right(self.bases, offset) - 1, 0)
+        j = max(bisect_right(self.blocks[i], offset - self.bases[i]) - 1, 0)
+        return self.firsts[i] + j
+
+    def find(self, offset: int) -> int | None:
+        """Return the visual line starting exactly at offset, if any"""
+        k = self.line(offset)
+        return k if self.offset(k) == offset else None
+
+    def replace(self, first: int, last: int, starts: list[int], delta: int):
+        """
+        Replace lines [first, last) by the lines beginning at starts,
+        and shift the following lines by delta
+        """
+        n = len(self)
+        assert 0 <= first <= last <= n
+        lo = bisect_right(self.firsts, min(first, n-1)) - 1
+        hi = bisect_right(self.firsts, max(min(last, n) - 1, first)) - 1
+
+        # flatten the affected blocks, splice, and re-chunk
+        flat: list[int] = []
+        for i in range(lo, hi+1):
+            flat.extend(self.bases[i] + v for v in self.blocks[i])
+        f = self.firsts[lo]
+        flat = flat[:first-f] + starts + [v + delta for v in flat[last-f:]]
+
+        tail_blocks, tail_bases = self.blocks[hi+1:], [b + delta for b in self.bases[hi+1:]]
+        del self.blocks[lo:], self.bases[lo:]
+        self._chunk(flat)
+        self.blocks += tail_blocks
+        self.bases += tail_bases
+        assert self.blocks and self.bases[0] == 0, "LineIndex: lost the first line"
+        self._renumber()
+
+    def _chunk(self, flat: list[int]):
+        """Append blocks of roughly equal size holding the offsets in flat"""
+        if not flat:
+            return
+        k = max(1, -(-len(flat) // self.block_size))      # ceil
+        size = -(-len(flat) // k)
+        for i in range(0, len(flat), size):
+            base = flat[i]
+            self.blocks.append(array('q', (v - base for v in flat[i:i+size])))
+            self.bases.append(base)
+
+    def _renumber(self):
+        self.firsts = [0] * len(self.blocks)
+        n = 0
+        for i, block in enumerate(self.blocks):
+            self.firsts[i] = n
+            n += len(block)
@@ -0,0 +1,110 @@
+# Open files either all at once or progressively, reading the tail in the background
+import os
+from queue import Queue, Empty
+from threading import Thread
+from typing import BinaryIO, Iterator
+
+from .document import Document
+from .piece import encoding, errors, char_boundary
+
+
+class Loader:
+    """
+    Reads the rest of an open file in chunks on a background thread.
+    The document appends chunks as they arrive, and waits for all of
+    them before its first edit.
+    """
+    def __init__(self, f: BinaryIO, size: int, carry: bytes = b'', chunk_size: int = 1 << 22):
+        self.size = size
+        self.loaded = f.tell() - len(carry)
+        self.carry = carry      # an incomplete character left over from the previous chunk
+        self.done = False
+        self.queue: Queue[bytes] = Queue(maxsize=8)    # bound how far reading gets ahead
+        self.thread = Thread(target=self._read, args=(f, chunk_size), daemon=True)
+        self.thread.start()
+
+    def _read(self, f: BinaryIO, chunk_size: int):
+        with f:
+            while data := f.read(chunk_size):
+                self.queue.put(data)
+        self.queue.put(b'')     # eof
+
+    def chunks(self, wait: bool = False) -> Iterator[bytes]:
+        """Yield the chunks read so far, or all remaining chunks if wait, split between characters"""
+        while not self.done:
+            try:
+                data = self.queue.get(block=wait)
+            except Empty:
+                return
+            if not data:
+                self.done = True
+                if self.carry:
+                    yield self.carry
+                return
+            self.loaded += len(data)
+            data = self.carry + data
+            n = char_boundary(data)
+            self.carry = data[n:]
+            if n:
+                yield data[:n]
+
+    @property
+    def progress(self) -> float:
+        return self.loaded / self.size if self.size else 1.0
+
+
+def open_document(
+        fname: str, progressive: bool = False, line: int = 0, context: int = 256, context_bytes: int = 1 << 19
+    ) -> Document:
+    """
+    Open fname with the point at the start of the given (0-based) line.
+    A progressive open only reads far enough to show that line with
+    some context before returning, leaving a Loader to fetch the rest.
+    The context is up to context lines, but no more than context_bytes
+    so a file of long lines, or none at all, isn't read whole.
+    """
+    if not progressive:
+        data = open(fname, 'rb').read()
+        doc = Document(data)
+        doc.move_point(line_offset(data, line))
+        return doc
+
+    size = os.path.getsize(fname)
+    f = open(fname, 'rb')
+    head = bytearray()
+    n = 0
+    start = 0 if not line else None     # where the line starts in head, once we've read that far
+    while data := f.read(1 << 16):
+        lines = data.count(b'\n')
+        if start is None and n + lines >= line:
+            i = -1
+            for _ in range(line - n):
+                i = data.find(b'\n', i + 1)
+            start = len(head) + i + 1
+        head += data
+        n += lines
+        if start is not None and (n >= line + context or len(head) - start >= context_bytes):
+            break
+    complete = len(head) >= size
+    k = len(head) if complete else char_boundary(head)
+    doc = Document(bytes(head[:k]))
+    if complete:
+        f.close()
+    else:
+        doc.loader = Loader(f, size, bytes(head[k:]))
+    doc.move_point(line_offset(head[:k], line))
+    return doc
+
+
+def line_offset(data: bytes | bytearray, line: int) -> int:
+    """Return the character offset of the start of the given line, or the end of the last line"""
+    if not line:
+        return 0
+    offset = 0
+    for _ in range(line):
+        i = data.find(b'\n', offset)
+        if i < 0:
+            offset = len(data)
+            break
+        offset = i + 1
+    return offset if data.isascii() else len(data[:offset].decode(encoding, errors))
@@ -2,6 +2,7 @@ from dataclasses import dataclass
 from typing import Self
 
 from .piece import Piece
+from . import tracing
 
 
 @dataclass
@@ -21,11 +22,15 @@ class Location:
     def position(self) -> int:
         """Find the offset relative to the start of the piece chain"""
         p, offset = self.tuple()
+        n = 0
         while True:
             p = p.prev
             if p is None:
                 break
             offset += len(p)
+            n += 1
+        if tracing.walk.enabled:
+            tracing.walk.count('pieces', n)
         return offset
 
     def is_start(self) -> bool:
@@ -51,10 +56,12 @@ class Location:
 
         offset = self.offset + delta
         p = self.piece
+        n = 0
         if offset > 0:
             while len(p) <= offset and p.next is not None:
                 offset -= len(p)
                 p = p.next
+                n += 1
             # did we fall off the end?
             if p.next is None:
                 offset = 0
@@ -62,9 +69,12 @@ class Location:
             while offset < 0 and p.prev is not None and len(p.prev) != 0:
                 p = p.prev
                 offset += len(p)
+                n += 1
             # did we hit the start?
             if offset < 0:
                 offset = 0
+        if tracing.walk.enabled:
+            tracing.walk.count('pieces', n)
 
         assert p is not None        # for the type checker
         return self.__class__(p, offset)
@@ -80,38 +90,71 @@ class Location:
     Here B is after A but A is *not* before B, and vice versa for C.
     And D and B are neither before or after each other.
     So instead we define before and after separately.
+
+    Pieces in the active chain do form a total order though, tracked
+    by their order labels, so we can compare live locations directly
+    and only walk the chain when one of them has been swapped out.
     """
 
+    def _order(self, other: Self) -> int | None:
+        """Compare two live locations, returning -1, 0 or 1, or None if either isn't live"""
+        p, q = self.piece, other.piece
+        if not (p.live and q.live):
+            return None
+        a, b = (p.label, self.offset), (q.label, other.offset)
+        return (a > b) - (a < b)
+
     def distance_before(self, other: Self) -> int | None:
         """if self is at or before other, returns positive distance, else None"""
+        if (self._order(other) or 0) > 0:
+            return None
         p = self.piece
         n = other.offset - self.offset
+        k = 0
         while p is not None and p != other.piece:
             n += len(p)
             p = p.next
+            k += 1
+        if tracing.walk.enabled:
+            tracing.walk.count('pieces', k)
         return n if p is not None and n >= 0 else None
 
     def is_at_or_before(self, other: Self) -> bool:
         """return true if our next links lead to other"""
+        order = self._order(other)
+        if order is not None:
+            return order <= 0
         return self.distance_before(other) is not None
 
     def is_strictly_before(self, other: Self) -> bool:
+        order = self._order(other)
+        if order is not None:
+            return order < 0
         d = self.distance_before(other)
         return d is not None and d > 0
 
     def distance_after(self, other: Self) -> int | None:
         """if self is at or after other, return positive distance, else None"""
+        if (self._order(other) or 0) < 0:
+            return None
         p = self.piece
         n = self.offset - other.offset
+        k = 0
         while p != other.piece:
             p = p.prev
             if p is None:
                 break
             n += len(p)
+            k += 1
+        if tracing.walk.enabled:
+            tracing.walk.count('pieces', k)
         return n if p is not None and n >= 0 else None
 
     def is_at_or_after(self, other: Self) -> bool:
         """return true if our prev links lead to other"""
+        order = self._order(other)
+        if order is not None:
+            return order >= 0
         return self.distance_after(other) is not None
 
     def within(self, start: Self, end: Self) -> bool:
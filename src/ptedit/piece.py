@@ -1,13 +1,44 @@
 from __future__ import annotations
+from array import array
+from bisect import bisect_right
 from typing import ClassVar, Self
 from dataclasses import dataclass
+from itertools import accumulate
 
 
 def snippet(s: str, n: int=8):
     return f"'{s}'" if len(s) <= n else f"'{s[:n-2]}...'"
 
 
-@dataclass(kw_only=True)
+label_gap = 1 << 32     # spacing between labels when we (re)number a run of pieces
+
+# documents are utf-8, with invalid bytes decoded as lone surrogates so they round-trip
+encoding = 'utf-8'
+errors = 'surrogateescape'
+
+
+# utf-8 byte classes: ascii, continuation, leads of 2, 3 and 4 byte sequences, and x for bytes that
+# are never valid or whose leads constrain the next byte (overlong forms, surrogates and beyond U+10FFFF)
+_utf8_classes = bytes(
+    ord('a') if b < 0x80 else ord('c') if b < 0xc0 else ord('2') if 0xc2 <= b < 0xe0
+    else ord('3') if 0xe1 <= b < 0xf0 and b != 0xed else ord('4') if 0xf1 <= b < 0xf4 else ord('x')
+    for b in range(256)
+)
+
+
+def char_boundary(data: bytes | bytearray) -> int:
+    """Return the length of data excluding any incomplete utf-8 character at the end"""
+    n = len(data)
+    for i in range(n - 1, max(n - 4, -1), -1):
+        b = data[i]
+        if b & 0xc0 != 0x80:
+            # a lead byte for a sequence of 2, 3 or 4 bytes that runs past the end?
+            need = 2 if b & 0xe0 == 0xc0 else 3 if b & 0xf0 == 0xe0 else 4 if b & 0xf8 == 0xf0 else 1
+            return i if i + need > n else n
+    return n
+
+
+@dataclass(kw_only=True, eq=False)
 class Piece:
     """
     A Piece represents a span of text in the document.
@@ -19,12 +50,21 @@ class Piece:
     next: Piece | None = None
     _len: int = 0
 
+    # Pieces in the active chain carry increasing order labels so we can compare
+    # locations without walking the chain.  Labels are stale when not live.
+    label: int = 0
+    live: bool = False
+
     id: int = 0             # for debugging it's useful to enumerate pieces
 
     @property
     def data(self) -> str:
         ...
 
+    def slice(self, start: int, end: int) -> str:
+        """Return data[start:end] without copying the rest of the data"""
+        ...
+
     def __bool__(self) -> bool:
         # Make any non-None instance is truthy
         # otherwise "if piece ..." checks for len() > 0
@@ -33,9 +73,25 @@ class Piece:
     def __len__(self) -> int:
         return self._len
 
-    def _ref(self) -> tuple[PrimaryPiece, int]:
+    def ref(self) -> tuple[PrimaryPiece, int]:
+        """Return the primary piece that owns our data, and our offset within it"""
         ...
 
+    def encode(self) -> bytes:
+        """Return our data encoded for saving"""
+        src, start = self.ref()
+        return src.encode_slice(start, start + len(self))
+
+    def newlines(self) -> int:
+        """Count the newlines in our data"""
+        src, start = self.ref()
+        return src.count_newlines(start, start + len(self))
+
+    def byte_span(self) -> tuple[PrimaryPiece, int, int]:
+        """Return the primary piece that owns our data, and the range of its encoded bytes we refer to"""
+        src, start = self.ref()
+        return src, src.byte_offset(start), src.byte_offset(start + len(self))
+
     def __post_init__(self):
         """Number pieces sequentially for debugging"""
         self.id = Piece._id
@@ -53,7 +109,7 @@ class Piece:
         the link *from* that neighbor isn't changed.  The internal link is empty.
         """
         assert 0 < offset < len(self)
-        src, start = self._ref()
+        src, start = self.ref()
         return SecondaryPiece(
             prev=self.prev,
             length=offset,
@@ -66,7 +122,7 @@ class Piece:
         Return the right hand pice of a split.
         """
         assert 0 < offset < len(self)
-        src, start = self._ref()
+        src, start = self.ref()
         return SecondaryPiece(
             next=self.next,
             length=len(self)-offset,
@@ -74,16 +130,77 @@ class Piece:
             start=start+offset
         )
 
+    def view(self, start: int, end: int) -> SecondaryPiece:
+        """Return an unlinked piece that shares our data[start:end] rather than copying it"""
+        assert 0 <= start < end <= len(self)
+        src, base = self.ref()
+        return SecondaryPiece(length=end-start, source=src, start=base+start)
+
     @staticmethod
     def link(before: Piece, after: Piece):
         before.next = after
         after.prev = before
 
+    @staticmethod
+    def splice(first: Piece, last: Piece):
+        """
+        Mark a fragment which was just linked into the active chain as live,
+        labelling it between its neighbors.  When there's no room we relabel
+        a window around the fragment, doubling it until the labels are sparse enough.
+        """
+        before, after = first.prev, last.next
+        assert before is not None and after is not None
+        n = 1
+        p = first
+        while p is not last:
+            assert p.next is not None
+            p.live = True
+            p = p.next
+            n += 1
+        last.live = True
+
+        left, right = before, after
+        count = n + 2           # pieces in the window including both ends
+        width = 1
+        while right.label - left.label < 4 * count:
+            if left.prev is None and right.next is None:
+                # the whole chain is crowded so make room at the end
+                right.label = left.label + count * label_gap
+                break
+            for _ in range(width):
+                if left.prev is not None:
+                    left = left.prev
+                    count += 1
+                if right.next is not None:
+                    right = right.next
+                    count += 1
+            width *= 2
+
+        gap = (right.label - left.label) // (count - 1)
+        label = left.label
+        p = left
+        while p is not right:
+            assert p.next is not None
+            p = p.next
+            label += gap
+            if p is not right:
+                p.label = label
+
+    @staticmethod
+    def retire(first: Piece, last: Piece):
+        """Mark a fragment which was just unlinked from the active chain"""
+        p = first
+        while p is not last:
+            assert p.next is not None
+            p.live = False
+            p = p.next
+        last.live = False
+
     def __repr__(self):
         return f"Piece(id={self.id}, prev={None if self.prev is None else self.prev.id}, next={None if self.next is None else self.next.id}, data[{len(self)}]={snippet(self.data)})"
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, eq=False)
 class PrimaryPiece(Piece):
     """
     A primary piece holds string data.
@@ -91,17 +208,48 @@ class PrimaryPiece(Piece):
     have no data.
     """
     _data: str = ''
+    shared: bool = False        # set once other pieces may outlive us, when we can no longer be trimmed
 
     def __init__(self, *, prev: Piece|None=None, next: Piece|None=None, data: str='', allow_empty: bool=False):
         super().__init__(prev=prev, next=next)
         assert allow_empty or data
+        self.ascii = True       # so byte and code point offsets agree (conservative after trimming)
         self.extend(data)
 
     @property
     def data(self) -> str:
         return self._data
 
+    def slice(self, start: int, end: int) -> str:
+        return self._data[start:end]
+
+    def encode_slice(self, start: int, end: int) -> bytes:
+        return self.slice(start, end).encode(encoding, errors)
+
+    def count_newlines(self, start: int, end: int) -> int:
+        """Count the newlines in data[start:end]"""
+        return self._data.count('\n', start, end)
+
+    def byte_offset(self, i: int) -> int:
+        """Return the offset in our encoded data of code point i"""
+        return min(i, self._len) if self.ascii else len(self.encode_slice(0, i))
+
+    def char_offset(self, b: int) -> int:
+        """Return the code point containing byte b of our encoded data"""
+        if self.ascii:
+            return min(b, self._len)
+        data = self.encode_slice(0, self._len)
+        if b < len(data) and data[b] & 0xc0 == 0x80:
+            # back up to the start of the character
+            b = char_boundary(data[:b])
+        return len(data[:b].decode(encoding, errors))
+
+    def byte_slice(self, start: int, end: int) -> bytes:
+        """Return bytes [start, end) of our encoded data"""
+        return self._data[start:end].encode() if self.ascii else self.encode_slice(0, self._len)[start:end]
+
     def trim(self, n: int) -> Self:
+        assert not self.shared, "can't trim data shared with other pieces"
         self._data = self._data[n:] if n>0 else self._data[:n]
         self._len -= abs(n)
         return self
@@ -109,12 +257,13 @@ class PrimaryPiece(Piece):
     def extend(self, s: str):
         self._data += s
         self._len += len(s)
+        self.ascii = self.ascii and s.isascii()
 
-    def _ref(self) -> tuple[PrimaryPiece, int]:
+    def ref(self) -> tuple[PrimaryPiece, int]:
         return self, 0
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, eq=False)
 class SecondaryPiece(Piece):
     """
     A secondary piece represents a subset of a (single) primary piece,
@@ -127,15 +276,153 @@ class SecondaryPiece(Piece):
         self._len = length
         assert self._len > 0 and self._start + self._len <= len(self._src)
 
-    def _ref(self) -> tuple[PrimaryPiece, int]:
+    def ref(self) -> tuple[PrimaryPiece, int]:
         return self._src, self._start
 
     @property
     def data(self) -> str:
-        return self._src.data[self._start:][:self._len]
+        return self._src.slice(self._start, self._start + self._len)
+
+    def slice(self, start: int, end: int) -> str:
+        end = min(end, self._len)
+        return self._src.slice(self._start + start, self._start + end) if start < end else ''
 
     def trim(self, n: int) -> Self:
         self._start += max(0,n)
         self._len -= abs(n)
         assert self._len > 0 and self._start + self._len <= len(self._src)
-        return self
\ No newline at end of file
+        return self
+
+class SourcePiece(PrimaryPiece):
+    """
+    A source piece holds raw bytes read from a file, decoding them on demand.
+    Offsets still count code points.  ASCII-only data indexes directly.
+    Otherwise we checkpoint the start of the first character in each
+    block of block_size bytes along with the number of code points before it,
+    so a slice only decodes the blocks it overlaps.  The last decoded block
+    is kept so stepping a character at a time is cheap.
+    We also count the newlines before each block of raw bytes, so counting
+    the lines in any part of the piece only scans the bytes at either end.
+    Source pieces are never trimmed or extended.
+    The offset is where the raw data started in the source file.
+    """
+    block_size: ClassVar[int] = 1 << 12
+
+    def __init__(self, *, raw: bytes, offset: int=0, prev: Piece|None=None, next: Piece|None=None):
+        Piece.__init__(self, prev=prev, next=next)
+        assert raw
+        self._raw = raw
+        self.offset = offset
+        self.ascii = raw.isascii()
+        self._bytes = array('q')        # byte offset of each checkpoint
+        self._points = array('q')       # code points before each checkpoint
+        self._block: tuple[int, str] = (-1, '')
+        # a newline byte is never part of a longer character, even in invalid utf-8
+        self._newlines = array('q', accumulate(
+            (raw.count(b'\n', b, b + self.block_size) for b in range(0, len(raw), self.block_size)), initial=0
+        ))
+        if self.ascii:
+            self._len = len(raw)
+        else:
+            self._index()
+
+    def _index(self):
+        raw, size = self._raw, self.block_size
+        b, n = 0, 0
+        while b < len(raw):
+            self._bytes.append(b)
+            self._points.append(n)
+            # end the block at the start of a character (unless it's invalid anyway)
+            e = min(b + size, len(raw))
+            for _ in range(3):
+                if e < len(raw) and raw[e] & 0xc0 == 0x80:
+                    e += 1
+            n += self._count(raw[b:e])
+            b = e
+        self._bytes.append(len(raw))
+        self._points.append(n)
+        self._len = n
+
+    @staticmethod
+    def _count(block: bytes) -> int:
+        """
+        Count the code points in a block without decoding it when we can.
+        Valid utf-8 has one per byte that isn't a continuation byte, but surrogateescape
+        makes each byte of an invalid sequence a code point, continuation bytes included.
+        Python can't check for those any faster than it decodes, so we decode blocks
+        that have continuation bytes which aren't all accounted for by lead bytes.
+        """
+        if block.isascii():
+            return len(block)
+        classes = block.translate(_utf8_classes)
+        follow = classes.count(b'c')
+        if (follow == classes.count(b'2') + 2 * classes.count(b'3') + 3 * classes.count(b'4')
+                and b'x' not in classes and not classes.startswith(b'c')
+                and b'ac' not in classes and b'2cc' not in classes and b'3ccc' not in classes and b'cccc' not in classes):
+            return len(block) - follow
+        return len(block.decode(encoding, errors))
+
+    def _decode(self, k: int) -> str:
+        """Decode checkpoint block k"""
+        if self._block[0] != k:
+            self._block = (k, self._raw[self._bytes[k]:self._bytes[k+1]].decode(encoding, errors))
+        return self._block[1]
+
+    @property
+    def data(self) -> str:
+        return self.slice(0, self._len)
+
+    def slice(self, start: int, end: int) -> str:
+        if self.ascii:
+            return self._raw[start:end].decode('ascii')
+        end = min(end, self._len)
+        if start >= end:
+            return ''
+        k = bisect_right(self._points, start) - 1
+        parts: list[str] = []
+        while self._points[k] < end:
+            base = self._points[k]
+            parts.append(self._decode(k)[max(start - base, 0):end - base])
+            k += 1
+        return ''.join(parts)
+
+    def byte_offset(self, i: int) -> int:
+        """Return the offset in the raw data of code point i"""
+        if i >= self._len:
+            return len(self._raw)
+        if self.ascii:
+            return i
+        k = bisect_right(self._points, i) - 1
+        return self._bytes[k] + len(self._decode(k)[:i - self._points[k]].encode(encoding, errors))
+
+    def encode_slice(self, start: int, end: int) -> bytes:
+        return self._raw[self.byte_offset(start):self.byte_offset(end)]
+
+    def count_newlines(self, start: int, end: int) -> int:
+        return self._newlines_before(self.byte_offset(end)) - self._newlines_before(self.byte_offset(start))
+
+    def _newlines_before(self, b: int) -> int:
+        """Count the newlines in the first b raw bytes"""
+        if b >= len(self._raw):
+            return self._newlines[-1]
+        k = b // self.block_size
+        return self._newlines[k] + self._raw.count(b'\n', k * self.block_size, b)
+
+    def char_offset(self, b: int) -> int:
+        if self.ascii or b >= len(self._raw):
+            return min(b, self._len)
+        k = bisect_right(self._bytes, b) - 1
+        if self._raw[b] & 0xc0 == 0x80:
+            # back up to the start of the character
+            start = max(self._bytes[k], b - 3)
+            b = start + char_boundary(self._raw[start:b])
+        return self._points[k] + len(self._raw[self._bytes[k]:b].decode(encoding, errors))
+
+    def byte_slice(self, start: int, end: int) -> bytes:
+        return self._raw[start:end]
+
+    def trim(self, n: int) -> Self:
+        raise TypeError("SourcePiece is immutable")
+
+    def extend(self, s: str):
+        raise TypeError("SourcePiece is immutable")
@@ -0,0 +1,139 @@
+# Save documents over their files, rewriting only the part that changed when we safely can
+import errno
+import os
+import shutil
+
+from .document import Document
+
+
+# errors meaning a way of copying between files isn't supported here, so try the next
+unsupported = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSOCK}
+
+
+def _copy_file_range(src: int, dst: int, offset: int, n: int) -> int:
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, 'no copy_file_range')
+    return os.copy_file_range(src, dst, n, offset)
+
+
+def _sendfile(src: int, dst: int, offset: int, n: int) -> int:
+    return os.sendfile(dst, src, offset, n)
+
+
+def _pread(src: int, dst: int, offset: int, n: int) -> int:
+    return os.write(dst, os.pread(src, min(n, 1 << 20), offset))
+
+
+def copy_range(src: int, dst: int, offset: int, n: int):
+    """
+    Copy n bytes from offset in file src to the current position of file dst.
+    We ask the kernel to copy them, which on some filesystems just shares the blocks,
+    falling back to sendfile and finally reading and writing a chunk at a time.
+    """
+    for method in (_copy_file_range, _sendfile, _pread):
+        try:
+            while n > 0:
+                k = method(src, dst, offset, n)
+                if not k:
+                    raise OSError(f"source file ends before byte {offset}")
+                offset += k
+                n -= k
+            return
+        except OSError as e:
+            if e.errno not in unsupported:
+                raise
+
+
+def write_atomic(doc: Document, fname: str, source: int | None = None, intact: int = 0) -> int:
+    """
+    Write doc to a temporary copy and rename it over fname, so a failure leaves the file as it was.
+    If source is an open file whose first intact bytes are still the document source,
+    unchanged source bytes are copied from it by copy_range rather than through Python.
+    We write through a symlink to the file it points at, and keep the file's permissions.
+    Returns the number of bytes written.
+    """
+    fname = os.path.realpath(fname)
+    tmp = fname + '.ptedit~'
+    try:
+        with open(tmp, 'wb') as f:
+            def copy(offset: int, n: int) -> bool:
+                if source is None or offset + n > intact:
+                    return False
+                f.flush()
+                copy_range(source, f.fileno(), offset, n)
+                return True
+
+            doc.write(f, copy=copy)
+            f.flush()
+            written = os.fstat(f.fileno()).st_size
+        if os.path.exists(fname):
+            shutil.copymode(fname, tmp)
+        os.replace(tmp, fname)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return written
+
+
+class Saver:
+    """
+    Saves a document over the file it was opened from.
+    When the document starts with a run of source bytes at their original offsets,
+    and the file still holds them, only the rest needs writing: we seek past the
+    unchanged prefix, write the tail and truncate, so saving after an edit near the end
+    of a huge file takes milliseconds.  We fall back to write_atomic when there's no such prefix,
+    when the file changed behind our back, or when the tail is longer than max_tail,
+    bounding how much a crash part way through could tear.
+
+    We keep the original file open so write_atomic can copy unchanged source bytes from it
+    in the kernel.  Renaming a new file over it leaves the original intact, though that means
+    its space isn't freed until we close.  Writing a tail in place overwrites the original,
+    but only with the same source bytes, up to as much of the source as the document still has.
+    """
+    max_tail = 1 << 24
+
+    def __init__(self, fname: str):
+        self.fname = fname
+        self.stat = self.identify()
+        # leading bytes of the file that still hold the document source
+        self.intact = self.stat[2] if self.stat else 0
+        self.source = os.open(fname, os.O_RDONLY) if self.stat else None
+        self.source_stat = self.stat
+        self.source_intact = self.intact
+
+    def identify(self, fd: int | None = None) -> tuple[int, int, int, int] | None:
+        """Return enough of the status of the file, or the open file fd, to tell if someone else wrote it"""
+        try:
+            st = os.stat(self.fname) if fd is None else os.fstat(fd)
+        except FileNotFoundError:
+            return None
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def save(self, doc: Document) -> bool:
+        """Save doc, returning True if we only rewrote its tail in place"""
+        doc.load(wait=True)
+        prefix = doc.source_prefix()
+        start = min(prefix, self.intact)
+        in_place = start > 0 and doc.byte_length() - start <= self.max_tail and self.identify() == self.stat
+        if in_place:
+            with open(self.fname, 'r+b') as f:
+                f.seek(start)
+                doc.write(f, start)
+                f.truncate()
+        else:
+            trusted = self.source is not None and self.identify(self.source) == self.source_stat
+            write_atomic(doc, self.fname, self.source if trusted else None, self.source_intact)
+        # either way the file now matches the document, so holds as much of the source as it does
+        self.intact = prefix
+        if in_place and self.source is not None and self.stat == self.source_stat:
+            # we wrote over the original
+            self.source_intact = prefix
+            self.source_stat = self.identify(self.source)
+        self.stat = self.identify()
+        return in_place
+
+    def close(self):
+        if self.source is not None:
+            os.close(self.source)
+            self.source = None
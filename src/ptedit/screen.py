@@ -1,5 +1,21 @@
 import curses
 from dataclasses import dataclass
+import re
+
+
+Span = tuple[int, int]      # [start, end) of a run of columns
+
+# Each cell has an attribute byte.  The low bit shows it in reverse video,
+# as for the status line and the marked region, and the rest is a syntax style
+# (see highlighter.Style) shown in the foreground color from palette[style - 1]
+REVERSE = 1
+reversed_attrs = bytes(a | REVERSE for a in range(256))     # translation table to add REVERSE
+attr_runs = re.compile(rb'(.)\1*', re.DOTALL)                # runs of cells with the same attribute
+palette = [curses.COLOR_YELLOW, curses.COLOR_GREEN, curses.COLOR_CYAN, curses.COLOR_MAGENTA, curses.COLOR_BLUE]
+
+
+def style_attr(style: int) -> int:
+    return style << 1
 
 
 @dataclass
@@ -8,9 +24,15 @@ class Screen:
     height: int
     width: int
 
+    def __post_init__(self):
+        # the mock simply records what's painted, which is handy for testing
+        self.clear()
+
     def clear(self):
         """clear the screen and move cursor to top-left"""
-        pass
+        self.lines = [[' '] * self.width for _ in range(self.height)]
+        self.highlights = [bytearray(self.width) for _ in range(self.height)]     # attribute of each cell
+        self.cursor = (0, 0)
 
     def refresh(self):
         """refresh display"""
@@ -21,26 +43,68 @@ class Screen:
         pass
 
     def move(self, row: int, col: int):
-        pass
+        self.cursor = (row, col)
 
-    def put(self, ch: int, highlight: bool=False):
+    def put(self, ch: int, attr: int=0):
         """put character and increment position"""
-        pass
+        row, col = self.cursor
+        if row < self.height and col < self.width:
+            self.lines[row][col] = chr(ch)
+            self.highlights[row][col] = attr
+        self.cursor = (row, col + 1)
 
-    def puts(self, s: str, highlight: bool=False):
+    def puts(self, s: str, attr: int=0):
         for c in s:
-            self.put(ord(c), highlight)
+            self.put(ord(c), attr)
+
+    def put_row(self, row: int, data: str, attrs: bytes=b'', col: int=0):
+        """
+        Write a run of characters starting at row, col with
+        the given attribute for each (default normal)
+        """
+        end = min(col + len(data), self.width)
+        self.lines[row][col:end] = list(data[:end-col])
+        self.highlights[row][col:end] = (attrs or bytes(len(data)))[:end-col]
+        self.cursor = (row, end)
+
+    def scroll(self, top: int, bottom: int, n: int):
+        """
+        Scroll rows [top, bottom) up by n rows (down if n < 0),
+        leaving blank rows in the exposed space
+        """
+        assert 0 < abs(n) < bottom - top
+        def shift(rows: list, blank: list):
+            region = rows[top:bottom]
+            rows[top:bottom] = region[n:] + blank if n > 0 else blank + region[:n]
+
+        shift(self.lines, [[' '] * self.width for _ in range(abs(n))])
+        shift(self.highlights, [bytearray(self.width) for _ in range(abs(n))])
+
+    def text(self, row: int) -> str:
+        """Return the recorded content of a row (for testing)"""
+        return ''.join(self.lines[row])
 
 
 class CursesScreen(Screen):
     def __init__(self, win: curses.window):
         self.win = win
         self.win.scrollok(False)
+        self.win.idlok(True)        # let curses use the terminal's insert/delete line
         # the actual cursor shape is determined by the terminal, e.g. for OS X terminal
         # use Terminal > Settings > Text > Cursor to pick vert or horiz bar vs block etc
         curses.curs_set(2)          # 0 is invisible, 1 is normal, 2 is high-viz (e.g. block)
         self.height, self.width = self.win.getmaxyx()
         assert self.height > 1 and self.width > 0
+        self.colors = curses.has_colors()
+        if self.colors:
+            curses.start_color()
+            try:
+                curses.use_default_colors()
+                background = -1
+            except curses.error:
+                background = curses.COLOR_BLACK
+            for i, color in enumerate(palette, 1):
+                curses.init_pair(i, color, background)
 
     def clear(self):
         self.win.clear()
@@ -51,12 +115,41 @@ class CursesScreen(Screen):
     def move(self, row: int, col: int):
         self.win.move(row, col)
 
-    def put(self, ch: int, highlight: bool=False):
+    def attr(self, attr: int) -> int:
+        """Return the curses attribute for one of ours"""
+        a = curses.A_REVERSE if attr & REVERSE else curses.A_NORMAL
+        style = attr >> 1
+        return a | curses.color_pair(style) if style and self.colors else a
+
+    def put(self, ch: int, attr: int=0):
         try:
             # ignore the error if we advance past the end of the screen
-            self.win.addch(ch, curses.A_REVERSE if highlight else curses.A_NORMAL)
+            self.win.addch(ch, self.attr(attr))
         except curses.error:
             pass
 
+    def put_row(self, row: int, data: str, attrs: bytes=b'', col: int=0):
+        # write each run of cells with the same attribute
+        if not attrs:
+            self._addnstr(row, col, data, curses.A_NORMAL)
+            return
+        for m in attr_runs.finditer(attrs, 0, len(data)):
+            start, end = m.span()
+            self._addnstr(row, col + start, data[start:end], self.attr(attrs[start]))
+
+    def scroll(self, top: int, bottom: int, n: int):
+        # scrolling only happens inside the region, so the status line stays put
+        self.win.setscrreg(top, bottom - 1)
+        self.win.scrollok(True)
+        self.win.scrl(n)
+        self.win.scrollok(False)
+        self.win.setscrreg(0, self.height - 1)
 
-
+    def _addnstr(self, row: int, col: int, s: str, attr: int):
+        if not s:
+            return
+        try:
+            # ignore the error if we write the bottom-right corner
+            self.win.addnstr(row, col, s, len(s), attr)
+        except curses.error:
+            pass
@@ -0,0 +1,154 @@
+# Record the keys of an editing session and replay them headless to time each action
+from dataclasses import dataclass, field
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+from time import perf_counter
+from typing import TextIO
+
+from .controller import Controller
+from .screen import Screen
+
+
+def file_digest(fname: str) -> str:
+    with open(fname, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+class Recorder:
+    """
+    Log each key read from the terminal to a trace file, one JSON object per line.
+    The first line describes the session: a hash of the file we started from,
+    the screen size and the starting line, so a replay sees exactly what the user did.
+    Each later line holds a key, as an int or a str like Controller.dispatch takes,
+    and the seconds since recording started.  We flush every key so a crash
+    leaves a usable trace, which is cheap at typing speed.
+    """
+    def __init__(self, trace: str, fname: str, rows: int, cols: int, line: int = 0):
+        self.f: TextIO = open(trace, 'w')
+        self.start = perf_counter()
+        self.write(dict(fname=os.path.basename(fname), sha256=file_digest(fname), rows=rows, cols=cols, line=line))
+
+    def write(self, obj: dict):
+        self.f.write(json.dumps(obj) + '\n')
+        self.f.flush()
+
+    def record(self, key: int | str):
+        self.write(dict(t=round(perf_counter() - self.start, 4), key=key))
+
+    def close(self):
+        self.f.close()
+
+
+@dataclass
+class Trace:
+    fname: str
+    sha256: str
+    rows: int
+    cols: int
+    line: int = 0
+    keys: list[int | str] = field(default_factory=list)
+    times: list[float] = field(default_factory=list)
+
+
+def read_trace(trace: str) -> Trace:
+    with open(trace) as f:
+        try:
+            t = Trace(**json.loads(f.readline()))
+            for line in f:
+                event = json.loads(line)
+                t.keys.append(event['key'])
+                t.times.append(event['t'])
+        except (TypeError, KeyError, json.JSONDecodeError) as e:
+            raise ValueError(f"{trace}: not a session trace ({e})") from e
+    return t
+
+
+# latency statistics in milliseconds per action name
+Result = dict[str, float]
+
+
+def percentile(times: list[float], q: float) -> float:
+    """Nearest-rank percentile of sorted times"""
+    return times[max(math.ceil(len(times) * q) - 1, 0)]
+
+
+def summarize(latencies: dict[str, list[float]]) -> dict[str, Result]:
+    results: dict[str, Result] = {}
+    for name, times in sorted(latencies.items()):
+        times = sorted(times)
+        results[name] = dict(
+            n=len(times),
+            **{f'p{q}': round(percentile(times, q / 100) * 1000, 3) for q in (50, 95, 99)}
+        )
+    return results
+
+
+def replay(trace: str, fname: str) -> dict[str, Result]:
+    """
+    Feed the keys from a trace through dispatch and paint on a headless screen,
+    timing each key as the user would have felt it, and return latency percentiles per action.
+    We edit a copy of fname, which must match the file the trace started from,
+    so autosaves and saves land in a scratch directory.
+    """
+    t = read_trace(trace)
+    if file_digest(fname) != t.sha256:
+        raise ValueError(f"{fname} doesn't match the file {t.fname} that {trace} started from")
+
+    latencies: dict[str, list[float]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, os.path.basename(fname))
+        shutil.copyfile(fname, copy)
+        c = Controller(copy, None, line=t.line, scr=Screen(t.rows, t.cols))
+        c.dpy.paint(c.ed.mark)
+        for key in t.keys:
+            if not c.active:
+                break
+            name = c.action_name(key)
+            start = perf_counter()
+            c.dispatch(key)
+            c.dpy.paint(c.ed.mark)
+            latencies.setdefault(name, []).append(perf_counter() - start)
+    return summarize(latencies)
+
+
+# how much slower than the previous run an action can get before we flag it,
+# ignoring changes under floor_ms which are lost in the noise
+tolerances = {
+    'p50': 0.25,
+    'p95': 0.5,
+    'p99': 1.0,
+}
+floor_ms = 1.0
+
+# with fewer samples a percentile is just the slowest key, so we don't compare it
+min_samples = {
+    'p50': 2,
+    'p95': 20,
+    'p99': 100,
+}
+
+
+def compare(results: dict[str, Result], baseline: dict[str, Result]) -> list[str]:
+    """Return a description of each action latency that regressed relative to baseline"""
+    regressions: list[str] = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric, tol in tolerances.items():
+            old, new = baseline[name][metric], result[metric]
+            if min(baseline[name]['n'], result['n']) < min_samples[metric]:
+                continue
+            if new - old > max(tol * old, floor_ms):
+                regressions.append(f'{name} {metric} {old:g} -> {new:g}ms')
+    return regressions
+
+
+def report(results: dict[str, Result]) -> str:
+    lines = [f"{'action':24s} {'n':>6s} {'p50':>9s} {'p95':>9s} {'p99':>9s}"]
+    for name, r in sorted(results.items(), key=lambda item: -item[1]['p95']):
+        lines.append(f"{name:24s} {r['n']:6g} {r['p50']:7.2f}ms {r['p95']:7.2f}ms {r['p99']:7.2f}ms")
+    return '\n'.join(lines)
@@ -0,0 +1,92 @@
+# Named counters and timers for the hot paths, free unless enabled
+import logging
+from collections import defaultdict
+from time import perf_counter
+from typing import Iterable
+
+
+class Category:
+    """
+    A group of counters and timers which can be switched on at runtime.
+    Callers check `enabled` before doing any work, including computing
+    what they'd record, so a disabled category costs one attribute lookup:
+
+        if tracing.paint.enabled:
+            tracing.paint.log('top %d', top.position())
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.enabled = False
+        self.counters: defaultdict[str, int] = defaultdict(int)
+        self.timers: defaultdict[str, float] = defaultdict(float)
+
+    def count(self, key: str, n: int = 1):
+        self.counters[key] += n
+
+    def lap(self, key: str, start: float) -> float:
+        """Add the time since start to timer key, returning now to start the next lap"""
+        now = perf_counter()
+        self.timers[key] += now - start
+        return now
+
+    def log(self, msg: str, *args: object):
+        """Log a message, formatting args lazily"""
+        logging.info('%s: ' + msg, self.name, *args)
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+
+    def summary(self) -> str:
+        return ' '.join(
+            [f'{k}={v}' for k, v in sorted(self.counters.items())]
+            + [f'{k}={v*1000:.1f}ms' for k, v in sorted(self.timers.items())]
+        )
+
+
+paint = Category('paint')       # frames and per-phase paint time
+lines = Category('lines')       # lines formatted vs line cache hits
+ladder = Category('ladder')     # BoL ladder hits, misses and rescues
+walk = Category('walk')         # pieces walked by Location
+
+categories = {c.name: c for c in (paint, lines, ladder, walk)}
+
+summary_interval = 5.0          # seconds between periodic summaries
+_last_summary = perf_counter()
+
+
+def enable(names: str | Iterable[str], on: bool = True):
+    """Enable (or disable) categories given as a comma-separated string or list, 'all' for every category"""
+    if isinstance(names, str):
+        names = [s.strip() for s in names.split(',') if s.strip()]
+    names = list(names)
+    unknown = [name for name in names if name != 'all' and name not in categories]
+    if unknown:
+        raise ValueError(f"unknown trace categories {','.join(unknown)}, expected all,{','.join(categories)}")
+    for name in names:
+        cats = categories.values() if name == 'all' else [categories[name]]
+        for c in cats:
+            c.enabled = on
+
+
+def reset():
+    for c in categories.values():
+        c.reset()
+
+
+def summary() -> str:
+    return '\n'.join(f'{c.name}: {c.summary()}' for c in categories.values() if c.enabled)
+
+
+def periodic_summary():
+    """Log and reset the enabled categories every summary_interval seconds"""
+    global _last_summary
+    if not any(c.enabled for c in categories.values()):
+        return
+    now = perf_counter()
+    if now - _last_summary < summary_interval:
+        return
+    _last_summary = now
+    for line in summary().splitlines():
+        logging.info('trace %s', line)
+    reset()
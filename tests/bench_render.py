@@ -0,0 +1,201 @@
+"""
+Headless rendering benchmark.
+
+Drives Display.paint on the mock Screen over a matrix of documents,
+starting positions and per-frame actions, reporting frames/sec along with
+chars scanned, pieces walked and memory allocated per frame.
+Results are written as JSON and can be compared against a stored baseline, e.g.
+
+    python tests/bench_render.py --baseline tests/bench_render.json
+    python tests/bench_render.py --save tests/bench_render.json
+"""
+import json
+import sys
+import tracemalloc
+from itertools import product
+from os import path
+from time import perf_counter
+from typing import Callable
+
+here = path.dirname(__file__)
+
+if __name__ == '__main__':
+    # run as a script, so find ptedit in the source tree rather than needing it installed
+    sys.path.insert(0, path.join(here, '..', 'src'))
+
+from ptedit import document, display, tracing
+
+try:
+    from .random_soak import random_soak, apply_actions
+except ImportError:
+    from random_soak import random_soak, apply_actions     # run as a script
+
+
+ALICE_NL = open(path.join(here, 'alice1.asc')).read()
+ALICE_FLOW = open(path.join(here, 'alice1flow.asc')).read()
+RAW = open(path.join(here, 'raw.dat'), encoding='iso-8859-1').read()
+
+
+def fragmented(text: str, stride: int = 8) -> document.Document:
+    """A document whose piece chain has been chopped up by an edit every stride chars"""
+    doc = document.Document(text)
+    doc.set_point_start()
+    while not doc.at_end():
+        doc.replace(doc.get_char())
+        doc.move_point(stride - 1)
+    return doc
+
+
+# each source builds a document from text repeated `size` times
+sources: dict[str, Callable[[int], document.Document]] = {
+    'alice1': lambda size: document.Document(ALICE_NL * size),
+    'alice1flow': lambda size: document.Document(ALICE_FLOW * size),
+    'raw': lambda size: document.Document(RAW * size),
+    'longline': lambda size: document.Document(ALICE_FLOW.replace('\n', ' ') * size),
+    'fragmented': lambda size: fragmented(ALICE_FLOW * size),
+    'soaked': lambda size: apply_actions(document.Document(ALICE_FLOW * size), random_soak(2048, 42)),
+}
+
+positions = {
+    'top': 0.0,
+    'middle': 0.5,
+    'end': 1.0,
+}
+
+
+def scroll(dpy: display.Display, i: int):
+    """Step a line away from the nearest end, like holding an arrow key"""
+    if dpy.doc.get_point().position() < len(dpy.doc) // 2:
+        dpy.move_forward_line()
+    else:
+        dpy.move_backward_line()
+
+
+def page(dpy: display.Display, i: int):
+    if i % 16 < 8:
+        dpy.move_forward_page()
+    else:
+        dpy.move_backward_page()
+
+
+def type_(dpy: display.Display, i: int):
+    """Type a word and a space, wrapping the paragraph as we go"""
+    dpy.doc.insert(' ' if i % 6 == 5 else 'x')
+
+
+actions: dict[str, Callable[[display.Display, int], None]] = {
+    'scroll': scroll,
+    'page': page,
+    'type': type_,
+}
+
+
+Result = dict[str, float]
+
+
+def run_scenario(source: str, size: int, position: str, action: str, frames: int = 100) -> Result:
+    doc = sources[source](size)
+    doc.set_point_start().move_point(int(positions[position] * len(doc)))
+    dpy = display.Display(doc, display.Screen(24, 80))
+    step = actions[action]
+    dpy.paint()     # the first paint builds the ladder and fills the caches
+
+    n_chars = doc.n_get_char_calls
+    tracing.walk.reset()
+    tracing.enable('walk')
+    t = perf_counter()
+    for i in range(frames):
+        step(dpy, i)
+        dpy.paint()
+    elapsed = perf_counter() - t
+    tracing.enable('walk', False)
+    n_chars = doc.n_get_char_calls - n_chars
+    n_pieces = tracing.walk.counters['pieces']
+
+    # measure allocation separately since tracing slows everything down
+    tracemalloc.start()
+    peak = 0
+    for i in range(frames, frames + min(frames, 20)):
+        step(dpy, i)
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        dpy.paint()
+        peak += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    return dict(
+        fps=round(frames / elapsed, 1),
+        chars_per_frame=round(n_chars / frames, 1),
+        pieces_per_frame=round(n_pieces / frames, 1),
+        alloc_kb_per_frame=round(peak / min(frames, 20) / 1024, 1),
+    )
+
+
+def run_all(sizes: list[int], frames: int, only: str = '') -> dict[str, Result]:
+    results: dict[str, Result] = {}
+    for source, size, position, action in product(sources, sizes, positions, actions):
+        name = f'{source}-x{size}-{position}-{action}'
+        if only not in name:
+            continue
+        results[name] = run_scenario(source, size, position, action, frames)
+        print(f'{name:40s} ' + '  '.join(f'{k} {v:g}' for k, v in results[name].items()), file=sys.stderr)
+    return results
+
+
+# how much worse than baseline a metric can get before we flag it,
+# with more slack for timing than the deterministic counters
+tolerances = {
+    'fps': -0.25,
+    'chars_per_frame': 0.1,
+    'pieces_per_frame': 0.1,
+    'alloc_kb_per_frame': 0.25,
+}
+
+
+def compare(results: dict[str, Result], baseline: dict[str, Result]) -> list[str]:
+    """Return a description of each metric that regressed relative to baseline"""
+    regressions: list[str] = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric, tol in tolerances.items():
+            old, new = baseline[name].get(metric), result[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            if (change < tol) if tol < 0 else (change > tol and new - old > 1):
+                regressions.append(f'{name} {metric} {old:g} -> {new:g} ({change:+.0%})')
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='bench_render',
+        description='Benchmark headless rendering over a scenario matrix'
+    )
+    parser.add_argument('-n', '--frames', help='Frames per scenario', type=int, default=50)
+    parser.add_argument('-s', '--sizes', help='Comma-separated document size multipliers', default='1,8')
+    parser.add_argument('-k', '--only', help='Only run scenarios whose name contains this', default='')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file (default stdout)')
+    parser.add_argument('-b', '--baseline', help='Compare against baseline JSON, exiting 1 on regression')
+    parser.add_argument('--save', help='Save results as the new baseline JSON')
+
+    args = parser.parse_args()
+
+    results = run_all([int(s) for s in args.sizes.split(',')], args.frames, args.only)
+
+    out = json.dumps(results, indent=2)
+    if args.output:
+        open(args.output, 'w').write(out + '\n')
+    elif not args.save:
+        print(out)
+    if args.save:
+        open(args.save, 'w').write(out + '\n')
+
+    if args.baseline:
+        regressions = compare(results, json.load(open(args.baseline)))
+        for r in regressions:
+            print('REGRESSION', r, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,102 @@
+"""
+Startup benchmark.
+
+Measures how long it takes to import ptedit, and the time from launching
+a fresh interpreter to the first paint of a large file, reading it whole
+or progressively.  Test files are built by repeating alice1flow.asc and
+kept in --dir between runs, e.g.
+
+    python tests/bench_startup.py --sizes 1G,4G --dir /tmp
+"""
+import json
+import os
+import subprocess
+import sys
+from os import path
+from statistics import median
+from time import time
+
+
+here = path.dirname(__file__)
+src = path.join(here, '..', 'src')
+
+
+def parse_size(s: str) -> int:
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    return int(s[:-1]) * units[s[-1]] if s[-1] in units else int(s)
+
+
+def make_file(dir: str, size: str) -> str:
+    """Return the name of a file of the given size, creating it if needed"""
+    n = parse_size(size)
+    fname = path.join(dir, f'ptedit-bench-{size}.txt')
+    if not path.exists(fname) or path.getsize(fname) != n:
+        block = open(path.join(here, 'alice1flow.asc'), 'rb').read() * 1024
+        with open(fname, 'wb') as f:
+            for _ in range(n // len(block)):
+                f.write(block)
+            f.write(block[:n % len(block)])
+    return fname
+
+
+def run(*args: str) -> float:
+    """Run this script as a child, returning the seconds from launch until it reports"""
+    env = dict(os.environ, PYTHONPATH=src)
+    start = time()
+    out = subprocess.run([sys.executable, __file__, *args], env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout) - start
+
+
+def child(args: list[str]):
+    """Report the time once we've imported or painted the first screen"""
+    if args[0] == 'import':
+        from ptedit import controller      # noqa: F401
+        print(time())
+        return
+
+    from ptedit import loader, display
+    doc = loader.open_document(args[1], progressive=args[0] == 'progressive')
+    display.Display(doc, display.Screen(24, 80)).paint()
+    print(time())
+
+
+def bench(sizes: list[str], dir: str, repeat: int) -> dict[str, float]:
+    results: dict[str, float] = {}
+    baseline = median(run('pass') for _ in range(repeat))
+    results['import_s'] = round(median(run('import') for _ in range(repeat)) - baseline, 4)
+    for size in sizes:
+        fname = make_file(dir, size)
+        for mode in ('whole', 'progressive'):
+            key = f'first_paint_{size}_{mode}_s'
+            results[key] = round(median(run(mode, fname) for _ in range(repeat)), 4)
+            print(f'{key:40s} {results[key]:g}', file=sys.stderr)
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in ('pass', 'import', 'whole', 'progressive'):
+        if sys.argv[1] == 'pass':
+            print(time())
+        else:
+            child(sys.argv[1:])
+        sys.exit(0)
+
+    import argparse, tempfile
+
+    parser = argparse.ArgumentParser(
+        prog='bench_startup',
+        description='Benchmark import time and launch to first paint on large files'
+    )
+    parser.add_argument('-s', '--sizes', help='Comma-separated file sizes', default='1G')
+    parser.add_argument('-d', '--dir', help='Where to keep the test files', default=tempfile.gettempdir())
+    parser.add_argument('-r', '--repeat', help='Runs per measurement (we report the median)', type=int, default=3)
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file (default stdout)')
+
+    args = parser.parse_args()
+
+    results = bench(args.sizes.split(','), args.dir, args.repeat)
+    out = json.dumps(results, indent=2)
+    if args.output:
+        open(args.output, 'w').write(out + '\n')
+    else:
+        print(out)
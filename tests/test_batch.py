@@ -0,0 +1,92 @@
+import io
+import json
+
+import pytest
+
+from ptedit import batch, document
+from .random_soak import random_soak, apply_actions, corpus
+
+
+def test_soak_script(tmp_path):
+    # a random_soak action list gives the same result as applying it directly
+    fname = str(tmp_path / 'soak.txt')
+    open(fname, 'w', encoding='iso-8859-1').write(corpus)
+    actions = random_soak(200, 7)
+    script_commands = batch.parse_script(json.dumps(actions))
+    out = io.BytesIO()
+    batch.run_script(fname, script_commands, out)
+    expected = apply_actions(document.Document(corpus), actions).get_data()
+    assert out.getvalue().decode('iso-8859-1') == expected
+
+
+def test_commands():
+    script = '''
+        # comments and blank lines are ignored
+
+        find "sister"
+        insert ", Kate,"
+        subst "Alice" "A."
+        moveto 0
+        delete 6
+        end
+        insert "\\nThe End\\n"
+    '''
+    doc = document.Document(corpus)
+    batch.apply_commands(doc, batch.parse_script(script))
+    text = doc.get_data()
+    assert text.startswith('was beginning to get very tired of sitting by her sister, Kate, on')
+    assert 'Alice' not in text and text.count('A.') == corpus.count('Alice') - 1
+    assert text.endswith('\nThe End\n')
+
+    # JSON scripts can name commands too
+    assert batch.parse_script('[["subst", "a", "b"], ["start"]]') == [('subst', ['a', 'b']), ('start', [])]
+
+
+def test_subst_across_pieces():
+    doc = document.Document('one fi two fish')
+    doc.move_point(6)
+    doc.insert('sh')    # the first fish spans two pieces
+    doc.set_point_start()
+    assert batch.substitute(doc, 'fish', 'cat') == 2
+    assert doc.get_data() == 'one cat two cat'
+    assert doc.at_end()
+
+
+def test_errors():
+    with pytest.raises(ValueError, match='line 2: unknown command'):
+        batch.parse_script('start\nfrobnicate 3')
+    with pytest.raises(ValueError, match='line 1: subst expects str str'):
+        batch.parse_script('subst "a"')
+    with pytest.raises(ValueError, match="can't parse"):
+        batch.parse_script('insert hello')
+    with pytest.raises(ValueError, match='action 0: unknown edit type'):
+        batch.parse_script('[[7, 0, ""]]')
+    # an empty search would match forever
+    with pytest.raises(ValueError, match="line 3: subst can't search for an empty string"):
+        batch.parse_script('start\n\nsubst "" "x"')
+    with pytest.raises(ValueError, match="action 1: find can't search for an empty string"):
+        batch.parse_script('[["start"], ["find", ""]]')
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_batch(tmp_path, workers):
+    fnames = []
+    for i in range(5):
+        fname = str(tmp_path / f'f{i}.txt')
+        open(fname, 'w').write(f'file {i}: colour\n' * (i + 1))
+        fnames.append(fname)
+    missing = str(tmp_path / 'missing.txt')
+    script_commands = batch.parse_script('subst "colour" "color"')
+
+    totals = batch.Totals()
+    results = {}
+    for result in batch.run_batch(fnames + [missing], script_commands, workers, chunk_size=2):
+        totals.add(result)
+        results[result.fname] = result
+    assert totals.files == 6 and totals.errors == 1
+    assert 'FileNotFoundError' in results[missing].error
+    for i, fname in enumerate(fnames):
+        assert open(fname).read() == f'file {i}: color\n' * (i + 1)
+        assert results[fname].written == results[fname].size - i - 1
+    assert sorted(tmp_path.iterdir()) == sorted(tmp_path / f'f{i}.txt' for i in range(5))
+    assert '6 files, 1 errors' in totals.summary()
@@ -0,0 +1,82 @@
+import curses
+
+from ptedit import controller, screen
+from ptedit.controller import ctrl
+from .test_display import ALICE_NL
+
+
+# go to the start of the line, quote it, fiddle with the end and move down
+KEYS = [
+    ctrl('A'), ord('>'), ord(' '), ctrl('F'), curses.KEY_RIGHT, ctrl('E'), ord(' '), 127,
+    curses.KEY_DOWN, curses.KEY_UP, curses.KEY_DOWN, curses.KEY_RIGHT, ctrl('A'),
+]
+
+
+def headless(tmp_path, name: str) -> controller.Controller:
+    fname = str(tmp_path / name)
+    open(fname, 'w').write(ALICE_NL)
+    c = controller.Controller(fname, None, scr=screen.Screen(24, 80))
+    c.dpy.paint()
+    return c
+
+
+def type_keys(c: controller.Controller, keys: list[int]):
+    for key in keys:
+        c.dispatch(key)
+        c.dpy.paint()
+
+
+def test_macro(tmp_path):
+    c = headless(tmp_path, 'macro.txt')
+    type_keys(c, [ctrl('['), ord('(')] + KEYS + [ctrl('['), ord(')')])
+    assert c.macro == KEYS and not c.recording
+
+    # replaying gives the same result as typing the keys again
+    typed = headless(tmp_path, 'typed.txt')
+    type_keys(typed, KEYS * 21)
+    c.play_macro(20)
+    c.dpy.paint()
+    assert c.doc.get_data() == typed.doc.get_data()
+    assert c.doc.get_point().position() == typed.doc.get_point().position()
+    assert c.doc.get_data().startswith('> Alice was beginning')
+    assert c.doc.get_data().count('\n> ') == 20
+
+    # we autosave once at the end rather than every ten changes
+    saved = []
+    c.save = lambda suffix='': saved.append(suffix)
+    c.play_macro(10)
+    assert saved == ['~']
+
+
+def test_macro_count(tmp_path):
+    c = headless(tmp_path, 'macro.txt')
+    type_keys(c, [ctrl('['), ord('(')] + KEYS + [ctrl('['), ord(')')])
+    typed = headless(tmp_path, 'typed.txt')
+    type_keys(typed, KEYS * 13)
+
+    # C-u 12 M-r plays the macro twelve times, and the count only applies to the next command
+    type_keys(c, [ctrl('U'), ord('1'), ord('2'), ctrl('['), ord('r')])
+    assert c.count is None and c.mode == controller.KeyMode.NORMAL
+    assert c.doc.get_data() == typed.doc.get_data()
+    type_keys(c, [ctrl('U'), ord('5'), curses.KEY_DOWN, ctrl('['), ord('r')])
+    type_keys(typed, [curses.KEY_DOWN] + KEYS)
+    assert c.doc.get_data() == typed.doc.get_data()
+    assert c.doc.get_point().position() == typed.doc.get_point().position()
+
+
+def test_macro_errors(tmp_path):
+    c = headless(tmp_path, 'macro.txt')
+    c.play_macro()
+    assert c.dpy.message == 'No macro'
+
+    type_keys(c, [ctrl('['), ord('('), ord('x')])
+    c.play_macro()
+    assert c.dpy.message.startswith("Can't play a macro while recording")
+    # trying to play while recording leaves no trace in the macro
+    type_keys(c, [ctrl('U'), ord('2'), ctrl('['), ord('r'), ord('y'), ctrl('['), ord(')')])
+    assert not c.recording
+    assert c.macro == [ord('x'), ord('y')]
+    type_keys(c, [ctrl('['), ord('r')])
+    assert c.doc.get_data().startswith('xyxyAlice')
+    c.end_macro()
+    assert c.dpy.message == 'Not recording'
@@ -1,5 +1,6 @@
 from ptedit import display, document
 from os import path
+from .bench_render import run_scenario, compare
 
 
 ALICE_NL = open(path.join(path.dirname(__file__), 'alice1.asc')).read()
@@ -88,3 +89,194 @@ def test_raw():
     doc = document.Document(open('tests/raw.dat', encoding='iso-8859-1').read())
     dpy = display.Display(doc, display.Screen(24, 80))
     dpy.paint()
+
+
+class CountingScreen(display.Screen):
+    def __post_init__(self):
+        self.n_clear = self.n_calls = self.n_bytes = self.n_scroll = 0
+        super().__post_init__()
+        self.n_clear = 0
+
+    def scroll(self, top: int, bottom: int, n: int):
+        super().scroll(top, bottom, n)
+        self.n_scroll += 1
+
+    def clear(self):
+        super().clear()
+        self.n_clear += 1
+
+    def put_row(self, row: int, data: str, attrs: bytes=b'', col: int=0):
+        super().put_row(row, data, attrs, col)
+        self.n_calls += 1
+        self.n_bytes += len(data)
+
+
+def test_damage():
+    doc = document.Document(ALICE_FLOW)
+    scr = CountingScreen(24, 80)
+    dpy = display.Display(doc, scr)
+    dpy.paint()
+    assert scr.n_clear == 1
+    assert scr.n_calls <= 24
+    full = scr.n_bytes
+    assert scr.text(0).startswith('Alice was beginning')
+    assert scr.highlights[23][0]    # status line
+
+    # repainting an unchanged screen sends nothing
+    scr.n_bytes = 0
+    dpy.paint()
+    assert scr.n_bytes == 0
+
+    # moving the point only updates the status line
+    scr.n_calls = scr.n_bytes = 0
+    doc.move_point(10)
+    dpy.paint()
+    assert scr.n_calls == 1 and 0 < scr.n_bytes < 80
+
+    # replacing a character only touches part of a row plus the status line
+    scr.n_calls = scr.n_bytes = 0
+    doc.replace('x')
+    dpy.paint()
+    assert scr.n_clear == 1
+    assert scr.n_calls == 2 and scr.n_bytes < 2 * 80 < full
+    assert scr.text(0).startswith('Alice was x')
+
+    # highlighting the region repaints just the affected cells
+    scr.n_bytes = 0
+    mark = doc.get_point()
+    doc.move_point(4)
+    dpy.paint(mark)
+    assert scr.highlights[0][10:16] == b'\x00\x01\x01\x01\x01\x00'
+
+    # invalidating forces a full repaint
+    scr.n_bytes = 0
+    dpy.invalidate()
+    dpy.paint()
+    assert scr.n_clear == 2 and scr.n_bytes > 80
+
+
+def test_scroll():
+    doc = document.Document(ALICE_FLOW)
+    scr = CountingScreen(24, 80)
+    dpy = display.Display(doc, scr)
+    dpy.paint()
+
+    # step down until the screen starts to scroll
+    while scr.n_scroll == 0:
+        top = scr.text(0)
+        dpy.move_forward_line()
+        dpy.paint()
+    second = scr.text(0)
+    assert scr.n_clear == 1
+
+    # each further line scrolls by one and paints at most the new row and status
+    for i in range(8):
+        scr.n_calls = scr.n_bytes = 0
+        dpy.move_forward_line()
+        dpy.paint()
+        assert scr.n_scroll == i + 2
+        assert scr.n_calls <= 2 and scr.n_bytes <= 2 * 80
+
+    # the scrolled screen matches a full repaint
+    lines = [scr.text(row) for row in range(23)]
+    dpy.invalidate()
+    dpy.paint()
+    assert [scr.text(row) for row in range(23)] == lines
+
+    # and so does scrolling back down
+    for _ in range(30):
+        dpy.move_backward_line()
+        dpy.paint()
+    assert scr.text(0) == top and scr.text(1) == second
+    assert scr.n_clear == 2
+
+
+def test_move_to_fraction():
+    doc = document.Document(ALICE_FLOW)
+    dpy = display.Display(doc, display.Screen(24, 80))
+    dpy.move_to_fraction(0.5)
+    dpy.paint()
+    n = dpy.fmt.visual_line_count()
+    assert dpy.fmt.visual_line(doc.get_point()) == n // 2
+    assert abs(doc.get_point().position() - len(doc) // 2) < len(doc) // 10
+
+
+def test_nowrap():
+    rows = [f'{i:03d},' + ','.join(f'f{j:02d}' for j in range(30)) for i in range(40)]
+    doc = document.Document('\n'.join(rows) + '\n')
+    scr = display.Screen(12, 20)
+    dpy = display.Display(doc, scr)
+    dpy.toggle_wrap()
+    dpy.paint()
+    assert [scr.text(r) for r in range(3)] == [row[:20] for row in rows[:3]]
+
+    # scroll right to show the end of the line
+    dpy.move_end_line()
+    dpy.paint()
+    assert doc.get_point().position() == len(rows[0])
+    left = dpy.fmt.left
+    assert left > 0 and scr.cursor == (0, len(rows[0]) - left)
+    assert scr.text(1) == rows[1][left:].ljust(20)
+
+    # the preferred column counts from the start of the line
+    dpy.move_forward_line()
+    dpy.paint()
+    assert doc.get_point().position() == 2 * len(rows[0]) + 1
+    assert dpy.fmt.left == left and scr.cursor == (1, len(rows[0]) - left)
+
+    dpy.move_start_line()
+    dpy.paint()
+    assert dpy.fmt.left == 0 and scr.cursor == (1, 0)
+
+    assert dpy.fmt.visual_line_count() == len(rows) + 1
+    dpy.move_to_fraction(0.5)
+    assert doc.get_point().position() == 20 * (len(rows[0]) + 1)
+
+    # wrapping again puts each line back on several rows
+    dpy.toggle_wrap()
+    dpy.paint()
+    row, col = scr.cursor
+    assert col == 0 and scr.text(row) == rows[20][:20] and scr.text(row + 1) == rows[20][20:40]
+
+
+def test_bench_render():
+    result = run_scenario('fragmented', 1, 'middle', 'type', frames=5)
+    assert set(result) == {'fps', 'chars_per_frame', 'pieces_per_frame', 'alloc_kb_per_frame'}
+    assert result['chars_per_frame'] > 0 and result['pieces_per_frame'] > 0
+    assert compare({'a': result}, {'a': result}) == []
+    worse = dict(result, pieces_per_frame=2 * result['pieces_per_frame'])
+    assert compare({'a': worse}, {'a': result}) == [
+        f"a pieces_per_frame {result['pieces_per_frame']:g} -> {worse['pieces_per_frame']:g} (+100%)"
+    ]
+
+
+def test_nowrap_escapes():
+    # a line starting with an escape that's wider than the preferred column
+    doc = document.Document('hello world\n\x01abc\n\u4e2dxyz\n')
+    scr = display.Screen(12, 20)
+    dpy = display.Display(doc, scr)
+    dpy.toggle_wrap()
+    dpy.paint()
+    dpy.move_forward_line()
+    dpy.paint()
+    assert doc.get_point().position() == 12 and scr.cursor == (1, 0)
+    dpy.move_forward_line()
+    dpy.paint()
+    assert doc.get_point().position() == 17 and scr.cursor == (2, 0)
+
+    # on a long line the point's column comes from the cached row while it's on screen,
+    # rather than formatting the line up to the point on every paint
+    doc = document.Document('x' * 100_000 + '\nmore\n')
+    dpy = display.Display(doc, scr)
+    dpy.toggle_wrap()
+    dpy.paint()
+    dpy.move_end_line()
+    dpy.paint()
+    left = dpy.fmt.left
+    format_line = dpy.fmt._format_line
+    formatted = []
+    dpy.fmt._format_line = lambda *args, **kwargs: formatted.append(args) or format_line(*args, **kwargs)
+    for _ in range(3):
+        doc.move_point(-1)
+        dpy.paint()
+    assert dpy.fmt.left == left and not formatted
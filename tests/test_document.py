@@ -1,3 +1,4 @@
+import io
 from ptedit import document
 
 
@@ -88,3 +89,85 @@ def test_replace():
     assert str(doc) == '|a|nother| b|lack|^ fox|'
     assert doc.edit_counts()[0] == 5
 
+
+
+def test_utf8():
+    raw = 'señor 中文\n'.encode() + b'bad \xff byte\n'
+    doc = document.Document(raw)
+    assert len(doc) == 20
+    doc.move_point(7)
+    assert doc.get_char() == '文'
+    doc.insert('国')
+    assert doc.find_forward('bad', document.MatchMode.EXACT_CASE)
+    assert doc.next_char() == ' ' and doc.next_char() == '\udcff'
+
+    # invalid bytes survive the round trip, and unchanged text is copied as is
+    out = io.BytesIO()
+    doc.write(out)
+    assert out.getvalue() == 'señor 中国文\n'.encode() + b'bad \xff byte\n'
+
+
+def test_bytes():
+    doc = document.Document('señor 中文\n'.encode() + b'bad \xff byte\n')
+    doc.move_point(7)
+    doc.insert('é国')
+    raw = 'señor 中é国文\n'.encode() + b'bad \xff byte\n'
+    assert doc.byte_length() == len(raw)
+    assert doc.get_bytes(5, 12) == raw[5:17]
+    assert doc.get_bytes(20, 99) == raw[20:]
+
+    # bytes inside a character belong to it
+    text = doc.get_data()
+    for b in range(len(raw) + 1):
+        loc = doc.byte_location(b)
+        i = loc.position()
+        assert len(text[:i].encode('utf-8', 'surrogateescape')) == doc.byte_position(loc) <= b
+        assert b < len(raw) and b < len(text[:i+1].encode('utf-8', 'surrogateescape')) or loc.is_end()
+
+
+def test_line_counts():
+    doc = document.Document('one\ntwo\n中文\nfour'.encode())
+    doc.move_point(8)
+    doc.insert('x\ny\n')
+    doc.move_point(4).delete(2)
+    text = doc.get_data()
+    for i in range(len(text) + 1):
+        doc.set_point_start().move_point(i)
+        assert doc.line_counts() == (text[:i].count('\n'), text.count('\n'))
+
+
+def test_pieces():
+    doc = document.Document('the quick brown fox')
+    doc.move_point(4).insert('very ')
+    start = doc.get_start().move(2)
+    end = doc.get_point().move(3)
+    clip = doc.get_pieces(start, end)
+    assert [p.data for p in clip] == ['e ', 'very ', 'qui']
+    assert doc.get_pieces(start, start) == []
+
+    # the shared insert is never trimmed, so deleting after it is a new edit
+    n = doc.edit_counts()[0]
+    doc.delete(-2).insert('!')
+    assert doc.edit_counts()[0] == n + 1
+    assert doc.get_data() == 'the ver!quick brown fox'
+    assert [p.data for p in clip] == ['e ', 'very ', 'qui']
+
+    # pasting shares the data rather than copying it, and is an edit of its own
+    doc.set_point_end().insert_pieces(clip)
+    assert doc.get_data() == 'the ver!quick brown foxe very qui'
+    assert doc.get_point().piece.prev.ref()[0] is clip[-1].ref()[0]
+    doc.insert('.')
+    assert doc.edit_counts()[0] == n + 3
+    doc.undo().undo()
+    assert doc.get_data() == 'the ver!quick brown fox'
+    doc.redo()
+    assert doc.get_data() == 'the ver!quick brown foxe very qui'
+
+
+def test_pieces_merge():
+    # adjacent runs of the same primary piece come back as one
+    doc = document.Document('abcdefgh')
+    doc.move_point(4).insert('x').delete(-1)
+    assert str(doc) == '|abcd|^efgh|'
+    clip = doc.get_pieces(doc.get_start(), doc.set_point_end().get_point())
+    assert len(clip) == 1 and clip[0].data == 'abcdefgh'
@@ -0,0 +1,97 @@
+from ptedit import display, document, editor
+
+
+def test_kill_ring():
+    doc = document.Document('one two three\n')
+    ed = editor.Editor(doc, display.Display(doc, display.Screen(24, 80)))
+    ed.paste()
+    assert ed.pager.message == 'Clipboard empty'
+
+    # kill 'one ', copy 'two' and kill 'three'
+    ed.set_mark()
+    ed.move_forward_word()
+    ed.cut()
+    ed.set_mark()
+    doc.move_point(3)
+    ed.copy()
+    doc.move_point(1)
+    ed.set_mark()
+    doc.move_point(5)
+    ed.cut()
+    assert doc.get_data() == 'two \n'
+    assert [''.join(p.data for p in clip) for clip in ed.kill_ring] == ['one ', 'two', 'three']
+
+    # paste the latest, then cycle back through older entries
+    ed.paste()
+    assert doc.get_data() == 'two three\n'
+    ed.paste_previous()
+    assert doc.get_data() == 'two two\n'
+    ed.paste_previous()
+    assert doc.get_data() == 'two one \n'
+    ed.paste_previous()
+    assert doc.get_data() == 'two three\n'
+
+    # but only straight after a paste
+    ed.move_backward_char()
+    ed.paste_previous()
+    assert ed.pager.message == 'Not after a paste'
+    assert doc.get_data() == 'two three\n'
+
+    # the ring holds pieces, not copies of the text, and forgets the oldest entries
+    big = document.Document('x' * 1_000_000)
+    ed = editor.Editor(big, display.Display(big, display.Screen(24, 80)))
+    for _ in range(20):
+        big.set_point_start()
+        ed.set_mark()
+        big.move_point(1_000_000)
+        ed.copy()
+        big.set_point_end()
+        ed.paste()
+    assert len(big) == 21_000_000
+    assert len(ed.kill_ring) == ed.kill_ring_size
+    assert all(len(clip) == 1 for clip in ed.kill_ring)
+
+
+def test_isearch():
+    text = 'x' * 100_000 + ' Needle needs nee needs\n'
+    doc = document.Document(text)
+    ed = editor.Editor(doc, display.Display(doc, display.Screen(24, 80)))
+
+    def typed(s: str) -> tuple[int, int | None]:
+        for c in s:
+            ed.insert(ord(c))
+        return doc.get_point().position(), ed.mark and ed.mark.position()
+
+    # each character narrows the search from the last match rather than the start
+    ed.isearch_forward()
+    assert typed('n') == (100_002, 100_001)
+    n = doc.n_get_char_calls
+    assert typed('eed') == (100_005, 100_001)
+    assert typed('s') == (100_013, 100_008)
+    assert typed('q') == (len(text), None)
+    assert typed('z') == (len(text), None)
+    assert doc.n_get_char_calls - n < 100
+
+    # deleting returns to each earlier match without searching again
+    ed.delete_backward_char()
+    ed.delete_backward_char()
+    assert (doc.get_point().position(), ed.mark and ed.mark.position()) == (100_013, 100_008)
+    ed.isearch_forward()
+    assert (doc.get_point().position(), ed.mark.position()) == (100_023, 100_018)
+    ed.delete_backward_char()
+    ed.delete_backward_char()
+    assert ed.isearch_text == 'need' and doc.get_point().position() == 100_005
+    assert doc.n_get_char_calls - n < 100
+    for _ in range(5):
+        ed.delete_backward_char()
+    assert ed.isearch_text == '' and doc.get_point().position() == 0
+    ed.isearch_cancel()
+
+    # backwards, a longer match is at or before the last one
+    doc.set_point_end()
+    ed.isearch_backward()
+    assert typed('nee') == (100_021, 100_018)
+    assert typed('d') == (100_022, 100_018)
+    assert typed('s ') == (100_014, 100_008)
+    ed.isearch_exit()
+    assert doc.get_point().position() == 100_014
@@ -1,4 +1,4 @@
-from ptedit import document, formatter
+from ptedit import document, formatter, display
 
 
 def test_bol():
@@ -17,9 +17,9 @@ def test_bol():
 def test_format():
     doc = document.Document('the \tbig\t 012345678901234567890123456789\r\x01 number\x7f')
     fmt = formatter.Formatter(doc, 24, 8)
-    assert fmt.format_line()[0] == b'the \t\0\0\0big\t ' + bytes(11)
-    assert fmt.format_line()[0] == b'012345678901234567890123'
-    assert fmt.format_line()[0] == b'456789\x01M\x01A number\x027F' + bytes(4)
+    assert fmt.format_line()[0] == 'the \t\0\0\0big\t ' + '\0' * 11
+    assert fmt.format_line()[0] == '012345678901234567890123'
+    assert fmt.format_line()[0] == '456789\x01M\x01A number\x027F' + '\0' * 4
 
 
 def test_column_for_offset():
@@ -29,7 +29,7 @@ def test_column_for_offset():
     # source data:   456789.. number.#
     #                012345678901234567890123
     # formatted:     456789^M^A number\7F#000    where # is 0 for eod
-    assert line == b'456789\x01M\x01A number\x027F' + bytes(4)
+    assert line == '456789\x01M\x01A number\x027F' + '\0' * 4
     assert len(col_map) == len(doc) + 1     # +1 for eod
     assert col_map[0] == 0
     assert col_map[6] == 6
@@ -42,7 +42,7 @@ def test_offset_for_column():
     doc = document.Document('456789\r\x01')
     fmt = formatter.Formatter(doc, 24, 8)
     line, col_map = fmt.format_line()
-    assert line == b'456789\x01M\x01A' + bytes(14)
+    assert line == '456789\x01M\x01A' + '\0' * 14
     assert formatter.Formatter.offset_for_column(0, col_map) == 0
     assert formatter.Formatter.offset_for_column(5, col_map) == 5
     assert formatter.Formatter.offset_for_column(6, col_map) == 6  # ^
@@ -50,4 +50,155 @@ def test_offset_for_column():
     assert formatter.Formatter.offset_for_column(8, col_map) == 7  # ^
     assert formatter.Formatter.offset_for_column(9, col_map) == 7  # A
     assert formatter.Formatter.offset_for_column(10, col_map) == 8  # eod
-    assert formatter.Formatter.offset_for_column(99, col_map) == 8  # eod
\ No newline at end of file
+    assert formatter.Formatter.offset_for_column(99, col_map) == 8  # eod
+
+
+def test_format_chunks():
+    # the same text split across many small pieces formats identically
+    text = 'The quick\tbrown-fox\x01jumps\xe9over the lazy dog\n' * 3
+    whole = document.Document(text)
+    split = document.Document(text)
+    for i in range(5, len(text), 5)[::-1]:
+        split.set_point_start().move_point(i)
+        split.replace(text[i])
+    split.set_point_start()
+    a, b = formatter.Formatter(whole, 16, 8), formatter.Formatter(split, 16, 8)
+    while True:
+        line, col_map = a.format_line()
+        assert b.format_line() == (line, col_map)
+        assert whole.get_point().position() == split.get_point().position()
+        if whole.at_end():
+            break
+    # a chunk is read a piece at a time, and scanned chars are counted
+    n = split.n_get_char_calls
+    split.set_point_start()
+    assert split.get_chunk(99) == 'The q' and split.n_get_char_calls == n + 5
+
+def test_line_cache():
+    doc = document.Document(open('tests/alice1flow.asc').read())
+    dpy = display.Display(doc, display.Screen(24, 80))
+    fmt = dpy.fmt
+    doc.move_point(2000)
+    dpy.paint()
+
+    # repainting formats nothing
+    n = fmt.n_formatted
+    dpy.paint()
+    assert fmt.n_formatted == n
+
+    # an edit which splits the source piece only reformats the edited line
+    doc.replace('X')
+    dpy.paint()
+    assert fmt.n_formatted - n == 1
+
+    # extending the same edit in place still reformats the line
+    n = fmt.n_formatted
+    doc.delete(-1)
+    doc.insert('Y')
+    dpy.paint()
+    assert fmt.n_formatted - n == 1
+
+    # and the screen matches a fresh display of the same text
+    fresh = document.Document(doc.get_data())
+    fresh.move_point(doc.get_point().position())
+    scr = display.Screen(24, 80)
+    display.Display(fresh, scr).paint()
+    assert scr.lines[:-1] == dpy.scr.lines[:-1]
+
+
+def test_line_index():
+    text = open('tests/alice1flow.asc').read()
+    doc = document.Document(text)
+    fmt = formatter.Formatter(doc, 40, 8)
+
+    def expected() -> list[int]:
+        fresh = formatter.Formatter(document.Document(doc.get_data()), 40, 8)
+        index = fresh.get_line_index()
+        return [index.offset(k) for k in range(len(index))]
+
+    index = fmt.get_line_index()
+    index.block_size = 16       # exercise block splitting
+    starts = expected()
+    assert [index.offset(k) for k in range(len(index))] == starts
+    assert fmt.visual_line_count() == len(starts)
+    k = len(starts) // 2
+    loc = fmt.visual_line_start(k)
+    assert loc.position() == starts[k]
+    assert fmt.visual_line(loc.move(3)) == k
+
+    # edits repair the index incrementally
+    doc.watch(fmt.change_handler)
+    for pos, op in [(1000, 'ins'), (2000, 'del'), (5, 'ins'), (len(text) - 10, 'del'), (3000, 'nl')]:
+        doc.set_point_start().move_point(pos)
+        match op:
+            case 'ins': doc.insert('lorem ipsum dolor sit amet ' * 3)
+            case 'del': doc.delete(-120)
+            case 'nl': doc.insert('\n\n')
+        assert [index.offset(k) for k in range(len(index))] == expected(), op
+    doc.undo()
+    doc.undo()
+    assert [index.offset(k) for k in range(len(index))] == expected()
+
+
+def test_ladder():
+    doc = document.Document(open('tests/alice1flow.asc').read())
+    fmt = formatter.Formatter(doc, 40, 8)
+    doc.move_point(5000)
+    fmt.clamp_to_bol()
+    bol = doc.get_point()
+
+    ladder = fmt.bol_ladder
+    assert ladder.generation == doc.generation
+    assert ladder.keys == sorted(ladder.keys)
+    assert all(loc.position() == key for loc, key in zip(ladder, ladder.keys))
+    assert bol in ladder and ladder.key(bol) == bol.position()
+    i = ladder.find(bol)
+    assert i is not None and ladder[i] == bol
+    assert ladder.rung_at_or_before(5000) == i
+
+    # any change invalidates the ladder unless it's rescued
+    doc.insert('x')
+    assert fmt.ladder().generation == doc.generation and not fmt.bol_ladder
+
+
+def test_format_unicode():
+    doc = document.Document('café 中​\udcff'.encode('utf-8', 'surrogateescape'))
+    fmt = formatter.Formatter(doc, 24, 8)
+    line, col_map = fmt.format_line()
+    # wide and invisible characters and invalid bytes are escaped
+    assert line == 'café \x02u4E2D\x02u200B\x02FF' + '\0' * 4
+    assert list(col_map) == [0, 1, 2, 3, 4, 5, 11, 17, 20]
+
+
+def test_long_lines():
+    text = open('tests/alice1flow.asc').read().replace('\n', ' ')
+    doc = document.Document(text)
+    fmt = formatter.Formatter(doc, 16, 4)
+    fmt.anchor = 64
+
+    # a line without newlines is also cut at every multiple of anchor
+    index = fmt.get_line_index()
+    starts = [index.offset(k) for k in range(len(index))]
+    assert set(range(0, len(text), 64)) <= set(starts)
+    assert fmt.index_long
+
+    # so finding the BoL before the end only looks back a few anchor intervals
+    doc.set_point_end().move_point(-5)
+    n = doc.n_get_char_calls
+    fmt.clamp_to_bol()
+    assert doc.n_get_char_calls - n < 8 * fmt.anchor
+    assert doc.get_point().position() == max(k for k in starts if k <= len(text) - 5)
+
+    # edits rebuild the index rather than repairing it
+    doc.watch(fmt.change_handler)
+    doc.insert('x')
+    assert fmt.line_index is None
+    index = fmt.get_line_index()
+    assert index.offset(len(index) - 1) > starts[-1]
+
+    # but a newline means nothing is anchored
+    doc = document.Document('x' * 60 + '\n' + 'y' * 60)
+    fmt = formatter.Formatter(doc, 16, 4)
+    fmt.anchor = 64
+    index = fmt.get_line_index()
+    assert [index.offset(k) for k in range(len(index))] == [0, 16, 32, 48, 61, 77, 93, 109]
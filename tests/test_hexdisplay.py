@@ -0,0 +1,90 @@
+from ptedit import document, hexdisplay, piece
+from ptedit.display import Screen
+
+
+def test_rows():
+    doc = document.Document('héllo\tworld\n'.encode() * 4)
+    scr = Screen(6, 80)
+    dpy = hexdisplay.HexDisplay(doc, scr)
+    dpy.paint()
+    assert dpy.width == 16
+    assert scr.text(0).rstrip() == '00000000  68 c3 a9 6c 6c 6f 09 77  6f 72 6c 64 0a 68 c3 a9  |h..llo.world.h..|'
+    assert scr.text(3).rstrip() == '00000030  72 6c 64 0a                                       |rld.|'
+    assert scr.text(4).strip() == ''
+    assert scr.text(5).split()[:4] == ['ch', '$68', 'off', '0/34']
+
+    # the marked bytes are highlighted in both columns
+    dpy.paint(doc.get_start().move(2))
+    lit = [col for col, on in enumerate(scr.highlights[0]) if on]
+    assert lit == list(range(dpy.hex_cols[0], dpy.hex_cols[2] + 2)) + dpy.ascii_cols[:3]
+
+    # narrow screens get fewer bytes per row
+    narrow = hexdisplay.HexDisplay(doc, Screen(6, 40))
+    assert narrow.width == 4 and narrow.hex_cols == [10, 13, 16, 19] and narrow.ascii_cols == [24, 25, 26, 27]
+
+
+def test_moves():
+    doc = document.Document('a' * 16 + 'é' * 8 + 'b' * 16 * 100)
+    dpy = hexdisplay.HexDisplay(doc, Screen(11, 80))
+
+    def at() -> int:
+        return doc.byte_position(doc.get_point())
+
+    # moving by rows keeps the column, even if we land inside a character
+    doc.move_point(5)
+    dpy.paint()
+    dpy.move_forward_line()
+    assert at() == 20
+    dpy.paint()
+    assert dpy.scr.cursor == (1, dpy.hex_cols[4])
+    dpy.move_forward_line()
+    assert at() == 37
+    dpy.move_forward_page()
+    assert at() == 37 + 10 * 16
+    dpy.paint()
+    assert dpy.top_row == at() // 16 - dpy.preferred_row
+    dpy.move_backward_page()
+    dpy.move_backward_page()
+    assert at() == 5
+
+    dpy.move_start_line()
+    assert at() == 0
+    dpy.move_backward_line()
+    assert at() == 0
+    dpy.move_end_line()
+    assert at() == 15
+
+    # jumping is by byte offset
+    dpy.move_to_fraction(0.5)
+    assert at() == doc.byte_length() // 2 // 16 * 16
+    dpy.move_to_offset(1 << 40)
+    assert doc.at_end()
+    dpy.paint()
+    assert dpy.status_fields((0, 0))[2] == f'off {at():x}/{at():x}'
+
+
+def test_byte_index(monkeypatch):
+    doc = document.Document('héllo wörld\n' * 1000)
+    for i in range(200):
+        doc.set_point_start().move_point(i * 50).insert('ü')
+    dpy = hexdisplay.HexDisplay(doc, Screen(11, 80))
+    dpy.paint()
+    assert dpy.size == doc.byte_length()
+
+    # once indexed, painting and moving only look at the pieces on screen
+    spans = []
+    byte_span = piece.Piece.byte_span
+    monkeypatch.setattr(piece.Piece, 'byte_span', lambda p: spans.append(p) or byte_span(p))
+    dpy.move_forward_page()
+    dpy.move_forward_line()
+    dpy.paint()
+    assert len(spans) < 20
+    at = dpy.point_byte
+    assert at == doc.byte_position(doc.get_point()) and dpy.get_bytes(at, 40) == doc.get_bytes(at, 40)
+
+    # until a change means indexing them again
+    doc.insert('ß')
+    dpy.paint()
+    assert dpy.size == doc.byte_length() and dpy.point_byte == doc.byte_position(doc.get_point())
+    for b in (0, 1, 2, 1000, at, dpy.size - 1, dpy.size, dpy.size + 5):
+        assert dpy.byte_location(b) == doc.byte_location(b)
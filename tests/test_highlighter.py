@@ -0,0 +1,110 @@
+import random
+
+from ptedit import display, document
+from ptedit.highlighter import ConfigLexer, Highlighter, PythonLexer, Style, highlighter_for
+from ptedit.screen import REVERSE, style_attr
+
+
+def styled(text: str, tokens) -> list[tuple[str, Style]]:
+    return [(text[a:b], style) for a, b, style in tokens]
+
+
+def test_lexers():
+    lexer = PythonLexer()
+    line = 'def f(x=0x1f):  # hex\n'
+    tokens, state = lexer.lex(line, lexer.initial)
+    # plain text isn't a token, though identifiers still match as a whole, so the x1f in f(x1f) isn't a number
+    assert styled(line, tokens) == [('def', Style.KEYWORD), ('0x1f', Style.NUMBER), ('# hex\n', Style.COMMENT)]
+    assert state == 'root'
+
+    # triple-quoted strings carry on to later lines
+    tokens, state = lexer.lex('s = """one\n', 'root')
+    assert state == '"'
+    tokens, state = lexer.lex('two "quoted" \\""" three\n', state)
+    assert state == '"'
+    line = 'end""" if s else 2\n'
+    tokens, state = lexer.lex(line, state)
+    assert state == 'root'
+    assert styled(line, tokens) == [('end"""', Style.STRING), ('if', Style.KEYWORD), ('else', Style.KEYWORD), ('2', Style.NUMBER)]
+
+    lexer = ConfigLexer()
+    for line, expected in [
+        ('[section]\n', [('[section]', Style.KEYWORD)]),
+        ('key = "value" ; not a comment\n', [('key', Style.NAME), ('"value"', Style.STRING)]),
+        ('  # comment\n', [('  # comment\n', Style.COMMENT)]),
+        ('on: true\n', [('on', Style.NAME), ('true', Style.KEYWORD)]),
+    ]:
+        tokens, _ = lexer.lex(line, lexer.initial)
+        assert styled(line, tokens) == expected
+
+    doc = document.Document('')
+    assert isinstance(highlighter_for(doc, 'setup.CFG').lexer, ConfigLexer)
+    assert highlighter_for(doc, 'notes.txt') is None
+
+
+def small(h: Highlighter) -> Highlighter:
+    h.stride, h.budget, h.cache_size = 32, 256, 16
+    return h
+
+
+def test_incremental():
+    # edits re-lex only until the lexer states match what they were before,
+    # always giving the same runs as starting afresh
+    bits = ['def ', 'x = 1\n', '"""', "'", '"', '# c\n', '\n', 'if ', 'abc', '  ', '\\', '0x1f ', 'y' * 40]
+    rnd = random.Random(49)
+    doc = document.Document(''.join(rnd.choice(bits) for _ in range(200)))
+    h = small(Highlighter(doc, PythonLexer()))
+    for _ in range(300):
+        r = rnd.random()
+        if r < 0.5:
+            doc.set_point(doc.get_start().move(rnd.randrange(len(doc) + 1)))
+            doc.insert(rnd.choice(bits))
+        elif r < 0.8 and len(doc):
+            doc.set_point(doc.get_start().move(rnd.randrange(len(doc))))
+            doc.delete(rnd.randrange(1, 6))
+        elif doc.has_undo:
+            doc.undo()
+        a = rnd.randrange(len(doc) + 1)
+        b = min(len(doc), a + rnd.randrange(400))
+        fresh = small(Highlighter(document.Document(doc.get_data()), PythonLexer()))
+        assert h.runs(doc.get_start().move(a), a, b) == fresh.runs(fresh.doc.get_start().move(a), a, b)
+
+    # typing in a big file lexes a line or two, while opening a string lexes until we give up
+    text = 'def f(x):\n    return x + 1\n' * 10_000
+    doc = document.Document(text)
+    h = Highlighter(doc, PythonLexer())
+    h.runs(doc.get_start(), 0, len(doc))
+    # as if we'd painted a screen there
+    mid = len(text) // 2
+    h.runs(doc.get_start().move(mid - 1000), mid - 1000, mid + 1000)
+    doc.set_point_start().move_point(mid)
+    h.n_lexed = 0
+    doc.insert('y = 2\n')
+    assert h.n_lexed < 100
+    assert h.runs(doc.get_point(), doc.get_point().position(), len(doc)) == \
+        Highlighter(document.Document(doc.get_data()), PythonLexer()).runs(doc.get_point(), doc.get_point().position(), len(doc))
+    h.n_lexed = 0
+    doc.insert('"""')
+    assert h.budget < h.n_lexed < h.budget + 2 * h.stride
+    n = h.n_lexed
+    doc.insert('"""')
+    runs = h.runs(doc.get_point(), mid, mid + 1000)
+    assert h.n_lexed - n < h.budget + 2 * h.stride
+    assert runs == Highlighter(document.Document(doc.get_data()), PythonLexer()).runs(doc.get_point(), mid, mid + 1000)
+
+
+def test_display_styles():
+    doc = document.Document('# hello\nif x:\n    y = "hi"\n')
+    dpy = display.Display(doc, display.Screen(24, 20), highlighter=Highlighter(doc, PythonLexer()))
+    dpy.paint()
+    rows = dpy.scr.highlights
+    assert rows[0][:7] == bytes([style_attr(Style.COMMENT)]) * 7
+    assert rows[1][:3] == bytes([style_attr(Style.KEYWORD)] * 2 + [0])
+    assert rows[2][:8] == bytes(8) and rows[2][8:12] == bytes([style_attr(Style.STRING)]) * 4
+
+    # the selection shows reversed over the styles
+    mark = doc.get_start().move(2)
+    doc.set_point_start().move_point(11)
+    dpy.paint(mark)
+    assert rows[0][:3] == bytes([style_attr(Style.COMMENT)] * 2 + [style_attr(Style.COMMENT) | REVERSE])
+    assert rows[1][0] == style_attr(Style.KEYWORD) | REVERSE and rows[1][2] == REVERSE
@@ -0,0 +1,81 @@
+from ptedit import display, loader
+from .random_soak import corpus
+
+
+def write_big(tmp_path, copies: int = 64) -> tuple[str, str]:
+    fname = str(tmp_path / 'big.txt')
+    text = corpus * copies
+    open(fname, 'w', encoding='iso-8859-1').write(text)
+    return fname, text
+
+
+def test_progressive(tmp_path):
+    fname, text = write_big(tmp_path)
+    doc = loader.open_document(fname, progressive=True)
+    assert doc.loading and 0 < len(doc) < len(text)
+
+    # we can paint the first screen straight away
+    scr = display.Screen(24, 80)
+    dpy = display.Display(doc, scr)
+    dpy.paint()
+    assert scr.text(0).startswith('Alice was beginning')
+    assert 'load ' in scr.text(23)
+
+    # appending the rest isn't an edit
+    assert doc.load(wait=True)
+    assert not doc.loading and doc.get_data() == text
+    assert not doc.dirty and not doc.has_undo
+    doc.set_point_end()
+    dpy.paint()
+    assert 'lns ' in scr.text(23)
+
+
+def test_edit_while_loading(tmp_path):
+    fname, text = write_big(tmp_path)
+    doc = loader.open_document(fname, progressive=True)
+    dpy = display.Display(doc, display.Screen(24, 80))
+    dpy.paint()
+    # the first edit waits for the whole file
+    doc.insert('>>')
+    assert not doc.loading and doc.get_data() == '>>' + text
+    doc.undo()
+    assert doc.get_data() == text
+
+
+def test_open_at_line(tmp_path):
+    fname, text = write_big(tmp_path, 4)
+    for progressive in (False, True):
+        doc = loader.open_document(fname, progressive, line=3)
+        pos = doc.get_point().position()
+        assert text[:pos].count('\n') == 3 and text[pos-1] == '\n'
+        doc.load(wait=True)
+    assert loader.line_offset(b'a\nb', 5) == 3
+
+
+def test_long_lines(tmp_path):
+    # a file without enough newlines is only read up to a byte limit past the line we want
+    fname = str(tmp_path / 'long.txt')
+    text = 'x' * (4 << 20) + '\n' + 'y' * (4 << 20)
+    open(fname, 'w').write(text)
+    for line in (0, 1):
+        doc = loader.open_document(fname, progressive=True, line=line)
+        assert doc.loading and len(doc) < (line + 1) * (4 << 20) + (1 << 20)
+        assert doc.get_point().position() == (0 if line == 0 else (4 << 20) + 1)
+        doc.load(wait=True)
+        assert doc.get_data() == text
+
+
+def test_utf8_chunks(tmp_path):
+    assert loader.char_boundary(b'ab') == 2
+    assert loader.char_boundary('a中'.encode()[:-1]) == 1
+    assert loader.char_boundary('a😀'.encode()) == 5
+    assert loader.char_boundary(b'a\xff') == 2
+
+    # a file that's cut mid-character by the first read
+    fname = str(tmp_path / 'utf8.txt')
+    text = 'x' + '中文\n' * 40000
+    open(fname, 'w', encoding='utf-8').write(text)
+    doc = loader.open_document(fname, progressive=True)
+    assert doc.loading
+    doc.load(wait=True)
+    assert doc.get_data() == text
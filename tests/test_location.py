@@ -2,6 +2,7 @@ import pytest
 from ptedit import document
 from ptedit.location import Location
 from ptedit.piece import PrimaryPiece
+from .random_soak import random_soak, corpus, apply_actions
 
 doc = document.Document('the quick brown fox')
 doc.set_point_start().move_point(4)
@@ -45,6 +46,41 @@ def test_ordering():
     assert p2.distance_before(p15) == 13
     assert p15.distance_after(p0) == 15
     assert p15.distance_before(p18) == 3
+    assert p15.distance_before(p2) is None and p2.distance_after(p15) is None
+
+
+def test_labels():
+    doc = document.Document(corpus[:1024])
+    actions = random_soak(2048, 7)
+    for i in range(0, len(actions), 16):
+        apply_actions(doc, actions[i:i+16])
+        if i % 48 == 0:
+            doc.undo()
+        elif i % 48 == 16:
+            doc.redo()
+
+    # the live chain is labelled in increasing order
+    p = doc.get_start().piece.prev
+    assert p is not None
+    locs: list[Location] = []
+    while p.next is not None:
+        assert p.live and p.label < p.next.label
+        locs.append(Location(p))
+        p = p.next
+    assert p.live
+
+    # and ordering via labels agrees with the walk
+    for a in locs[::7]:
+        for b in locs[::5]:
+            walk = Location.distance_before(a, b)
+            assert a.is_at_or_before(b) == (a == b or (walk is not None and walk >= 0))
+            assert a.is_strictly_before(b) == (a.piece.label < b.piece.label)
+
+    # pieces swapped out by the last edit are no longer live
+    doc.set_point_start().move_point(100)
+    old = doc.get_point()
+    doc.insert('x')
+    assert not old.piece.live
 
 
 @pytest.mark.parametrize("offset", [
@@ -84,3 +120,9 @@ def test_find_char_backward():
     assert not doc.find_char_backward('f')
     assert doc.get_char() == 't'  # failed
     assert doc.at_start()
+    # a limited search stops where it gave up
+    doc.set_point_end()
+    assert not doc.find_char_backward('f', 2)
+    assert doc.get_point().position() == 16
+    assert doc.find_char_backward('f', 3)
+    assert doc.get_point().position() == 16
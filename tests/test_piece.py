@@ -1,3 +1,5 @@
+import random
+
 from ptedit import piece
 
 
@@ -17,3 +19,44 @@ def test_secondary():
     assert p.data == 'oba'
     p.trim(1).trim(-1)
     assert p.data == 'b'
+
+
+def test_source(monkeypatch):
+    monkeypatch.setattr(piece.SourcePiece, 'block_size', 8)
+    text = 'naïve café 中文 😀 ' * 4 + b'\xff\x80'.decode('utf-8', 'surrogateescape')
+    raw = text.encode('utf-8', 'surrogateescape')
+    p = piece.SourcePiece(raw=raw)
+    assert not p.ascii and len(p) == len(text) and p.data == text
+    for i in range(0, len(text), 3):
+        assert p.slice(i, i + 7) == text[i:i + 7]
+        assert p.encode_slice(i, i + 7) == text[i:i + 7].encode('utf-8', 'surrogateescape')
+
+    # secondary pieces encode straight from the raw source
+    q = piece.SecondaryPiece(source=p, start=6, length=7)
+    assert q.data == 'café 中文' and q.encode() == 'café 中文'.encode()
+
+    a = piece.SourcePiece(raw=b'plain')
+    assert a.ascii and a.slice(1, 3) == 'la' and a.encode_slice(1, 3) == b'la'
+
+
+def test_source_newlines(monkeypatch):
+    monkeypatch.setattr(piece.SourcePiece, 'block_size', 8)
+    for text in ['ab\ncd\n\nefghijklmn\nop\n', 'naïve\ncafé 中文\n\n😀 x\n' + b'\xff\n\x80'.decode('utf-8', 'surrogateescape')]:
+        p = piece.SourcePiece(raw=text.encode('utf-8', 'surrogateescape'))
+        for i in range(len(text)):
+            for j in range(i, len(text) + 1):
+                assert p.count_newlines(i, j) == text[i:j].count('\n')
+        q = piece.SecondaryPiece(source=p, start=3, length=len(text) - 5)
+        assert q.newlines() == q.data.count('\n')
+
+
+def test_source_count():
+    # code points counted from bytes agree with decoding, valid utf-8 or not
+    rnd = random.Random(37)
+    bits = ['a', 'é', '中', '😀', '\n'] + [bytes([b]).decode('utf-8', 'surrogateescape') for b in (0x80, 0xbf, 0xc0, 0xed, 0xf4, 0xff)]
+    for _ in range(500):
+        text = ''.join(rnd.choice(bits) for _ in range(rnd.randrange(1, 60)))
+        raw = text.encode('utf-8', 'surrogateescape')
+        assert piece.SourcePiece._count(raw) == len(raw.decode('utf-8', 'surrogateescape'))
+    for raw in [b'\xe0\xa0\x80', b'\xed\xa0\x80', b'\xf0\x90\x80\x80', b'\xc3\xa9\xa9', b'\xa9\xc3\xa9', b'\xe4\xb8']:
+        assert piece.SourcePiece._count(raw) == len(raw.decode('utf-8', 'surrogateescape'))
@@ -0,0 +1,102 @@
+import errno
+import os
+
+from ptedit import loader, saver
+from .random_soak import corpus
+
+
+def open_big(tmp_path, text: str) -> tuple[str, saver.Saver]:
+    fname = str(tmp_path / 'big.txt')
+    open(fname, 'wb').write(text.encode())
+    return fname, saver.Saver(fname)
+
+
+def test_save_tail(tmp_path):
+    text = corpus * 16 + 'naïve café\n'
+    fname, s = open_big(tmp_path, text)
+    doc = loader.open_document(fname, progressive=True)
+    doc.load(wait=True)
+    assert doc.source_prefix() == len(text.encode())
+    inode = os.stat(fname).st_ino
+
+    # appending, or editing near the end, only rewrites the tail
+    doc.set_point_end().insert('more\n')
+    assert s.save(doc)
+    assert open(fname, 'rb').read() == (text + 'more\n').encode()
+    doc.move_point(-8).delete(3)
+    assert s.save(doc)
+    doc.set_point_end().delete(-3)
+    assert s.save(doc)
+    expected = text[:-3] + 'mo'
+    assert doc.get_data() == expected and open(fname, 'rb').read() == expected.encode()
+    assert os.stat(fname).st_ino == inode
+
+    # an edit at the start means rewriting everything, replacing the file
+    doc.set_point_start().insert('>')
+    assert not s.save(doc)
+    assert open(fname, 'rb').read() == ('>' + expected).encode()
+    assert os.stat(fname).st_ino != inode
+    assert os.listdir(tmp_path) == ['big.txt']
+    # undoing it matches the source again, but not the file until we've rewritten it once more
+    doc.undo()
+    assert not s.save(doc)
+    doc.set_point_end().insert('\n')
+    assert s.save(doc)
+    assert open(fname, 'rb').read() == (expected + '\n').encode()
+
+
+def test_save_unsafe(tmp_path):
+    text = corpus * 4
+    fname, s = open_big(tmp_path, text)
+    doc = loader.open_document(fname)
+    doc.set_point_end().insert('!')
+
+    # if someone else wrote the file we don't trust it
+    open(fname, 'a').write('theirs')
+    assert not s.save(doc)
+    assert open(fname).read() == text + '!'
+
+    # nor rewrite a long tail in place
+    s.max_tail = 100
+    doc.move_point(-200).insert('?')
+    assert not s.save(doc)
+    assert open(fname).read() == text[:-199] + '?' + text[-199:] + '!'
+
+
+def test_copy_source(tmp_path, monkeypatch):
+    text = corpus * 16
+    fname, s = open_big(tmp_path, text)
+    doc = loader.open_document(fname, progressive=True)
+    copied = []
+    copy_range = saver.copy_range
+    monkeypatch.setattr(saver, 'copy_range', lambda *args: copied.append(args[2:]) or copy_range(*args))
+
+    # unchanged source is copied from the original file, even once we've replaced it
+    for expected in ('>' + text, '>>' + text):
+        doc.set_point_start().insert('>')
+        assert not s.save(doc)
+        assert open(fname).read() == expected
+        assert sum(n for _, n in copied) == len(text)
+        copied.clear()
+
+    # falling back when the kernel can't copy between these files
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, 'cross-device')
+
+    monkeypatch.setattr(saver, '_copy_file_range', unsupported)
+    doc.move_point(1000).delete(1)
+    assert not s.save(doc)
+    monkeypatch.setattr(saver, '_sendfile', unsupported)
+    doc.insert('?')
+    assert not s.save(doc)
+    expected = '>>' + text[:999] + '?' + text[1000:]
+    assert open(fname).read() == expected and copied
+
+    # but we don't copy from the original once someone else has changed it
+    fname, s = open_big(tmp_path, text)
+    doc = loader.open_document(fname)
+    copied.clear()
+    open(fname, 'r+b').write(b'X')
+    doc.set_point_start().delete(1)
+    assert not s.save(doc)
+    assert open(fname).read() == text[1:] and not copied
@@ -0,0 +1,62 @@
+import curses
+import json
+
+import pytest
+
+from ptedit import session
+from ptedit.controller import ctrl
+from .test_display import ALICE_NL
+
+
+def test_replay(tmp_path):
+    fname = str(tmp_path / 'alice.txt')
+    open(fname, 'w').write(ALICE_NL)
+    trace = str(tmp_path / 'trace.jsonl')
+
+    keys: list[int | str] = [
+        *[curses.KEY_DOWN] * 5, ctrl('S'), ord('A'), ord('l'), ctrl('['),
+        ord('x'), 'é', ctrl('['), ord('m'), ctrl('['), ord('f'), ctrl('['), ord('x'),
+        ctrl('['), ord('5'), ctrl('['), ord('q'), ord('y'),
+    ]
+    recorder = session.Recorder(trace, fname, 24, 80)
+    for key in keys:
+        recorder.record(key)
+    recorder.close()
+
+    t = session.read_trace(trace)
+    assert t.fname == 'alice.txt' and (t.rows, t.cols) == (24, 80)
+    assert t.keys == keys and t.times == sorted(t.times)
+
+    results = session.replay(trace, fname)
+    assert {name: r['n'] for name, r in results.items()} == {
+        'move_forward_line': 5, 'isearch_forward': 1, 'isearch_insert': 2, 'isearch_cancel': 1,
+        'insert': 2, 'meta': 5, 'set_mark': 1, 'move_forward_para': 1, 'cut': 1, 'move_to_fraction': 1, 'quit': 1,
+    }
+    r = results['move_forward_line']
+    assert 0 < r['p50'] <= r['p95'] <= r['p99']
+    # the replay edits a copy, and stops when we quit
+    assert open(fname).read() == ALICE_NL
+    assert 'move_forward_line' in session.report(results)
+
+    open(fname, 'a').write('more')
+    with pytest.raises(ValueError, match="doesn't match"):
+        session.replay(trace, fname)
+
+
+def test_percentiles():
+    results = session.summarize({'a': [i / 1000 for i in range(100, 0, -1)]})
+    assert results == {'a': dict(n=100, p50=50, p95=95, p99=99)}
+    assert session.summarize({'b': [0.002]})['b']['p99'] == 2
+
+
+def test_compare():
+    old = {'a': dict(n=10, p50=2.0, p95=4.0, p99=8.0), 'b': dict(n=1, p50=0.1, p95=0.1, p99=0.1)}
+    assert session.compare(old, old) == []
+    # small changes, and percentiles with too few samples, are ignored
+    new = json.loads(json.dumps(old))
+    new['a'].update(p50=2.4, p95=40.0, p99=80.0)
+    new['b'].update(p50=0.9, p95=0.9, p99=0.9)
+    assert session.compare(new, old) == []
+    new['a'].update(p50=3.2)
+    new['c'] = dict(n=1, p50=100, p95=100, p99=100)
+    assert session.compare(new, old) == ['a p50 2 -> 3.2ms']
@@ -0,0 +1,42 @@
+import pytest
+
+from ptedit import display, document, tracing
+from .random_soak import corpus
+
+
+def test_tracing():
+    doc = document.Document(corpus)
+    dpy = display.Display(doc, display.Screen(24, 80))
+    tracing.reset()
+
+    # nothing is recorded while disabled
+    dpy.paint()
+    assert not any(c.counters or c.timers for c in tracing.categories.values())
+    assert tracing.summary() == ''
+
+    tracing.enable('paint,lines')
+    try:
+        dpy.paint()
+        dpy.move_forward_page()
+        dpy.paint()
+        assert tracing.paint.counters['frames'] == 2
+        assert tracing.paint.counters['chars'] > 0
+        assert set(tracing.paint.timers) == {'find_top', 'format', 'refresh'}
+        assert tracing.lines.counters['formatted'] > 0 and tracing.lines.counters['cache_hits'] > 0
+        assert not tracing.walk.counters
+        assert tracing.summary().splitlines()[0].startswith('paint: chars=')
+
+        tracing.enable('all')
+        doc.move_point(-10)
+        dpy.paint()
+        assert tracing.walk.counters['pieces'] > 0
+    finally:
+        tracing.enable('all', False)
+        tracing.reset()
+
+
+def test_unknown_category():
+    # nothing is enabled if any name is wrong
+    with pytest.raises(ValueError, match='unknown trace categories bogus, expected all,paint,'):
+        tracing.enable('paint,bogus')
+    assert not tracing.paint.enabled
@@ -26,3 +26,66 @@ def test_undo():
 
     assert len(doc) == 18
     assert str(doc) == '|the |fast|^ brown fox|'
+
+
+def test_undo_to():
+    doc = document.Document('the quick brown fox')
+    changes = []
+    doc.watch(lambda start, end: changes.append((start.position(), end.position())))
+    doc.move_point(4).insert('very ')
+    doc.set_point_end().insert(' jumps')
+    doc.set_point_start().delete(4)
+    assert doc.get_data() == 'very quick brown fox jumps' and doc.edit_index == 3
+
+    # several edits undo and redo as one change spanning them all
+    changes.clear()
+    doc.undo_to(1)
+    assert doc.get_data() == 'the very quick brown fox'
+    assert doc.edit_index == 1 and doc.get_point().position() == 24
+    assert changes == [(0, 24)]
+    doc.redo_to(5)
+    assert doc.get_data() == 'very quick brown fox jumps'
+    assert doc.edit_index == 3 and doc.get_point().position() == 0
+    assert changes == [(0, 24), (0, 26)]
+    doc.undo_to(0)
+    assert doc.get_data() == 'the quick brown fox'
+
+    # typing after an undo starts a new edit rather than merging, dropping what we undid
+    doc.set_point_start().move_point(4).insert('very ')
+    doc.set_point_end().insert(' jumps')
+    doc.undo()
+    doc.set_point_start().move_point(9).insert('!')
+    assert doc.get_data() == 'the very !quick brown fox' and doc.edit_index == 2
+    doc.redo_to(5)
+    assert doc.get_data() == 'the very !quick brown fox' and doc.edit_index == 2
+    doc.undo()
+    assert doc.get_data() == 'the very quick brown fox'
+    doc.undo()
+    assert doc.get_data() == 'the quick brown fox'
+
+
+def test_revert():
+    doc = document.Document('the quick brown fox')
+    doc.move_point(4).insert('very ')
+    doc.mark_saved()
+    assert not doc.dirty
+
+    # typing after a save starts a new edit, so the saved state survives
+    doc.insert('very ')
+    doc.set_point_end().delete(-4)
+    assert doc.dirty and doc.edit_index == 3
+    assert doc.revert_to_saved()
+    assert doc.get_data() == 'the very quick brown fox' and not doc.dirty
+
+    doc.undo()
+    assert doc.dirty
+    doc.redo()
+    assert not doc.dirty
+    doc.undo_to(0)
+    assert doc.revert_to_saved() and not doc.dirty and doc.edit_index == 1
+
+    # once we undo past the save and edit, it's gone
+    doc.undo()
+    doc.insert('a ')
+    assert not doc.revert_to_saved()
+    assert doc.get_data() == 'the a quick brown fox'